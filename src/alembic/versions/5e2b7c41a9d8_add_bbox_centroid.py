@@ -0,0 +1,43 @@
+"""Add bbox and centroid columns to bag tables
+
+Revision ID: 5e2b7c41a9d8
+Revises: d0f806dcb3f0
+Create Date: 2026-10-19 13:47:05.218934
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b7c41a9d8'
+down_revision = 'd0f806dcb3f0'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+
+def upgrade():
+    # Bounding box and centroid of the geometry of the object, for spatial filters without parsing the object.
+    # The hash is cleared to have these columns filled for all objects on the next full import.
+    for table_name in TABLES:
+        op.execute(f"ALTER TABLE {table_name} ADD COLUMN bbox box, ADD COLUMN centroid point")
+        op.execute(f"UPDATE {table_name} SET hash = NULL")
+        op.create_index(op.f(f'ix_{table_name}_bbox'), table_name, ['bbox'], postgresql_using='gist')
+        op.create_index(op.f(f'ix_{table_name}_centroid'), table_name, ['centroid'], postgresql_using='gist')
+
+
+def downgrade():
+    for table_name in TABLES:
+        op.drop_index(op.f(f'ix_{table_name}_centroid'), table_name=table_name)
+        op.drop_index(op.f(f'ix_{table_name}_bbox'), table_name=table_name)
+        op.drop_column(table_name, 'centroid')
+        op.drop_column(table_name, 'bbox')
@@ -0,0 +1,47 @@
+"""Store the object column of the bag tables as JSONB
+
+Revision ID: a3c91e5f27b4
+Revises: 5e2b7c41a9d8
+Create Date: 2026-10-19 15:02:44.613702
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c91e5f27b4'
+down_revision = '5e2b7c41a9d8'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+
+def upgrade():
+    # JSONB is parsed once on write instead of on every read, and its attributes can be indexed.
+    # The expression indexes on the object are declared per collection, see attribute_indexes in gobbagextract/data.
+    for table_name in TABLES:
+        op.execute(f"ALTER TABLE {table_name} ALTER COLUMN object TYPE jsonb USING object::jsonb")
+
+
+def downgrade():
+    connection = op.get_bind()
+    for table_name in TABLES:
+        # The attribute indexes are created by the import, see PostgresDatastoreExt.ensure_attribute_indexes
+        indexes = connection.execute(
+            sa.text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"),
+            {"table": table_name}
+        )
+        for index_name, in indexes.fetchall():
+            if index_name.startswith(f"ix_{table_name}_attr_"):
+                op.drop_index(index_name, table_name=table_name)
+        op.execute(f"ALTER TABLE {table_name} ALTER COLUMN object TYPE json USING object::json")
@@ -0,0 +1,68 @@
+"""Add key dictionary for compact objects
+
+Revision ID: b6d1f4a8e290
+Revises: f3b8d2a6c047
+Create Date: 2026-10-19 21:32:48.501736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4a8e290'
+down_revision = 'f3b8d2a6c047'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+
+def upgrade():
+    # The codes of the keys of the objects in each table, see BAGEXTRACT_COMPACT_OBJECTS. A compact object is stored
+    # as {"<code>": value, ...}, codes are only added.
+    op.create_table(
+        'bag_object_keys',
+        sa.Column('code', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('code'),
+        sa.UniqueConstraint('table_name', 'key')
+    )
+
+    # Returns the object of a row in table_name with its keys, for example:
+    # SELECT bag_expand_object('bag_panden', object) FROM bag_panden_current WHERE object_id = '0457100000000001'
+    # Keys without a code are returned as they are, the objects that are not stored compact are not changed.
+    op.execute(r"""
+CREATE FUNCTION bag_expand_object(table_name varchar, object jsonb)
+RETURNS jsonb AS $$
+    SELECT CASE WHEN object IS NULL THEN NULL ELSE coalesce((
+        SELECT jsonb_object_agg(coalesce(k.key, o.key), o.value)
+        FROM jsonb_each(object) o
+        LEFT JOIN bag_object_keys k
+        ON k.code = CASE WHEN o.key ~ '^\d{1,9}$' THEN o.key::integer END
+        AND k.table_name = bag_expand_object.table_name
+    ), '{}'::jsonb) END
+$$ LANGUAGE sql STABLE
+""")
+
+    # The rows of each table with their objects expanded, in the same shape as the table
+    for table_name in TABLES:
+        op.execute(f"CREATE VIEW {table_name}_expanded AS "
+                   f"SELECT id, gemeente, object_id, last_update, "
+                   f"bag_expand_object('{table_name}', object) AS object, hash, bbox, centroid FROM {table_name}")
+
+
+def downgrade():
+    for table_name in TABLES:
+        op.execute(f"DROP VIEW {table_name}_expanded")
+    op.execute("DROP FUNCTION bag_expand_object(varchar, jsonb)")
+    op.drop_table('bag_object_keys')
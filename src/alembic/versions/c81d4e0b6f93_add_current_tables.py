@@ -0,0 +1,61 @@
+"""Add tables with the current voorkomen of each object
+
+Revision ID: c81d4e0b6f93
+Revises: a3c91e5f27b4
+Create Date: 2026-10-19 17:21:08.350961
+
+"""
+from alembic import op
+
+from gobbagextract.datastore.predicate import current_condition
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81d4e0b6f93'
+down_revision = 'a3c91e5f27b4'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+# The current voorkomens on the day of the migration, as PostgresDatastoreExt selects them
+CURRENT_CONDITION = current_condition("object", "to_char(CURRENT_DATE, 'YYYY-MM-DD')")
+
+
+def upgrade():
+    # The current voorkomen of each object, kept in sync with the bag table by PostgresDatastoreExt
+    for table_name in TABLES:
+        # The identificatie is the object_id without the volgnummer
+        op.execute(f"CREATE INDEX ix_{table_name}_identificatie ON {table_name} (split_part(object_id, '.', 1))")
+
+        current = f"{table_name}_current"
+        op.execute(f"CREATE TABLE {current} ("
+                   f"identificatie varchar PRIMARY KEY, "
+                   f"object_id varchar NOT NULL, "
+                   f"gemeente varchar NOT NULL, "
+                   f"last_update date NOT NULL, "
+                   f"object jsonb, "
+                   f"hash varchar(32), "
+                   f"bbox box, "
+                   f"centroid point)")
+        op.create_index(op.f(f'ix_{current}_gemeente'), current, ['gemeente', 'identificatie'])
+        op.execute(f"INSERT INTO {current} "
+                   f"SELECT DISTINCT ON (split_part(object_id, '.', 1)) split_part(object_id, '.', 1), "
+                   f"object_id, gemeente, last_update, object, hash, bbox, centroid FROM {table_name} "
+                   f"WHERE {CURRENT_CONDITION} "
+                   f"ORDER BY split_part(object_id, '.', 1), "
+                   f"NULLIF(split_part(object_id, '.', 2), '')::integer DESC NULLS LAST")
+
+
+def downgrade():
+    for table_name in TABLES:
+        op.drop_table(f"{table_name}_current")
+        op.drop_index(op.f(f'ix_{table_name}_identificatie'), table_name=table_name)
@@ -0,0 +1,38 @@
+"""Add hash column to bag tables
+
+Revision ID: d0f806dcb3f0
+Revises: 4852c4ff9ead
+Create Date: 2026-10-19 09:12:31.482113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd0f806dcb3f0'
+down_revision = '4852c4ff9ead'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+
+def upgrade():
+    # Hash of the object, rows are only updated when the hash changes.
+    # Existing rows have no hash and are updated once.
+    for table_name in TABLES:
+        op.add_column(table_name, sa.Column('hash', sa.String(32), nullable=True))
+
+
+def downgrade():
+    for table_name in TABLES:
+        op.drop_column(table_name, 'hash')
@@ -0,0 +1,54 @@
+"""Add the dates of the refreshes of the current tables
+
+Revision ID: d7e3a9b2c415
+Revises: b6d1f4a8e290
+Create Date: 2026-10-19 23:12:40.517304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from gobbagextract.datastore.predicate import BEGIN_GELDIGHEID_KEY, EIND_GELDIGHEID_KEY
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3a9b2c415'
+down_revision = 'b6d1f4a8e290'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+
+def upgrade():
+    # The date up to which the current voorkomens of each table and gemeente are up to date, a refresh only updates
+    # the objects with a voorkomen that has begun or ended since, see PostgresDatastoreExt.refresh_current
+    op.create_table(
+        'bag_current_refreshes',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('gemeente', sa.String(), nullable=False),
+        sa.Column('refreshed', sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name', 'gemeente')
+    )
+
+    # The expressions of predicate.changed_condition
+    for table_name in TABLES:
+        op.execute(f"CREATE INDEX ix_{table_name}_begin_geldigheid ON {table_name} "
+                   f"((left(object->>'{BEGIN_GELDIGHEID_KEY}', 10)))")
+        op.execute(f"CREATE INDEX ix_{table_name}_eind_geldigheid ON {table_name} "
+                   f"((object->>'{EIND_GELDIGHEID_KEY}'))")
+
+
+def downgrade():
+    for table_name in TABLES:
+        op.drop_index(f'ix_{table_name}_eind_geldigheid', table_name=table_name)
+        op.drop_index(f'ix_{table_name}_begin_geldigheid', table_name=table_name)
+    op.drop_table('bag_current_refreshes')
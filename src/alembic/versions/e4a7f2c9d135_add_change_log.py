@@ -0,0 +1,52 @@
+"""Add change log of the objects written by each import
+
+Revision ID: e4a7f2c9d135
+Revises: c81d4e0b6f93
+Create Date: 2026-10-19 18:40:12.902447
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7f2c9d135'
+down_revision = 'c81d4e0b6f93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The object_ids that each import (mutation_import.id) inserted, updated, left unchanged or deleted per table.
+    # There is no foreign key, the mutation import is committed after the rows are written.
+    op.create_table(
+        'bag_change_log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('mutation_import_id', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('change', sa.String(), nullable=False),
+        sa.Column('object_ids', postgresql.ARRAY(sa.String()), nullable=False),
+        sa.Column('logged_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_bag_change_log_mutation_import_id_table_name'), 'bag_change_log',
+                    ['mutation_import_id', 'table_name'])
+    op.create_index(op.f('ix_bag_change_log_logged_at'), 'bag_change_log', ['logged_at'])
+
+    # Returns the changes of an import on a table, for example:
+    # SELECT object_id FROM bag_changes(123, 'bag_panden') WHERE change IN ('inserted', 'updated')
+    op.execute("""
+CREATE FUNCTION bag_changes(import_id integer, table_name varchar)
+RETURNS TABLE (change varchar, object_id varchar) AS $$
+    SELECT l.change, unnest(l.object_ids) FROM bag_change_log l
+    WHERE l.mutation_import_id = import_id AND l.table_name = bag_changes.table_name
+$$ LANGUAGE sql STABLE
+""")
+
+
+def downgrade():
+    op.execute("DROP FUNCTION bag_changes(integer, varchar)")
+    op.drop_index(op.f('ix_bag_change_log_logged_at'), table_name='bag_change_log')
+    op.drop_index(op.f('ix_bag_change_log_mutation_import_id_table_name'), table_name='bag_change_log')
+    op.drop_table('bag_change_log')
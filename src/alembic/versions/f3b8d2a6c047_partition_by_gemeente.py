@@ -0,0 +1,98 @@
+"""Partition the bag tables by gemeente
+
+Revision ID: f3b8d2a6c047
+Revises: e4a7f2c9d135
+Create Date: 2026-10-19 20:05:37.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d2a6c047'
+down_revision = 'e4a7f2c9d135'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'bag_ligplaatsen',
+    'bag_nummeraanduidingen',
+    'bag_openbareruimtes',
+    'bag_panden',
+    'bag_standplaatsen',
+    'bag_verblijfsobjecten',
+    'bag_woonplaatsen',
+)
+
+COLUMNS = "id,gemeente,object_id,last_update,object,hash,bbox,centroid"
+COLUMNS_DEF = "gemeente varchar NOT NULL, object_id varchar NOT NULL, last_update date NOT NULL, object jsonb, " \
+              "hash varchar(32), bbox box, centroid point"
+
+
+def _drop_indexes(table_name: str):
+    """Drops the constraints and indexes of table_name, to reuse their names. The attribute indexes are recreated
+    by the import, see PostgresDatastoreExt.ensure_attribute_indexes."""
+    connection = op.get_bind()
+    constraints = connection.execute(
+        sa.text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype IN ('p', 'u')"),
+        {"table": table_name}
+    ).fetchall()
+    for constraint_name, in constraints:
+        op.execute(f"ALTER TABLE {table_name} DROP CONSTRAINT {constraint_name}")
+
+    indexes = connection.execute(
+        sa.text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"),
+        {"table": table_name}
+    ).fetchall()
+    for index_name, in indexes:
+        op.execute(f"DROP INDEX {index_name}")
+
+
+def _create_indexes(table_name: str, unique: list[str]):
+    op.create_index(op.f(f'ix_{table_name}_object_id'), table_name, unique, unique=True)
+    op.create_index(op.f(f'ix_{table_name}_gemeente_last_update'), table_name, ['gemeente', 'last_update'])
+    op.create_index(op.f(f'ix_{table_name}_bbox'), table_name, ['bbox'], postgresql_using='gist')
+    op.create_index(op.f(f'ix_{table_name}_centroid'), table_name, ['centroid'], postgresql_using='gist')
+    op.execute(f"CREATE INDEX ix_{table_name}_identificatie ON {table_name} (split_part(object_id, '.', 1))")
+
+
+def _replace_table(table_name: str, create: str):
+    """Replaces table_name with the table that create creates, with the same rows and id sequence."""
+    connection = op.get_bind()
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                                  {"table": table_name}).scalar()
+
+    op.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_old")
+    _drop_indexes(f"{table_name}_old")
+    op.execute(create.format(table=table_name, sequence=sequence))
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table_name}.id")
+
+
+def upgrade():
+    # A full import reloads the partition of its gemeente, the rows of other gemeentes are not touched.
+    # The import creates the partition for a new gemeente, see PostgresDatastoreExt.ensure_partition.
+    connection = op.get_bind()
+    for table_name in TABLES:
+        _replace_table(table_name, f"CREATE TABLE {{table}} (id integer NOT NULL DEFAULT nextval('{{sequence}}'), "
+                                   f"{COLUMNS_DEF}, PRIMARY KEY (id, gemeente)) PARTITION BY LIST (gemeente)")
+
+        gemeentes = connection.execute(sa.text(f"SELECT DISTINCT gemeente FROM {table_name}_old")).fetchall()
+        for gemeente, in gemeentes:
+            op.execute(f"CREATE TABLE {table_name}_{gemeente} PARTITION OF {table_name} FOR VALUES IN ('{gemeente}')")
+
+        op.execute(f"INSERT INTO {table_name} ({COLUMNS}) SELECT {COLUMNS} FROM {table_name}_old")
+        op.drop_table(f"{table_name}_old")
+
+        # Unique indexes on a partitioned table include the partition key
+        _create_indexes(table_name, ['object_id', 'gemeente'])
+
+
+def downgrade():
+    for table_name in TABLES:
+        _replace_table(table_name, f"CREATE TABLE {{table}} (id integer NOT NULL DEFAULT nextval('{{sequence}}'), "
+                                   f"{COLUMNS_DEF}, PRIMARY KEY (id))")
+        op.execute(f"INSERT INTO {table_name} ({COLUMNS}) SELECT {COLUMNS} FROM {table_name}_old")
+        # Drops the partitions as well
+        op.drop_table(f"{table_name}_old")
+        _create_indexes(table_name, ['object_id'])
@@ -3,13 +3,15 @@ from typing import Dict, Any
 
 import sys
 
-from gobbagextract.config import BAGEXTRACT_NOT_AVAIL_DAYS_ERROR, BAGEXTRACT_NOT_AVAIL_DAYS_WARNING
+from gobbagextract.config import BAGEXTRACT_NOT_AVAIL_DAYS_ERROR, BAGEXTRACT_NOT_AVAIL_DAYS_WARNING, \
+    BAGEXTRACT_NOTIFY_CHANNEL
 from gobbagextract.database.connection import connect
 from gobbagextract.database.repository import MutationImportRepository, MutationImport
 from gobbagextract.database.session import DatabaseSession
 from gobbagextract.extract_config.extract_config import get_extract_definition
 from gobbagextract.mutations.exception import NothingToDo
 from gobbagextract.mutations.handler import MutationsHandler
+from gobbagextract.prepare.prefetch import Prefetcher
 from gobbagextract.prepare.prepare_client import PrepareClient
 from gobcore.enum import ImportMode
 from gobcore.exceptions import GOBException
@@ -31,13 +33,35 @@ def _log_no_more_left(last_import: MutationImport):
             logger.warning(f"No mutation available, last mutation was {interval} ago")
 
 
-def _handle_mutation_import(msg: dict, dataset: dict, mutations_handler: MutationsHandler) -> [str, bool]:
+def _notify_import(repo: MutationImportRepository, mutation_import: MutationImport, summary: dict):
+    """Publishes that mutation_import is finished, with its row counts.
+
+    Listeners can start processing the import without waiting for the result message, which is only sent when
+    all available mutations have been imported.
+    """
+    if not BAGEXTRACT_NOTIFY_CHANNEL:
+        return
+
+    repo.notify(BAGEXTRACT_NOTIFY_CHANNEL, {
+        "event": "import",
+        "table": f"{mutation_import.catalogue}_{mutation_import.collection}",
+        "mutation_import_id": mutation_import.id,
+        "filename": mutation_import.filename,
+        "mode": mutation_import.mode,
+    } | {key: summary.get(key, 0) for key in ("num_records", "inserted", "updated", "unchanged")})
+
+
+def _handle_mutation_import(msg: dict, dataset: dict, mutations_handler: MutationsHandler,
+                            prefetcher: Prefetcher = None) -> [str, bool]:
     """The dataset source is marked as a mutations import. Let the MutationsHandler decide what to import and
     which mode to use.
 
     MutationsHandler returns a new MutationsImport object and the updated dataset configuration to use for this
     import
 
+    When a prefetcher is given, the prefetched file is used if it matches this import, and the next file is
+    prefetched while this import is running.
+
     returns: Message with summary  and bool if more mutations are available
     """
     logger.info("Have mutations import. Determine next step")
@@ -62,13 +86,20 @@ def _handle_mutation_import(msg: dict, dataset: dict, mutations_handler: Mutatio
         dataset = updated_dataset
         mode = ImportMode(mutation_import.mode)
 
-        prepare_client = PrepareClient(msg, dataset, mode, mutation_date)
+        data_src = None
+        if prefetcher:
+            data_src = prefetcher.get(mutation_import)
+            prefetcher.start(mutation_import)
+
+        prepare_client = PrepareClient(msg, dataset, mode, mutation_date, data_src=data_src,
+                                       mutation_import_id=mutation_import.id)
 
         msg = prepare_client.import_dataset()
         mutation_import.ended_at = datetime.datetime.utcnow()
 
         repo.save(mutation_import)
         logger.info("Mutation import ended. Saving state in database")
+        _notify_import(repo, mutation_import, msg.get("summary", {}))
 
         next_mutations = mutations_handler.have_next(mutation_import)
     return msg, next_mutations
@@ -103,10 +134,11 @@ def handle_bag_extract_message(msg: dict) -> dict:
     }
     mutations_handler = MutationsHandler(dataset)
     next_mutation = True
-    while next_mutation:
-        msg, next_mutation = _handle_mutation_import(msg, dataset, mutations_handler)
-        if next_mutation:
-            logger.info("Next mutation is available, keep processing")
+    with Prefetcher(mutations_handler) as prefetcher:
+        while next_mutation:
+            msg, next_mutation = _handle_mutation_import(msg, dataset, mutations_handler, prefetcher)
+            if next_mutation:
+                logger.info("Next mutation is available, keep processing")
     logger.info("This was the last file to be exctracted for now.")
     return msg
 
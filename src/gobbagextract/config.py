@@ -25,6 +25,64 @@ DATABASE_CONFIG = {
 BAGEXTRACT_NOT_AVAIL_DAYS_WARNING = os.getenv("BAGEXTRACT_NOT_AVAIL_DAYS_WARNING", 2)
 BAGEXTRACT_NOT_AVAIL_DAYS_ERROR = os.getenv("BAGEXTRACT_NOT_AVAIL_DAYS_ERROR", 5)
 
+# Relative costs of a daily mutation import and a full import, used to decide whether to replay the mutation backlog
+# or to skip ahead to the newest full extract. Skipping ahead is done when it saves at least
+# BAGEXTRACT_SKIP_AHEAD_MIN_SAVING (in the same cost units) compared to replaying the backlog.
+BAGEXTRACT_DAILY_IMPORT_COST = int(os.getenv("BAGEXTRACT_DAILY_IMPORT_COST", 1))
+BAGEXTRACT_FULL_IMPORT_COST = int(os.getenv("BAGEXTRACT_FULL_IMPORT_COST", 10))
+BAGEXTRACT_SKIP_AHEAD_MIN_SAVING = int(os.getenv("BAGEXTRACT_SKIP_AHEAD_MIN_SAVING", 7))
+
+# Download and extract the next file in the background while the current file is being imported, when the next
+# files and their extracted contents are estimated to take at most BAGEXTRACT_PREFETCH_MAX_SIZE bytes.
+# Set to 0 to disable prefetching.
+BAGEXTRACT_PREFETCH_MAX_SIZE = int(os.getenv("BAGEXTRACT_PREFETCH_MAX_SIZE", 1_000_000_000))
+
+# How rows are written to the bag tables:
+# "copy" (COPY into a staging table and merge) or "insert" (INSERT ... VALUES)
+BAGEXTRACT_WRITE_MODE = os.getenv("BAGEXTRACT_WRITE_MODE", "copy")
+
+# Number of connections that write the rows of a batch concurrently, each writes the objects of one shard.
+# The shards are committed with a two-phase commit, more than 1 requires max_prepared_transactions > 0 in Postgres.
+# A batch that is interrupted while it is committed leaves prepared transactions bagextract_<txid>_<shard>, which
+# hold their locks. The next import finishes them when it connects. To finish them by hand, list them with
+#   SELECT gid, txid_status(split_part(gid, '_', 2)::bigint) FROM pg_prepared_xacts WHERE gid LIKE 'bagextract\_%';
+# and run COMMIT PREPARED '<gid>' when the status is committed, ROLLBACK PREPARED '<gid>' when it is aborted.
+# Leave them when the status is in progress, their batch is still being written.
+# The shards only write faster when the database server has idle cores, the two-phase commit has its own cost.
+BAGEXTRACT_WRITE_CONNECTIONS = int(os.getenv("BAGEXTRACT_WRITE_CONNECTIONS", 1))
+
+# Rows are written in batches of at most BAGEXTRACT_WRITE_BATCH_MAX_BYTES (estimated) bytes. With adaptive batch
+# sizing the number of rows per batch is adjusted between BAGEXTRACT_WRITE_BATCH_MIN_SIZE and
+# BAGEXTRACT_WRITE_BATCH_MAX_SIZE to write each batch in BAGEXTRACT_WRITE_BATCH_MIN_TIME to
+# BAGEXTRACT_WRITE_BATCH_MAX_TIME seconds.
+BAGEXTRACT_ADAPTIVE_BATCH_SIZE = os.getenv("BAGEXTRACT_ADAPTIVE_BATCH_SIZE", "true").lower() == "true"
+BAGEXTRACT_WRITE_BATCH_MIN_SIZE = int(os.getenv("BAGEXTRACT_WRITE_BATCH_MIN_SIZE", 1_000))
+BAGEXTRACT_WRITE_BATCH_MAX_SIZE = int(os.getenv("BAGEXTRACT_WRITE_BATCH_MAX_SIZE", 200_000))
+BAGEXTRACT_WRITE_BATCH_MAX_BYTES = int(os.getenv("BAGEXTRACT_WRITE_BATCH_MAX_BYTES", 64_000_000))
+BAGEXTRACT_WRITE_BATCH_MIN_TIME = float(os.getenv("BAGEXTRACT_WRITE_BATCH_MIN_TIME", 1.0))
+BAGEXTRACT_WRITE_BATCH_MAX_TIME = float(os.getenv("BAGEXTRACT_WRITE_BATCH_MAX_TIME", 5.0))
+
+# Where GML geometries are converted to WKT:
+# "python" (while reading the extract) or "postgis" (by the database while writing the rows, requires PostGIS)
+# Note that PostGIS writes WKT without a space after the geometry type, e.g. POINT(1 2) instead of POINT (1 2)
+BAGEXTRACT_GML_CONVERSION = os.getenv("BAGEXTRACT_GML_CONVERSION", "python")
+
+# Full imports reload the bag table: the rows are loaded into a new table, which is swapped with the current table
+BAGEXTRACT_FULL_RELOAD = os.getenv("BAGEXTRACT_FULL_RELOAD", "true").lower() == "true"
+
+# Full imports skip the closed voorkomens (with an eindGeldigheid) that are already stored, these do not change
+BAGEXTRACT_SKIP_CLOSED = os.getenv("BAGEXTRACT_SKIP_CLOSED", "true").lower() == "true"
+
+# Store the objects compact: the keys of the objects are replaced by short codes, which are kept per table in
+# bag_object_keys. The objects are expanded with the bag_expand_object SQL function or the bag_*_expanded views.
+BAGEXTRACT_COMPACT_OBJECTS = os.getenv("BAGEXTRACT_COMPACT_OBJECTS", "false").lower() == "true"
+
+# The object_ids that each import has written are kept in the change log for this number of days
+BAGEXTRACT_CHANGE_LOG_RETENTION_DAYS = int(os.getenv("BAGEXTRACT_CHANGE_LOG_RETENTION_DAYS", 30))
+
+# Committed batches and finished imports are published with NOTIFY on this channel. Set to "" to disable.
+BAGEXTRACT_NOTIFY_CHANNEL = os.getenv("BAGEXTRACT_NOTIFY_CHANNEL", "bag_extract")
+
 KADASTER_PRODUCTSTORE_AFGIFTE_URL = os.getenv("KADASTER_PRODUCTSTORE_AFGIFTE_URL")
 KADASTER_PRODUCTSTORE_DOWNLOAD_URL = os.getenv("KADASTER_PRODUCTSTORE_DOWNLOAD_URL")
 
@@ -1,4 +1,7 @@
+from sqlalchemy import text
+
 from gobbagextract.database.model import MutationImport
+from gobbagextract.datastore.serializer import dumps
 
 
 class MutationImportRepository:
@@ -20,3 +23,14 @@ class MutationImportRepository:
 
     def get(self, id: int) -> MutationImport:
         return self.session.query(MutationImport).get(id)
+
+    def notify(self, channel: str, payload: dict):
+        """Publishes payload as JSON on channel with NOTIFY.
+
+        The autocommit session does not commit a SELECT by itself, and the notification is only delivered when
+        its transaction commits. The statement is bound like the queries on MutationImport, the session has no bind
+        of its own.
+        """
+        statement = text("SELECT pg_notify(:channel, :payload)").execution_options(autocommit=True)
+        self.session.execute(statement, {"channel": channel, "payload": dumps(payload)},
+                             bind_arguments={"mapper": MutationImport})
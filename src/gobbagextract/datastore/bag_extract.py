@@ -1,16 +1,24 @@
 from collections import defaultdict
+from functools import lru_cache
 
+import hashlib
 import io
 import datetime as dt
 import re
+import threading
 
 from xml.etree import ElementTree
 from osgeo import ogr
 from tempfile import TemporaryDirectory
-from typing import List, Union, Iterator, Any
+from typing import List, Optional, Union, Iterator, Any
 from zipfile import ZipFile
 from pathlib import Path
 
+from gobbagextract.config import BAGEXTRACT_GML_CONVERSION
+from gobbagextract.datastore.gml import CONVERSION_POSTGIS, ENCODING_WKB, ENCODING_WKT, bbox, centroid, \
+    gml_to_string, parse_gml, round_wkt, to_wkb, to_wkt
+from gobbagextract.datastore.predicate import get_predicate
+from gobbagextract.datastore.serializer import dumps_sorted_bytes
 from gobbagextract.mutations.afgifte import Afgifte
 from gobbagextract.mutations.productstore import ProductStore
 from gobcore.datastore.datastore import Datastore
@@ -57,18 +65,71 @@ class ElementFormatter:
     ns_pattern = re.compile(r"{.*}")
     gml_namespace = "http://www.opengis.net/gml/3.2"
 
-    def __init__(self, element: ElementTree.Element):
+    def __init__(self, element: ElementTree.Element, keep_gml: bool = False,
+                 geometry_encoding: str = ENCODING_WKT, geometry_precision: Optional[int] = None,
+                 keys: Optional[frozenset[str]] = None):
         self.element = element
+        # Only keep these flattened keys (and everything below them), other elements are not converted at all
+        self.keys = keys
+        self._key_paths = None if keys is None else self.key_paths(keys)
+        # Keep GML geometries as GML strings instead of converting them to WKT
+        self.keep_gml = keep_gml
+        # Encode geometries as WKT, optionally rounded to geometry_precision decimals, or as hex WKB
+        self.geometry_encoding = geometry_encoding
+        self.geometry_precision = geometry_precision
+
+        # Bounding box (min x, min y, max x, max y) and centroid (x, y) of the first geometry in element
+        self.bbox = None
+        self.centroid = None
 
     def get_dict(self):
-        return self._flatten_dict(self._element_to_dict(self.element))
+        return self._flatten_dict(self._element_to_dict(self.element, "" if self.keys is not None else None))
 
     @staticmethod
-    def _gml_to_wkt(elm: ElementTree.Element) -> str:
+    @lru_cache
+    def key_paths(keys: frozenset[str]) -> frozenset[str]:
+        """Returns the paths that lead to keys, for example a and a/b for key a/b/c."""
+        return frozenset(key.rsplit("/", i)[0] for key in keys for i in range(1, key.count("/") + 1))
+
+    def _set_extent(self, bbox: tuple[float, float, float, float], centroid: tuple[float, float]):
+        if self.bbox is None:
+            self.bbox = bbox
+            self.centroid = centroid
+
+    def _convert_gml(self, elm: ElementTree.Element) -> str:
+        """Returns GML geometry elm in the requested encoding. Geometries that are not parsed by parse_gml are
+        converted by OGR."""
+        if self.keep_gml:
+            return gml_to_string(elm)
+
+        geometry = parse_gml(elm)
+        if geometry is None:
+            return self._convert_ogr_geometry(self._ogr_geometry(elm))
+
+        self._set_extent(bbox(geometry), centroid(geometry))
+        if self.geometry_encoding == ENCODING_WKB:
+            return to_wkb(geometry)
+
+        wkt = to_wkt(geometry, self.geometry_precision)
+        return self._convert_ogr_geometry(self._ogr_geometry(elm)) if wkt is None else wkt
+
+    def _convert_ogr_geometry(self, geometry: ogr.Geometry) -> str:
+        min_x, max_x, min_y, max_y = geometry.GetEnvelope()
+        point = geometry.Centroid()
+        self._set_extent((min_x, min_y, max_x, max_y), (point.GetX(), point.GetY()))
+
+        if self.geometry_encoding == ENCODING_WKB:
+            return bytes(geometry.ExportToWkb(ogr.wkbNDR)).hex().upper()
+
+        wkt = geometry.ExportToWkt()
+        return wkt if self.geometry_precision is None else round_wkt(wkt, self.geometry_precision)
+
+    @staticmethod
+    def _ogr_geometry(elm: ElementTree.Element) -> ogr.Geometry:
         gml_str = ElementTree.tostring(elm).decode("utf-8")
         gml = ogr.CreateGeometryFromGML(gml_str)
         gml.FlattenTo2D()
-        return gml.ExportToWkt()
+        return gml
 
     def _flatten_nested_list(self, lst: list, key_prefix: str) -> dict[str, Any]:
         """Flattens list, called from the _flatten_dict method. Pulls the dict keys in the list out.
@@ -132,18 +193,30 @@ class ElementFormatter:
             return result
         return flatten(d)
 
-    def _element_to_dict(self, element: ElementTree.Element) -> Union[str, dict]:
-        """Transforms an XML element to a dictionary."""
+    def _element_to_dict(self, element: ElementTree.Element, path: Optional[str] = None) -> Union[str, dict]:
+        """Transforms an XML element to a dictionary.
+
+        With path, the flattened key of element, only the childs that lead to or are in keys are transformed.
+        """
         childs = list(element)
 
         if len(childs) == 1 and self.gml_namespace in childs[0].tag:
-            return self._gml_to_wkt(childs[0])
+            return self._convert_gml(childs[0])
 
         elif childs:
             child_dicts = defaultdict(list)
 
             for child in childs:
-                child_dicts[self.ns_pattern.sub("", child.tag)].append(self._element_to_dict(child))
+                tag = self.ns_pattern.sub("", child.tag)
+                if path is None:
+                    child_dicts[tag].append(self._element_to_dict(child))
+                    continue
+
+                child_path = f"{path}/{tag}" if path else tag
+                if child_path in self.keys:
+                    child_dicts[tag].append(self._element_to_dict(child))
+                elif child_path in self._key_paths:
+                    child_dicts[tag].append(self._element_to_dict(child, child_path))
 
             return {k: v[0] if len(v) == 1 else v for k, v in child_dicts.items()}
 
@@ -151,6 +224,10 @@ class ElementFormatter:
             return element.text.strip()
 
 
+class ConnectCancelled(Exception):
+    """Raised when connect is cancelled, see BagExtractDatastore.cancelled."""
+
+
 class BagExtractDatastore(Datastore):
     namespaces = {
         # We could extract namespaces from the file, but this way we're sure they won't change in the source.
@@ -170,6 +247,9 @@ class BagExtractDatastore(Datastore):
         "xs": "http://www.w3.org/2001/XMLSchema",
     }
 
+    # Where GML geometries are converted to WKT
+    GML_CONVERSION = BAGEXTRACT_GML_CONVERSION
+
     id_path = "Objecten:identificatie"
     seqnr_path = "Objecten:voorkomen/Historie:Voorkomen/Historie:voorkomenidentificatie"
 
@@ -180,7 +260,11 @@ class BagExtractDatastore(Datastore):
         self.tmp_path = Path(self.tmp_dir.name)
         self.files = None
         self.ids = None
+        # object_ids of closed voorkomens that are already stored, these are skipped in full imports
+        self.closed_ids = set()
         self._last_update = last_update
+        # When set, connect stops between the downloads and extracts, for example when a prefetch is cancelled
+        self.cancelled: Optional[threading.Event] = None
 
         self._check_config()
         self._gemeente = read_config.get("gemeentes")[0]  # For now we only support Weesp
@@ -196,6 +280,15 @@ class BagExtractDatastore(Datastore):
         self.mode = self.read_config["mode"]
         assert isinstance(self.mode, ImportMode), "mode should be of type ImportMode"
 
+        keys = self.read_config.get("keys")
+        self._formatter_config = {
+            "keep_gml": self.GML_CONVERSION == CONVERSION_POSTGIS,
+            "geometry_encoding": self.read_config.get("geometry_encoding", ENCODING_WKT),
+            "geometry_precision": self.read_config.get("geometry_precision"),
+            # Only these flattened keys are extracted from the objects, all keys when not specified
+            "keys": None if keys is None else frozenset(keys),
+        }
+
     def _check_config(self):
         for key in ("object_type", "xml_object", "mode", "gemeentes", "download_location"):
             if not self.read_config.get(key):
@@ -205,6 +298,24 @@ class BagExtractDatastore(Datastore):
             if not self.read_config.get("last_full_download_location"):
                 raise GOBException("Missing last_full_download_location in read_config")
 
+        self._check_geometry_config()
+
+        keys = self.read_config.get("keys")
+        if keys is not None and (not isinstance(keys, list) or not keys or not all(isinstance(k, str) for k in keys)):
+            raise GOBException(f"Invalid keys {keys} in read_config")
+
+    def _check_geometry_config(self):
+        encoding = self.read_config.get("geometry_encoding", ENCODING_WKT)
+        if encoding not in (ENCODING_WKT, ENCODING_WKB):
+            raise GOBException(f"Invalid geometry_encoding {encoding} in read_config")
+
+        precision = self.read_config.get("geometry_precision")
+        if precision is not None and (not isinstance(precision, int) or precision < 0 or encoding != ENCODING_WKT):
+            raise GOBException(f"Invalid geometry_precision {precision} in read_config")
+
+        if self.GML_CONVERSION == CONVERSION_POSTGIS and (encoding != ENCODING_WKT or precision is not None):
+            raise GOBException("geometry_encoding and geometry_precision require GML conversion in Python")
+
     def _extract_full_file(self, afgifte: Afgifte) -> Iterator[Path]:
         object_type = self.read_config["object_type"]
         gemeente = afgifte.get_gemeente()
@@ -228,6 +339,7 @@ class BagExtractDatastore(Datastore):
         """Get mutation ids."""
         afgifte = self.read_config["last_full_download_location"]
         ProductStore.download(afgifte, destination=self.tmp_path)
+        self._check_cancelled()
 
         for file in self._extract_full_file(afgifte):
             tree = ElementTree.parse(file)
@@ -235,14 +347,26 @@ class BagExtractDatastore(Datastore):
             for elm in tree.getroot().iterfind(f"{self.full_xml_path}/{self.id_path}", self.namespaces):
                 yield elm.text
 
+    def _check_cancelled(self):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise ConnectCancelled
+
     def connect(self):
+        """Downloads and extracts the file. Raises ConnectCancelled when cancelled is set between the steps, the
+        files that have been written so far are removed by disconnect."""
+        if self.files is not None:
+            # Already downloaded and extracted, for example by the Prefetcher
+            return
+
         afgifte = self.read_config["download_location"]
         ProductStore.download(afgifte, destination=self.tmp_path)
+        self._check_cancelled()
 
         if self.mode == ImportMode.FULL:
             self.files = sorted(self._extract_full_file(afgifte))
         else:
             self.ids = set(self._get_mutation_ids())
+            self._check_cancelled()
             self.files = sorted(self._extract_mutations_file(afgifte))
 
     def disconnect(self):
@@ -278,28 +402,48 @@ class BagExtractDatastore(Datastore):
         for mutation in mutations.values():
             yield mutation
 
-    def _pack_object(self, row, object_id) -> dict:
+    @staticmethod
+    def _hash(row: dict) -> str:
+        """Returns a hash of the contents of row, used to detect whether a stored object has changed."""
+        return hashlib.md5(dumps_sorted_bytes(row)).hexdigest()
+
+    def _pack_object(self, row, object_id, bbox=None, centroid=None) -> dict:
         return {
             "gemeente": self._gemeente,
             "last_update": self._last_update,
             "object_id": object_id,
             "object": row,
+            "hash": self._hash(row),
+            # In the Postgres box and point input formats
+            "bbox": None if bbox is None else "({!r},{!r}),({!r},{!r})".format(*bbox),
+            "centroid": None if centroid is None else "({!r},{!r})".format(*centroid),
         }
 
     def query(self, query, **kwargs):
-        # query arg is ignored
+        """Yields the objects in the extract that match query, see gobbagextract.datastore.predicate.
 
+        Objects that do not match are skipped before they are formatted. An empty query matches all objects.
+        """
+        predicate = get_predicate(query)
         get_elements_fn = self._get_elements_full if self.mode == ImportMode.FULL else self._get_elements_mutations
 
         for file in self.files:
             tree = ElementTree.parse(file)
 
             for element in get_elements_fn(tree.getroot()):
-                row = ElementFormatter(element).get_dict()
-
                 identificatie = element.find(f"./{self.id_path}", self.namespaces)
                 identificatie = identificatie.text.strip() if identificatie is not None else None
-                volgnummer = element.find(f"./{self.seqnr_path}", self.namespaces)
 
+                if predicate is not None and not predicate(element, identificatie):
+                    continue
+
+                volgnummer = element.find(f"./{self.seqnr_path}", self.namespaces)
                 object_id = identificatie if volgnummer is None else f"{identificatie}.{volgnummer.text.strip()}"
-                yield self._pack_object(row, object_id)
+
+                # A closed voorkomen does not change anymore, skip formatting it when it is already stored
+                if object_id in self.closed_ids:
+                    continue
+
+                formatter = ElementFormatter(element, **self._formatter_config)
+                row = formatter.get_dict()
+                yield self._pack_object(row, object_id, formatter.bbox, formatter.centroid)
@@ -0,0 +1,252 @@
+"""Converts the GML geometries in BAG extracts to WKT or WKB without a round trip through OGR.
+
+Only the geometries that BAG uses are converted: Point, Polygon (with interior rings) and MultiSurface. The Z
+dimension is dropped and the WKT is formatted like OGR does after FlattenTo2D. For any other GML parse_gml returns
+None, as does to_wkt for coordinates that it can not format like OGR. The caller then falls back to OGR.
+"""
+import re
+import struct
+from typing import Optional, Union
+from xml.etree import ElementTree
+
+GML_NAMESPACE = "http://www.opengis.net/gml/3.2"
+GML = f"{{{GML_NAMESPACE}}}"
+
+# Where GML geometries are converted, see BAGEXTRACT_GML_CONVERSION
+CONVERSION_PYTHON = "python"
+CONVERSION_POSTGIS = "postgis"
+
+# How geometries are encoded in the object, see the geometry_encoding read_config option
+ENCODING_WKT = "wkt"
+ENCODING_WKB = "wkb"
+
+# Serialize GML geometries with the gml prefix, see gml_to_string
+ElementTree.register_namespace("gml", GML_NAMESPACE)
+
+POINT = f"{GML}Point"
+POLYGON = f"{GML}Polygon"
+MULTISURFACE = f"{GML}MultiSurface"
+
+# OGR writes integral coordinates as integers when they fit in an int
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+class _Unsupported(Exception):
+    """Raised when the GML can not be converted here."""
+
+
+Coordinates = list[tuple[float, float]]
+
+# A parsed geometry: the WKT geometry type and its coordinates, as a list of points, rings or polygons
+Geometry = tuple[str, Union[Coordinates, list[Coordinates], list[list[Coordinates]]]]
+
+# WKB geometry types
+WKB_TYPES = {"POINT": 1, "POLYGON": 3, "MULTIPOLYGON": 6}
+
+RX_NUMBER = re.compile(r"-?\d+(\.\d*)?(E[+-]?\d+)?", re.IGNORECASE)
+
+
+def _coordinates(elm: ElementTree.Element, srs_dimension: Optional[str]) -> Coordinates:
+    """Returns the 2D coordinates in gml:pos or gml:posList elm."""
+    srs_dimension = elm.get("srsDimension", srs_dimension)
+    if srs_dimension not in ("2", "3") or not elm.text:
+        raise _Unsupported
+
+    dimension = int(srs_dimension)
+    values = elm.text.split()
+    if not values or len(values) % dimension:
+        raise _Unsupported
+
+    try:
+        return [(float(x), float(y)) for x, y in zip(values[::dimension], values[1::dimension])]
+    except ValueError:
+        raise _Unsupported
+
+
+def _coordinate(x: float, y: float) -> str:
+    """Formats x and y like OGR: integers when both are integral ints, otherwise both with a decimal point."""
+    if x.is_integer() and y.is_integer() and INT_MIN <= x <= INT_MAX and INT_MIN <= y <= INT_MAX:
+        return f"{int(x)} {int(y)}"
+    return f"{_decimal(x)} {_decimal(y)}"
+
+
+def _decimal(value: float) -> str:
+    result = f"{value:.15g}"
+    if "e" in result:
+        # OGR writes these in its own notation, which is not needed for BAG coordinates
+        raise _Unsupported
+    return result if "." in result else f"{result}.0"
+
+
+def _rounded(value: float, precision: int) -> str:
+    """Formats value with at most precision decimals, without trailing zeros."""
+    result = f"{value:.{precision}f}"
+    if "." in result:
+        result = result.rstrip("0").rstrip(".")
+    return "0" if result == "-0" else result
+
+
+def _only_child(elm: ElementTree.Element, tag: str) -> ElementTree.Element:
+    childs = list(elm)
+    if len(childs) != 1 or childs[0].tag != tag:
+        raise _Unsupported
+    return childs[0]
+
+
+def _point(elm: ElementTree.Element, srs_dimension: Optional[str]) -> Coordinates:
+    coordinates = _coordinates(_only_child(elm, f"{GML}pos"), elm.get("srsDimension", srs_dimension))
+    if len(coordinates) != 1:
+        raise _Unsupported
+    return coordinates
+
+
+def _polygon(elm: ElementTree.Element, srs_dimension: Optional[str]) -> list[Coordinates]:
+    srs_dimension = elm.get("srsDimension", srs_dimension)
+
+    rings = []
+    for i, boundary in enumerate(elm):
+        if boundary.tag != (f"{GML}exterior" if i == 0 else f"{GML}interior"):
+            raise _Unsupported
+
+        pos_list = _only_child(_only_child(boundary, f"{GML}LinearRing"), f"{GML}posList")
+        rings.append(_coordinates(pos_list, srs_dimension))
+
+    if not rings:
+        raise _Unsupported
+    return rings
+
+
+def _multi_surface(elm: ElementTree.Element, srs_dimension: Optional[str]) -> list[list[Coordinates]]:
+    srs_dimension = elm.get("srsDimension", srs_dimension)
+
+    polygons = [_polygon(_only_child(member, POLYGON), srs_dimension)
+                for member in elm.iterfind(f"{GML}surfaceMember")]
+    if not polygons or len(polygons) != len(elm):
+        raise _Unsupported
+    return polygons
+
+
+def parse_gml(elm: ElementTree.Element) -> Optional[Geometry]:
+    """Returns the 2D geometry of GML geometry elm, or None when elm is not a geometry that is converted here."""
+    srs_dimension = elm.get("srsDimension")
+    try:
+        if elm.tag == POINT:
+            return "POINT", _point(elm, srs_dimension)
+        if elm.tag == POLYGON:
+            return "POLYGON", _polygon(elm, srs_dimension)
+        if elm.tag == MULTISURFACE:
+            return "MULTIPOLYGON", _multi_surface(elm, srs_dimension)
+    except _Unsupported:
+        pass
+    return None
+
+
+def to_wkt(geometry: Geometry, precision: Optional[int] = None) -> Optional[str]:
+    """Returns geometry as WKT, with coordinates rounded to precision decimals when given.
+
+    Returns None when the coordinates can not be formatted like OGR does.
+    """
+    geometry_type, coordinates = geometry
+    if precision is None:
+        def points(coords: Coordinates) -> str:
+            return ",".join([_coordinate(x, y) for x, y in coords])
+    else:
+        def points(coords: Coordinates) -> str:
+            return ",".join([f"{_rounded(x, precision)} {_rounded(y, precision)}" for x, y in coords])
+
+    try:
+        if geometry_type == "POINT":
+            return f"POINT ({points(coordinates)})"
+        polygons = [coordinates] if geometry_type == "POLYGON" else coordinates
+        text = ",".join("(" + ",".join(f"({points(ring)})" for ring in polygon) + ")" for polygon in polygons)
+        return f"POLYGON {text}" if geometry_type == "POLYGON" else f"MULTIPOLYGON ({text})"
+    except _Unsupported:
+        return None
+
+
+def to_wkb(geometry: Geometry) -> str:
+    """Returns geometry as little endian WKB in upper case hex."""
+    geometry_type, coordinates = geometry
+
+    def header(wkb_type: int, count: Optional[int] = None) -> bytes:
+        return struct.pack("<BI", 1, wkb_type) + (b"" if count is None else struct.pack("<I", count))
+
+    def polygon(rings: list[Coordinates]) -> bytes:
+        return header(WKB_TYPES["POLYGON"], len(rings)) + b"".join(
+            struct.pack(f"<I{2 * len(ring)}d", len(ring), *[value for point in ring for value in point])
+            for ring in rings
+        )
+
+    if geometry_type == "POINT":
+        wkb = header(WKB_TYPES["POINT"]) + struct.pack("<2d", *coordinates[0])
+    elif geometry_type == "POLYGON":
+        wkb = polygon(coordinates)
+    else:
+        wkb = header(WKB_TYPES["MULTIPOLYGON"], len(coordinates)) + b"".join(polygon(p) for p in coordinates)
+    return wkb.hex().upper()
+
+
+def _polygons(geometry: Geometry) -> list[list[Coordinates]]:
+    geometry_type, coordinates = geometry
+    return [coordinates] if geometry_type == "POLYGON" else coordinates
+
+
+def bbox(geometry: Geometry) -> tuple[float, float, float, float]:
+    """Returns the bounding box (min x, min y, max x, max y) of geometry."""
+    if geometry[0] == "POINT":
+        x, y = geometry[1][0]
+        return x, y, x, y
+
+    points = [point for polygon in _polygons(geometry) for point in polygon[0]]
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _ring_centroid(ring: Coordinates) -> tuple[float, float, float]:
+    """Returns the area and centroid (x, y) of ring. The area is negative for clockwise rings."""
+    x0, y0 = ring[0]
+    area = sum_x = sum_y = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        # Relative to the first point to limit rounding errors
+        x1, y1, x2, y2 = x1 - x0, y1 - y0, x2 - x0, y2 - y0
+        cross = x1 * y2 - x2 * y1
+        area += cross
+        sum_x += (x1 + x2) * cross
+        sum_y += (y1 + y2) * cross
+
+    if area == 0:
+        return 0.0, x0, y0
+    return area / 2, x0 + sum_x / (3 * area), y0 + sum_y / (3 * area)
+
+
+def centroid(geometry: Geometry) -> tuple[float, float]:
+    """Returns the centroid (x, y) of geometry, the area weighted centroid for (multi)polygons."""
+    if geometry[0] == "POINT":
+        return geometry[1][0]
+
+    total_area = total_x = total_y = 0.0
+    for polygon in _polygons(geometry):
+        for i, ring in enumerate(polygon):
+            area, x, y = _ring_centroid(ring)
+            # The exterior ring adds to the area, interior rings are holes
+            area = abs(area) if i == 0 else -abs(area)
+            total_area += area
+            total_x += area * x
+            total_y += area * y
+
+    if total_area == 0:
+        # Degenerate polygons, use the average of the exterior points
+        points = [point for polygon in _polygons(geometry) for point in polygon[0]]
+        return sum(x for x, _ in points) / len(points), sum(y for _, y in points) / len(points)
+    return total_x / total_area, total_y / total_area
+
+
+def round_wkt(wkt: str, precision: int) -> str:
+    """Rounds all coordinates in wkt to precision decimals, like to_wkt does."""
+    return RX_NUMBER.sub(lambda m: _rounded(float(m.group()), precision), wkt)
+
+
+def gml_to_string(elm: ElementTree.Element) -> str:
+    """Returns GML geometry elm as a string, for conversion by PostGIS. The string starts with '<gml:'."""
+    return ElementTree.tostring(elm, encoding="unicode").strip()
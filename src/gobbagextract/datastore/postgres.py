@@ -1,18 +1,199 @@
-from typing import List
+import io
+import json
+import re
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterator, List
 
 from psycopg2 import Error
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_values, Json
 
 from gobcore.datastore.postgres import PostgresDatastore
 from gobcore.exceptions import GOBException
 
+from gobbagextract.config import BAGEXTRACT_WRITE_MODE, BAGEXTRACT_WRITE_CONNECTIONS, BAGEXTRACT_GML_CONVERSION, \
+    BAGEXTRACT_NOTIFY_CHANNEL, BAGEXTRACT_COMPACT_OBJECTS
+from gobbagextract.datastore.gml import CONVERSION_POSTGIS
+from gobbagextract.datastore.predicate import BEGIN_GELDIGHEID_KEY, EIND_GELDIGHEID_KEY, EIND_REGISTRATIE_KEY, \
+    changed_condition, current_condition
+from gobbagextract.datastore.serializer import dumps, dumps_bytes
+
+# Characters that need to be escaped in the COPY text format
+COPY_ESCAPE = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+RX_COPY_ESCAPE = re.compile(r"[\\\t\n\r]")
+
 
 class PostgresDatastoreExt(PostgresDatastore):
+    WRITE_MODE_INSERT = "insert"
+    WRITE_MODE_COPY = "copy"
+
+    WRITE_MODE = BAGEXTRACT_WRITE_MODE
+
+    # Batches are split in shards that are written concurrently, each on its own connection
+    WRITE_CONNECTIONS = BAGEXTRACT_WRITE_CONNECTIONS
+
+    # Existing rows with the same content hash are not updated
+    HASH_COLUMN = "hash"
+
+    # Where GML geometries are converted to WKT, in PostGIS mode this is done while writing the OBJECT_COLUMN
+    GML_CONVERSION = BAGEXTRACT_GML_CONVERSION
+    OBJECT_COLUMN = "object"
+
+    # Converts the GML strings (see gml_to_string) in a JSONB object to 2D WKT
+    GML_TO_WKT = "(SELECT jsonb_object_agg(key, CASE WHEN value::text LIKE '\"<gml:%%' " \
+                 "THEN to_jsonb(ST_AsText(ST_Force2D(ST_GeomFromGML(value #>> '{{}}')))) ELSE value END) " \
+                 "FROM jsonb_each({column}::jsonb))"
+
+    # The bounding box and centroid of the first GML geometry in the object, these are computed while reading the
+    # extract when the GML is converted in Python
+    BBOX_COLUMN = "bbox"
+    CENTROID_COLUMN = "centroid"
+    GML_TO_BBOX = "(SELECT ST_GeomFromGML(value #>> '{{}}')::box FROM jsonb_each({column}::jsonb) " \
+                  "WHERE value::text LIKE '\"<gml:%%' LIMIT 1)"
+    GML_TO_CENTROID = "(SELECT ST_Centroid(ST_GeomFromGML(value #>> '{{}}'))::point " \
+                      "FROM jsonb_each({column}::jsonb) WHERE value::text LIKE '\"<gml:%%' LIMIT 1)"
+
+    # Compact objects have short codes instead of their keys, see _encode_objects
+    COMPACT_OBJECTS = BAGEXTRACT_COMPACT_OBJECTS
+    OBJECT_KEYS_TABLE = "bag_object_keys"
+    # The keys that are read by CLOSED_CONDITION and CURRENT_CONDITION, these are not encoded
+    PLAIN_KEYS = (BEGIN_GELDIGHEID_KEY, EIND_GELDIGHEID_KEY, EIND_REGISTRATIE_KEY)
+
+    # Selects the rows of closed voorkomens, these have an end date. Rows without a hash are excluded, these are to
+    # be written again (for example after a migration that adds a column)
+    CLOSED_CONDITION = "object->>'voorkomen/Voorkomen/eindGeldigheid' IS NOT NULL AND hash IS NOT NULL"
+
+    # The bag tables are list partitioned on gemeente, a full import reloads one partition, see ensure_partition.
+    # Unique indexes include the partition column.
+    PARTITION_COLUMN = "gemeente"
+    PARTITION_TABLE = "{table}_{gemeente}"
+
+    # Expression indexes on attributes of the object, see ensure_attribute_indexes
+    ATTRIBUTE_INDEX = "ix_{table}_attr_{name}"
+
+    # Side table with typed columns for attributes of the object, see ensure_projection
+    PROJECTION_TABLE = "{table}_projection"
+    PROJECTION_TYPES = {
+        "string": "varchar",
+        "integer": "integer",
+        "date": "date",
+        "timestamp": "timestamp",
+    }
+
+    # Table with the current voorkomen of each object in a table, see _update_current
+    CURRENT_TABLE = "{table}_current"
+    CURRENT_COLUMNS = ("object_id", "gemeente", "last_update", "object", "hash", "bbox", "centroid")
+    # The same definition as the current query option, see gobbagextract.datastore.predicate.is_current
+    CURRENT_CONDITION = current_condition("object", "to_char(CURRENT_DATE, 'YYYY-MM-DD')")
+    # The voorkomens whose current state has changed since the date in %(since)s, these have the expression indexes
+    # ix_<table>_begin_geldigheid and ix_<table>_eind_geldigheid
+    CHANGED_CONDITION = changed_condition("object", "%(since)s", "to_char(CURRENT_DATE, 'YYYY-MM-DD')")
+    # The date of the last refresh of the current table, per table and gemeente, see refresh_current
+    CURRENT_REFRESH_TABLE = "bag_current_refreshes"
+    # The object_id is the identificatie and volgnummer of the voorkomen, separated by a dot
+    IDENTIFICATIE = "split_part(object_id, '.', 1)"
+    VOLGNUMMER = "NULLIF(split_part(object_id, '.', 2), '')::integer"
+
+    # Logs the object_ids that each import has written, see start_change_log
+    CHANGE_LOG_TABLE = "bag_change_log"
+    CHANGE_INSERTED = "inserted"
+    CHANGE_UPDATED = "updated"
+    CHANGE_UNCHANGED = "unchanged"
+    CHANGE_DELETED = "deleted"
+
+    # The prepared transactions of the shards of a batch are named PREPARED_PREFIX<txid>_<shard>, with txid the
+    # transaction of self.connection that decides whether the batch is committed, see _write_prepared
+    PREPARED_PREFIX = "bagextract_"
+
+    # Every committed batch is published on this channel with NOTIFY, see _notify_batch
+    NOTIFY_CHANNEL = BAGEXTRACT_NOTIFY_CHANNEL
+    EVENT_BATCH = "batch"
+
+    def __init__(self, connection_config: dict, read_config: dict = None):
+        super().__init__(connection_config, read_config)
+        # The tables that are being reloaded with the table that they reload, see reload_table
+        self._reloading = {}
+        # The connections that write the shards next to self.connection, see _write_connections
+        self._shard_connections = []
+        # Projected columns per table, see ensure_projection
+        self._projections = {}
+        # The keys of the attribute indexes per table, see ensure_attribute_indexes
+        self._attribute_keys = {}
+        # The codes of the keys of compact objects per table, see _key_codes
+        self._object_codes = {}
+        # Tables that have a current table, which is updated on every write
+        self.current_tables = set()
+        # The mutation import whose changes are logged, see start_change_log
+        self.change_log_id = None
+        # The mutation import that writes the rows, it is published with every batch
+        self.mutation_import_id = None
+        # Number of inserted, updated and unchanged rows
+        self.write_counts = Counter(inserted=0, updated=0, unchanged=0)
+
+    def _upsert_query(self, table: str, columns: list, source: str) -> str:
+        id_name = columns[0]
+        conflict = f"{id_name},{self.PARTITION_COLUMN}" if self.PARTITION_COLUMN in columns else id_name
+        query = f"INSERT INTO {table} ({','.join(columns)}) {source} " \
+            f"ON CONFLICT({conflict}) " \
+            f"DO UPDATE SET " \
+            f"{','.join([ col + '=EXCLUDED.' + col for col in columns[1:]])}"
+
+        if self.HASH_COLUMN in columns:
+            query += f" WHERE {table}.{self.HASH_COLUMN} IS DISTINCT FROM EXCLUDED.{self.HASH_COLUMN}"
+        return query
+
+    def _select_list(self, columns: list) -> str:
+        """Returns the select list for columns.
+
+        In PostGIS mode the GML geometries in OBJECT_COLUMN are converted, and their bounding box and centroid are
+        computed.
+        """
+        if self.GML_CONVERSION != CONVERSION_POSTGIS:
+            return ','.join(columns)
+
+        expressions = {
+            self.OBJECT_COLUMN: self.GML_TO_WKT,
+            self.BBOX_COLUMN: self.GML_TO_BBOX,
+            self.CENTROID_COLUMN: self.GML_TO_CENTROID,
+        }
+        return ','.join(f"{expressions[column].format(column=self.OBJECT_COLUMN)} AS {column}"
+                        if column in expressions else column for column in columns)
+
+    def _count(self, total: int, inserted: int, updated: int) -> dict:
+        """Adds the counts of a batch to write_counts and returns them."""
+        counts = {"inserted": inserted, "updated": updated, "unchanged": total - inserted - updated}
+        self.write_counts.update(counts)
+        return counts
+
+    def _notify_batch(self, cursor, table: str, counts: dict):
+        """Publishes the counts of a batch that is written to table. The notification is delivered when the
+        transaction commits, listeners can then read the new rows.
+        """
+        if not self.NOTIFY_CHANNEL:
+            return
+
+        payload = {
+            "event": self.EVENT_BATCH,
+            "table": table,
+            "mutation_import_id": self.mutation_import_id,
+            **counts,
+        }
+        cursor.execute("SELECT pg_notify(%s, %s)", (self.NOTIFY_CHANNEL, dumps(payload)))
 
     def write_rows(self, table: str, rows: List[list], columns: list) -> int:
         """
-        Writes rows to Postgres table using the optimised execute_values function from psycopg2, which
+        Writes rows to Postgres table. Existing rows, with the same value in the first column, are updated.
+
+        In copy mode (the default) the rows are copied into a staging table and merged in one statement.
+        In insert mode the rows are written using the optimised execute_values function from psycopg2, which
         combines all inserts into one query.
+        Rows for a table that is being reloaded are copied directly into the table.
+
+        Existing rows with an unchanged HASH_COLUMN value are left as they are. The number of inserted, updated and
+        unchanged rows is added to write_counts.
 
         :param connection:
         :param table:
@@ -20,16 +201,766 @@ class PostgresDatastoreExt(PostgresDatastore):
         :param columns: columns in each row, first column item is the unique id
         :return:
         """
-        id_name = columns[0]
-        query = f"INSERT INTO {table} ({','.join(columns)}) VALUES %s " \
-            f"ON CONFLICT({id_name}) " \
-            f"DO UPDATE SET " \
-            f"{','.join([ col + '=EXCLUDED.' + col for col in columns[1:]])}"
         try:
-            with self.connection.cursor() as cursor:
-                execute_values(cursor, query, rows)
+            rows = self._encode_objects(self._reloading.get(table, table), rows, columns)
+            if table in self._reloading:
+                # The rows are published when the reloaded table replaces table
+                with self.connection.cursor() as cursor:
+                    self._copy_reload(cursor, table, rows, columns)
                 self.connection.commit()
+            else:
+                self._write_shards(table, rows, columns)
         except Error as e:
             raise GOBException(f'Error writing rows to table {table}. Error: {e}')
 
         return len(rows)
+
+    def _plain_keys(self, table: str) -> set[str]:
+        """Returns the keys of the objects in table that are read in SQL: by the conditions in PLAIN_KEYS, the
+        projection and the attribute indexes. These keys are not encoded."""
+        return {*self.PLAIN_KEYS,
+                *(column["key"] for column in self._projections.get(table, [])),
+                *self._attribute_keys.get(table, ())}
+
+    def _key_codes(self, table: str, keys: set[str]) -> dict[str, str]:
+        """Returns the codes of the keys of the objects in table, keys that have no code yet get one.
+
+        The codes are read once per table. Codes for new keys are added to OBJECT_KEYS_TABLE and committed right
+        away, so that the codes are known before any row with them is committed. Concurrent imports that add the
+        same key get the same code.
+        """
+        codes = self._object_codes.get(table)
+        new_keys = sorted(keys if codes is None else keys - codes.keys())
+        if codes is not None and not new_keys:
+            return codes
+
+        with self.connection.cursor() as cursor:
+            if new_keys:
+                cursor.execute(f"INSERT INTO {self.OBJECT_KEYS_TABLE} (table_name, key) "
+                               f"SELECT %s, unnest(%s::varchar[]) ON CONFLICT DO NOTHING", (table, new_keys))
+            cursor.execute(f"SELECT key, code FROM {self.OBJECT_KEYS_TABLE} WHERE table_name = %s", (table,))
+            codes = {key: str(code) for key, code in cursor.fetchall()}
+        self.connection.commit()
+
+        self._object_codes[table] = codes
+        return codes
+
+    def _encode_objects(self, table: str, rows: List[list], columns: list) -> List[list]:
+        """Returns rows with the keys of the objects of table replaced by their codes when COMPACT_OBJECTS is set.
+
+        A compact object looks like {"12": "Pand in gebruik", "voorkomen/Voorkomen/eindGeldigheid": null, ...},
+        the keys that are read in SQL (see _plain_keys) are kept. The bag_expand_object function returns the
+        objects with their keys again, for compact objects and for objects that were stored before.
+
+        The hash is computed over the object with its keys. Unchanged objects are not written again, after
+        switching the format these change format on a full reload. The same holds for a key that becomes a
+        projected or indexed key after it has been encoded.
+        """
+        if not self.COMPACT_OBJECTS or self.OBJECT_COLUMN not in columns:
+            return rows
+
+        idx = columns.index(self.OBJECT_COLUMN)
+        objects = [row[idx].adapted if isinstance(row[idx], Json) else row[idx] for row in rows]
+        plain_keys = self._plain_keys(table)
+        keys = {key for obj in objects if obj for key in obj} - plain_keys
+
+        codes = self._key_codes(table, keys)
+        codes = {key: code for key, code in codes.items() if key not in plain_keys}
+        return [
+            row if obj is None else
+            [*row[:idx], Json({codes.get(key, key): value for key, value in obj.items()}, dumps=dumps), *row[idx + 1:]]
+            for row, obj in zip(rows, objects)
+        ]
+
+    def _write_connections(self) -> list:
+        """Returns the WRITE_CONNECTIONS connections that write the shards, the first is self.connection."""
+        while len(self._shard_connections) < self.WRITE_CONNECTIONS - 1:
+            # Let connect open the connection, with the same settings as self.connection
+            connection = self.connection
+            try:
+                super().connect()
+                self._shard_connections.append(self.connection)
+            finally:
+                self.connection = connection
+        return [self.connection, *self._shard_connections]
+
+    def disconnect(self):
+        for connection in self._shard_connections:
+            connection.close()
+        self._shard_connections = []
+        super().disconnect()
+
+    @staticmethod
+    def _shard_rows(rows: List[list], count: int) -> list[list]:
+        """Splits rows in count shards on a hash of the identificatie in the object_id (the first column).
+
+        All voorkomens of an object are in the same shard, so the shards do not lock the same rows in table nor in
+        its current table.
+        """
+        shards = [[] for _ in range(count)]
+        for row in rows:
+            shards[zlib.crc32(row[0].split(".", 1)[0].encode()) % count].append(row)
+        return shards
+
+    def _write_shards(self, table: str, rows: List[list], columns: list):
+        """Writes rows and commits them with their notification in one transaction.
+
+        With more than one write connection the shards of rows are written concurrently, see _write_prepared.
+        """
+        connections = self._write_connections()
+        if len(connections) > 1:
+            self._write_prepared(table, connections, rows, columns)
+            return
+
+        try:
+            counts = self._count(*self._write_shard(self.connection, table, rows, columns, self._merge()))
+            with self.connection.cursor() as cursor:
+                self._notify_batch(cursor, table, counts)
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def _write_prepared(self, table: str, connections: list, rows: List[list], columns: list):
+        """Writes the shards of rows concurrently and commits them atomically with a two-phase commit.
+
+        self.connection writes the first shard and coordinates the batch. The other shards are written in prepared
+        transactions, named after the transaction of self.connection (see PREPARED_PREFIX). When all shards have
+        been prepared self.connection commits, which decides that the batch is committed, and then the prepared
+        shards are committed. When any shard fails before that, all shards are rolled back. This requires
+        max_prepared_transactions > 0 on the server.
+
+        Prepared shards that are left by a crash or a failed commit are finished by recover_prepared.
+
+        A prepared transaction cannot use temporary tables nor NOTIFY: the prepared shards are staged in a regular
+        table (see _copy_staging) and the batch is published after all shards have been committed.
+        """
+        shards = self._shard_rows(rows, len(connections))
+
+        prepared = []
+        try:
+            self._begin_prepared(connections, shards, prepared)
+            with ThreadPoolExecutor(max_workers=len(connections), thread_name_prefix="shard") as executor:
+                futures = [executor.submit(self._write_shard, connection, table, shard, columns, self._merge(i > 0))
+                           for i, (connection, shard) in enumerate(zip(connections, shards)) if shard]
+            results = [future.result() for future in futures]
+
+            for connection in prepared:
+                connection.tpc_prepare()
+        except Exception:
+            self.connection.rollback()
+            for connection in prepared:
+                connection.tpc_rollback()
+            raise
+
+        self.connection.commit()
+        for connection in prepared:
+            connection.tpc_commit()
+
+        counts = self._count(*([sum(values) for values in zip(*results)] or [0, 0, 0]))
+        with self.connection.cursor() as cursor:
+            self._notify_batch(cursor, table, counts)
+        self.connection.commit()
+
+    def _begin_prepared(self, connections: list, shards: list[list], prepared: list):
+        """Begins the prepared transactions of the shards after the first one, and adds their connections to
+        prepared. The transactions are named after the transaction of self.connection, which coordinates the batch.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT txid_current()")
+            txid, = cursor.fetchone()
+        for i, (connection, shard) in enumerate(zip(connections, shards)):
+            if i and shard:
+                connection.tpc_begin(f"{self.PREPARED_PREFIX}{txid}_{i}")
+                prepared.append(connection)
+
+    def recover_prepared(self) -> dict[str, str]:
+        """Finishes the prepared shards of batches that have been interrupted, see _write_prepared.
+
+        A prepared shard is committed when the transaction that coordinated its batch has been committed, and it is
+        rolled back when that transaction has been aborted. The shards of batches that are still being written are
+        left alone. Returns the finished prepared transactions with whether they have been committed or rolled back.
+        """
+        finished = {}
+        try:
+            xids = [xid for xid in self.connection.tpc_recover()
+                    if xid.database == self.connection.info.dbname
+                    and (xid.gtrid or "").startswith(self.PREPARED_PREFIX)]
+            if not xids:
+                return finished
+
+            with self.connection.cursor() as cursor:
+                txids = [int(xid.gtrid[len(self.PREPARED_PREFIX):].split("_")[0]) for xid in xids]
+                cursor.execute("SELECT txid_status(txid) FROM unnest(%s::bigint[]) WITH ORDINALITY AS t(txid, n) "
+                               "ORDER BY n", (txids,))
+                statuses = [status for status, in cursor.fetchall()]
+            self.connection.commit()
+
+            for xid, status in zip(xids, statuses):
+                if status == "committed":
+                    self.connection.tpc_commit(xid)
+                    finished[xid.gtrid] = "committed"
+                elif status == "aborted":
+                    self.connection.tpc_rollback(xid)
+                    finished[xid.gtrid] = "rolled back"
+        except Error as e:
+            raise GOBException(f'Error recovering prepared transactions. Error: {e}')
+        return finished
+
+    def _merge(self, prepared: bool = False):
+        """Returns the function that merges rows into a table in WRITE_MODE, in a prepared transaction or not."""
+        if self.WRITE_MODE != self.WRITE_MODE_COPY:
+            return self._insert_rows
+        return partial(self._copy_rows, prepared=True) if prepared else self._copy_rows
+
+    def _write_shard(self, connection, table: str, rows: List[list], columns: list, write) -> tuple[int, int, int]:
+        """Merges rows into table on connection with write, without committing.
+
+        Returns the number of rows, and the number of inserted and updated rows.
+        """
+        with connection.cursor() as cursor:
+            result = write(cursor, table, rows, columns)
+
+            if table in self.current_tables:
+                self._update_current(cursor, table, [row[0] for row in rows])
+        return result
+
+    def _insert_rows(self, cursor, table: str, rows: List[list], columns: list) -> tuple[int, int, int]:
+        """Merges rows into table with execute_values.
+
+        Returns the number of rows, and the number of inserted and updated rows.
+        """
+        source = "VALUES %s" if self.GML_CONVERSION != CONVERSION_POSTGIS else \
+            f"SELECT {self._select_list(columns)} FROM (VALUES %s) AS source ({','.join(columns)})"
+        query = f"WITH merged AS ({self._upsert_query(table, columns, source)} " \
+                f"{self._returning(table, columns)}){self._projection_cte(table)} " \
+                f"SELECT inserted{'' if self.change_log_id is None else ', object_id'} FROM merged"
+        # One statement per batch, the default page size of 100 rows would split it
+        result = execute_values(cursor, query, rows, page_size=len(rows) or 1, fetch=True)
+
+        if self.change_log_id is not None:
+            return (len(rows), *self._log_changes(cursor, table, [row[0] for row in rows], result))
+
+        inserted = sum(1 for (is_inserted, *_) in result if is_inserted)
+        return len(rows), inserted, len(result) - inserted
+
+    @staticmethod
+    def _copy_value(value) -> bytes:
+        """Returns value in the COPY text format, UTF-8 encoded.
+
+        Json values are serialized to bytes directly. Serialized JSON contains no tabs or newlines, only backslashes
+        need to be escaped.
+        """
+        if value is None:
+            return b"\\N"
+        if isinstance(value, Json):
+            return dumps_bytes(value.adapted).replace(b"\\", b"\\\\")
+        text = str(value)
+        if RX_COPY_ESCAPE.search(text):
+            text = text.translate(COPY_ESCAPE)
+        return text.encode("utf-8")
+
+    def _copy(self, cursor, table: str, rows: List[list], columns: list) -> int:
+        """Copies rows into table, ordered by id. Returns the number of copied rows.
+
+        When rows contain the same id more than once, the last row is kept, as in insert mode.
+        """
+        unique_rows = {row[0]: row for row in rows}
+        copy_value = self._copy_value
+
+        data = io.BytesIO()
+        for id_ in sorted(unique_rows):
+            data.write(b"\t".join([copy_value(value) for value in unique_rows[id_]]))
+            data.write(b"\n")
+        data.seek(0)
+
+        cursor.copy_expert(f"COPY {table} ({','.join(columns)}) FROM STDIN WITH (ENCODING 'UTF8')", data)
+        return len(unique_rows)
+
+    def _copy_staging(self, cursor, table: str, rows: List[list], columns: list,
+                      prepared: bool = False) -> tuple[str, int]:
+        """Copies rows into a temporary staging table for table.
+
+        A prepared transaction cannot use temporary tables, with prepared the staging table is an unlogged table of
+        the connection that has to be dropped before the transaction ends.
+
+        Returns the name of the staging table and the number of copied rows.
+        """
+        if prepared:
+            staging = f"{table}_staging_{cursor.connection.get_backend_pid()}"
+            cursor.execute(f"CREATE UNLOGGED TABLE {staging} AS SELECT {','.join(columns)} FROM {table} WITH NO DATA")
+        else:
+            staging = f"{table}_staging"
+            cursor.execute(f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+                           f"SELECT {','.join(columns)} FROM {table} WITH NO DATA")
+        return staging, self._copy(cursor, staging, rows, columns)
+
+    def _copy_reload(self, cursor, table: str, rows: List[list], columns: list):
+        """Copies rows into a table that is being reloaded.
+
+        In PostGIS mode the rows are copied into a staging table first, to convert the GML geometries on the way.
+        """
+        if self.GML_CONVERSION != CONVERSION_POSTGIS:
+            self._copy(cursor, table, rows, columns)
+            return
+
+        staging, _ = self._copy_staging(cursor, table, rows, columns)
+        cursor.execute(f"INSERT INTO {table} ({','.join(columns)}) "
+                       f"SELECT {self._select_list(columns)} FROM {staging} ORDER BY {columns[0]}")
+
+    def _copy_rows(self, cursor, table: str, rows: List[list], columns: list,
+                   prepared: bool = False) -> tuple[int, int, int]:
+        """Copies rows into a staging table and merges the staging table into table.
+
+        With prepared the rows are written in a prepared transaction, see _copy_staging.
+
+        Returns the number of copied, inserted and updated rows.
+        """
+        staging, total = self._copy_staging(cursor, table, rows, columns, prepared)
+
+        source = f"SELECT {self._select_list(columns)} FROM {staging} ORDER BY {columns[0]}"
+        merge = f"WITH merged AS ({self._upsert_query(table, columns, source)} " \
+                f"{self._returning(table, columns)}){self._projection_cte(table)} "
+
+        if self.change_log_id is not None:
+            cursor.execute(f"{merge}SELECT inserted, object_id FROM merged")
+            result = (total, *self._log_changes(cursor, table, [row[0] for row in rows], cursor.fetchall()))
+        else:
+            cursor.execute(f"{merge}SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged")
+            inserted, merged = cursor.fetchone()
+            result = total, inserted, merged - inserted
+
+        if prepared:
+            cursor.execute(f"DROP TABLE {staging}")
+        return result
+
+    def _returning(self, table: str, columns: list) -> str:
+        """Returns the RETURNING clause of the merge, with the written object_ids when changes are logged and the
+        written objects when table has a projection."""
+        inserted = self._inserted(table, columns)
+        if table in self._projections:
+            return f"RETURNING {inserted} AS inserted, object_id, {self.OBJECT_COLUMN}"
+        if self.change_log_id is not None:
+            return f"RETURNING {inserted} AS inserted, object_id"
+        return f"RETURNING {inserted} AS inserted"
+
+    def _inserted(self, table: str, columns: list) -> str:
+        """Returns the expression that tells whether a row has been inserted by the merge, rather than updated.
+
+        A partitioned table cannot return system columns like xmax. Its rows are looked up in the snapshot of the
+        merge instead, which holds the rows that are updated and not the rows that are inserted by the merge.
+        """
+        if self.PARTITION_COLUMN not in columns:
+            return "xmax = 0"
+        id_name = columns[0]
+        return f"NOT EXISTS (SELECT FROM {table} o WHERE o.{id_name} = {table}.{id_name} " \
+               f"AND o.{self.PARTITION_COLUMN} = {table}.{self.PARTITION_COLUMN})"
+
+    def _projection_cte(self, table: str) -> str:
+        """Returns the CTE that projects the merged objects into the projection table of table, if any.
+
+        The projection is written in the same statement as the merge, only for the inserted and updated rows.
+        """
+        if table not in self._projections:
+            return ""
+        return f", projected AS ({self._projection_query(table, 'merged')})"
+
+    def _projection_query(self, table: str, source: str) -> str:
+        """Returns the query that writes the projection of the objects in source into the projection table."""
+        columns = self._projections[table]
+        names = [column["name"] for column in columns]
+        # Keys are written as literals, the merge is executed with execute_values which takes no other parameters
+        expressions = [f"({self.OBJECT_COLUMN}->>'{column['key']}')::{self.PROJECTION_TYPES[column['type']]}"
+                       for column in columns]
+        return f"INSERT INTO {self.PROJECTION_TABLE.format(table=table)} (object_id,{','.join(names)}) " \
+               f"SELECT object_id,{','.join(expressions)} FROM {source} " \
+               f"ON CONFLICT(object_id) DO UPDATE SET {','.join(f'{name}=EXCLUDED.{name}' for name in names)}"
+
+    def _check_projection(self, columns: list[dict]):
+        for column in columns:
+            if column["type"] not in self.PROJECTION_TYPES:
+                raise GOBException(f"Invalid type {column['type']} for projection column {column['name']}")
+            if "'" in column["key"]:
+                raise GOBException(f"Invalid key {column['key']} for projection column {column['name']}")
+
+    def ensure_projection(self, table: str, columns: list[dict]) -> bool:
+        """Creates the projection table of table with typed columns for attributes of the object, and keeps it in sync
+        with table on every write. Returns True when the projection table has been (re)created and filled.
+
+        Each column has a name, the key of the attribute in the object and a type (see PROJECTION_TYPES), for
+        example {"name": "bouwjaar", "key": "oorspronkelijkBouwjaar", "type": "integer"}. The projection table is
+        recreated when the columns change, and dropped when no columns are declared.
+        """
+        self._check_projection(columns)
+        projection = self.PROJECTION_TABLE.format(table=table)
+
+        # The declared columns are kept as comment on the projection table, to detect changes
+        definition = json.dumps(columns, sort_keys=True)
+        self._projections.pop(table, None)
+
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT obj_description(to_regclass(%s), 'pg_class')", (projection,))
+                recreate = cursor.fetchone()[0] != (definition if columns else None)
+                if recreate:
+                    cursor.execute(f"DROP TABLE IF EXISTS {projection}")
+                if recreate and columns:
+                    types = ','.join(f"{column['name']} {self.PROJECTION_TYPES[column['type']]}" for column in columns)
+                    cursor.execute(f"CREATE TABLE {projection} (object_id varchar PRIMARY KEY,{types})")
+                    cursor.execute(f"COMMENT ON TABLE {projection} IS %s", (definition,))
+                    self._projections[table] = columns
+                    cursor.execute(self._projection_query(table, table))
+            self.connection.commit()
+        except Error as e:
+            raise GOBException(f'Error creating projection of table {table}. Error: {e}')
+
+        if columns:
+            self._projections[table] = columns
+        return recreate and bool(columns)
+
+    def _current_query(self, source: str, condition: str = "TRUE") -> str:
+        """Returns the query that selects the current voorkomen of the objects in source that match condition.
+
+        The current voorkomen is the voorkomen with the highest volgnummer that is current today.
+        """
+        return f"SELECT DISTINCT ON ({self.IDENTIFICATIE}) {self.IDENTIFICATIE} AS identificatie," \
+               f"{','.join(self.CURRENT_COLUMNS)} FROM {source} WHERE ({condition}) AND {self.CURRENT_CONDITION} " \
+               f"ORDER BY {self.IDENTIFICATIE},{self.VOLGNUMMER} DESC NULLS LAST"
+
+    def _update_current(self, cursor, table: str, object_ids: list[str]):
+        """Updates the current voorkomen of the objects with object_ids in the current table of table.
+
+        Objects without a current voorkomen are removed from the current table. Unchanged rows are left as they are.
+        """
+        identificaties = sorted({object_id.split(".")[0] for object_id in object_ids})
+        self._merge_current(cursor, table, f"{self.IDENTIFICATIE} = ANY(%(identificaties)s)",
+                            "identificatie = ANY(%(identificaties)s)", {"identificaties": identificaties})
+
+    def _merge_current(self, cursor, table: str, condition: str, current_condition: str, params: dict):
+        """Merges the current voorkomens of the objects in table that match condition into the current table. The
+        objects that match current_condition in the current table, and have no current voorkomen, are removed."""
+        current = self.CURRENT_TABLE.format(table=table)
+        columns = ','.join(self.CURRENT_COLUMNS)
+
+        cursor.execute(
+            f"WITH selected AS ({self._current_query(table, condition)}), "
+            f"deleted AS (DELETE FROM {current} WHERE {current_condition} "
+            f"AND NOT EXISTS (SELECT FROM selected WHERE selected.identificatie = {current}.identificatie)) "
+            f"INSERT INTO {current} (identificatie,{columns}) SELECT identificatie,{columns} FROM selected "
+            f"ON CONFLICT(identificatie) DO UPDATE SET "
+            f"{','.join(f'{column}=EXCLUDED.{column}' for column in self.CURRENT_COLUMNS)} "
+            f"WHERE {current}.object_id <> EXCLUDED.object_id "
+            f"OR {current}.{self.HASH_COLUMN} IS DISTINCT FROM EXCLUDED.{self.HASH_COLUMN}",
+            params
+        )
+
+    def refresh_current(self, table: str, gemeente: str):
+        """Updates the current table of table, if any, for the objects of gemeente of which a voorkomen has begun or
+        ended since the previous refresh. The current voorkomen depends on the date, see CURRENT_CONDITION.
+
+        The objects that have been written since are up to date already, see _update_current. The first refresh of
+        gemeente updates all its objects.
+        """
+        if table not in self.current_tables:
+            return
+
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"SELECT to_char(refreshed, 'YYYY-MM-DD') FROM {self.CURRENT_REFRESH_TABLE} "
+                               f"WHERE table_name = %s AND gemeente = %s", (table, gemeente))
+                refreshed = cursor.fetchone()
+                if refreshed is None:
+                    self._merge_current(cursor, table, "gemeente = %(gemeente)s", "gemeente = %(gemeente)s",
+                                        {"gemeente": gemeente})
+                else:
+                    cursor.execute(f"SELECT object_id FROM {table} "
+                                   f"WHERE gemeente = %(gemeente)s AND ({self.CHANGED_CONDITION})",
+                                   {"gemeente": gemeente, "since": refreshed[0]})
+                    self._update_current(cursor, table, [object_id for object_id, in cursor.fetchall()])
+                self._set_refreshed(cursor, table, gemeente)
+            self.connection.commit()
+        except Error as e:
+            raise GOBException(f'Error refreshing current table of table {table}. Error: {e}')
+
+    def _reload_current(self, cursor, table: str, reload: str, gemeente: str):
+        """Replaces the objects of gemeente in the current table of table, if any, with the current voorkomens in
+        reload."""
+        if table in self.current_tables:
+            current = self.CURRENT_TABLE.format(table=table)
+            cursor.execute(f"DELETE FROM {current} WHERE gemeente = %s", (gemeente,))
+            cursor.execute(f"INSERT INTO {current} (identificatie,{','.join(self.CURRENT_COLUMNS)}) "
+                           f"{self._current_query(reload)}")
+            self._set_refreshed(cursor, table, gemeente)
+
+    def _set_refreshed(self, cursor, table: str, gemeente: str):
+        """Registers that the objects of gemeente in the current table of table are current as of today."""
+        cursor.execute(f"INSERT INTO {self.CURRENT_REFRESH_TABLE} (table_name, gemeente, refreshed) "
+                       f"VALUES (%s, %s, CURRENT_DATE) "
+                       f"ON CONFLICT (table_name, gemeente) DO UPDATE SET refreshed = EXCLUDED.refreshed",
+                       (table, gemeente))
+
+    def start_change_log(self, mutation_import_id: int, retention_days: int):
+        """Logs the changes of all following writes for mutation_import_id, see get_changes.
+
+        Changes that have been logged more than retention_days ago are removed.
+        """
+        self.change_log_id = mutation_import_id
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.CHANGE_LOG_TABLE} WHERE logged_at < now() - %s * interval '1 day'",
+                           (retention_days,))
+        self.connection.commit()
+
+    def _log_changes(self, cursor, table: str, object_ids: list[str], merged: list[tuple]) -> tuple[int, int]:
+        """Logs the changes of writing the rows with object_ids to table. merged holds the (inserted, object_id) of
+        the inserted and updated rows, the other rows are unchanged.
+
+        Returns the number of inserted and updated rows.
+        """
+        inserted = [object_id for is_inserted, object_id in merged if is_inserted]
+        updated = [object_id for is_inserted, object_id in merged if not is_inserted]
+        unchanged = set(object_ids).difference(inserted, updated)
+
+        for change, ids in ((self.CHANGE_INSERTED, inserted), (self.CHANGE_UPDATED, updated),
+                            (self.CHANGE_UNCHANGED, unchanged)):
+            if ids:
+                cursor.execute(f"INSERT INTO {self.CHANGE_LOG_TABLE} "
+                               f"(mutation_import_id,table_name,change,object_ids) VALUES (%s,%s,%s,%s)",
+                               (self.change_log_id, table, change, sorted(ids)))
+        return len(inserted), len(updated)
+
+    def _log_reload(self, cursor, table: str, reload: str, gemeente: str):
+        """Logs the changes of gemeente in reload compared to table, including the deleted objects."""
+        if self.change_log_id is None:
+            return
+
+        cursor.execute(f"INSERT INTO {self.CHANGE_LOG_TABLE} (mutation_import_id,table_name,change,object_ids) "
+                       f"SELECT %s, %s, change, array_agg(object_id ORDER BY object_id) FROM ("
+                       f"SELECT n.object_id, CASE WHEN o.object_id IS NULL THEN '{self.CHANGE_INSERTED}' "
+                       f"WHEN o.{self.HASH_COLUMN} IS DISTINCT FROM n.{self.HASH_COLUMN} THEN '{self.CHANGE_UPDATED}' "
+                       f"ELSE '{self.CHANGE_UNCHANGED}' END AS change "
+                       f"FROM {reload} n LEFT JOIN {table} o ON o.object_id = n.object_id AND o.gemeente = n.gemeente "
+                       f"WHERE n.gemeente = %s "
+                       f"UNION ALL "
+                       f"SELECT o.object_id, '{self.CHANGE_DELETED}' FROM {table} o WHERE o.gemeente = %s "
+                       f"AND NOT EXISTS (SELECT FROM {reload} n "
+                       f"WHERE n.object_id = o.object_id AND n.gemeente = o.gemeente)"
+                       f") changes GROUP BY change", (self.change_log_id, table, gemeente, gemeente))
+
+    def get_changes(self, mutation_import_id: int, table: str) -> dict[str, list[str]]:
+        """Returns the object_ids per change (inserted, updated, unchanged or deleted) that mutation_import_id has
+        written to table.
+        """
+        changes = defaultdict(list)
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT change, object_id FROM bag_changes(%s, %s) ORDER BY object_id",
+                           (mutation_import_id, table))
+            for change, object_id in cursor:
+                changes[change].append(object_id)
+        return dict(changes)
+
+    def closed_object_ids(self, table: str, gemeente: str) -> set[str]:
+        """Returns the object_ids of the closed voorkomens of gemeente in table."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"SELECT object_id FROM {table} WHERE gemeente = %s AND {self.CLOSED_CONDITION}",
+                           (gemeente,))
+            object_ids = {object_id for object_id, in cursor}
+        # End the read transaction, a prepared write must be started outside a transaction, see _write_prepared
+        self.connection.commit()
+        return object_ids
+
+    def ensure_attribute_indexes(self, table: str, indexes: list[dict]) -> list[str]:
+        """Creates the expression indexes on the attributes of the object in table, and drops the ones that are no
+        longer declared. Returns the names of the created indexes.
+
+        Each index has a name and the key of the attribute in the object, for example
+        {"name": "status", "key": "status"} creates ix_bag_panden_attr_status on object->>'status'.
+        An existing index is kept as it is, give it another name to change its key.
+        """
+        declared = {self.ATTRIBUTE_INDEX.format(table=table, name=index["name"]): index["key"] for index in indexes}
+        self._attribute_keys[table] = set(declared.values())
+        prefix = self.ATTRIBUTE_INDEX.format(table=table, name="")
+
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT indexname FROM pg_indexes "
+                               "WHERE schemaname = current_schema() AND tablename = %s", (table,))
+                existing = {name for name, in cursor.fetchall() if name.startswith(prefix)}
+
+                for name in sorted(existing - declared.keys()):
+                    cursor.execute(f"DROP INDEX {name}")
+
+                created = [name for name in declared if name not in existing]
+                for name in created:
+                    cursor.execute(f"CREATE INDEX {name} ON {table} (({self.OBJECT_COLUMN}->>%s))", (declared[name],))
+            self.connection.commit()
+        except Error as e:
+            raise GOBException(f'Error indexing table {table}. Error: {e}')
+
+        return created
+
+    def _partition(self, table: str, gemeente: str) -> str:
+        """Returns the name of the partition of gemeente in table."""
+        if not re.fullmatch(r"\w+", gemeente or ""):
+            raise GOBException(f"Invalid gemeente {gemeente}")
+        return self.PARTITION_TABLE.format(table=table, gemeente=gemeente)
+
+    def ensure_partition(self, table: str, gemeente: str) -> bool:
+        """Creates the partition of gemeente in table. Returns True when the partition has been created."""
+        partition = self._partition(table, gemeente)
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s)", (partition,))
+                created = cursor.fetchone()[0] is None
+                if created:
+                    cursor.execute(f"CREATE TABLE {partition} PARTITION OF {table} FOR VALUES IN (%s)", (gemeente,))
+            self.connection.commit()
+        except Error as e:
+            raise GOBException(f'Error creating partition of table {table}. Error: {e}')
+        return created
+
+    @contextmanager
+    def reload_table(self, table: str, gemeente: str, keep_closed: bool = False) -> Iterator[str]:
+        """Context to reload all rows of gemeente in table.
+
+        Yields the name of a new table for the partition of gemeente. The new table is unlogged and has no indexes
+        while the rows of gemeente are written to it. On leaving the context the new table gets the indexes and
+        constraints of the partition, and replaces the partition in one transaction. Readers of table do not see
+        the new rows until then, the partitions of other gemeentes are not touched. On errors the new table is
+        dropped and table is left as it was.
+
+        With keep_closed the closed voorkomens of gemeente (see closed_object_ids) are kept as well, these must not
+        be written again. Their objects are stored in the current format, see _keep_closed.
+        """
+        partition = self._partition(table, gemeente)
+        reload = f"{partition}_reload"
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {reload}")
+                cursor.execute(f"CREATE UNLOGGED TABLE {reload} (LIKE {table} INCLUDING DEFAULTS)")
+            if keep_closed:
+                self._keep_closed(table, partition, reload)
+            self.connection.commit()
+
+            self._reloading[reload] = table
+            yield reload
+            self._reloading.pop(reload)
+
+            with self.connection.cursor() as cursor:
+                self._notify_batch(cursor, table, self._count_reload(cursor, table, reload, gemeente))
+                self._log_reload(cursor, table, reload, gemeente)
+                self._keep_last_update(cursor, partition, reload)
+                self._reload_projection(cursor, table, reload, gemeente)
+                self._reload_current(cursor, table, reload, gemeente)
+                self._swap_partition(cursor, table, gemeente, reload)
+            self.connection.commit()
+        except Exception as e:
+            self._reloading.pop(reload, None)
+            self._drop_reload_table(reload)
+            if isinstance(e, Error):
+                raise GOBException(f'Error reloading table {table}. Error: {e}')
+            raise
+
+    def _keep_closed(self, table: str, partition: str, reload: str):
+        """Copies the closed voorkomens of partition of table into reload.
+
+        The objects are encoded again when COMPACT_OBJECTS is set, with the codes and the plain keys (see
+        _plain_keys) of now. A key that has become projected or indexed since the voorkomen was written is then
+        readable in SQL, as for the written rows. Otherwise the objects are expanded when objects of table have
+        been stored compact. The hash is computed over the expanded object and is not changed.
+        """
+        codes = self._key_codes(table, set())
+        obj = self.OBJECT_COLUMN
+        if self.COMPACT_OBJECTS:
+            # A closed voorkomen has an eindGeldigheid, so its object is never NULL or empty
+            obj = f"(SELECT jsonb_object_agg(coalesce(k.code::text, o.key), o.value) " \
+                  f"FROM jsonb_each(bag_expand_object(%(table)s, {self.OBJECT_COLUMN})) o " \
+                  f"LEFT JOIN {self.OBJECT_KEYS_TABLE} k ON k.table_name = %(table)s AND k.key = o.key " \
+                  f"AND k.key <> ALL(%(plain_keys)s)) AS {self.OBJECT_COLUMN}"
+        elif codes:
+            obj = f"bag_expand_object(%(table)s, {self.OBJECT_COLUMN}) AS {self.OBJECT_COLUMN}"
+
+        columns = ("id", *self.CURRENT_COLUMNS)
+        select_list = ",".join(obj if column == self.OBJECT_COLUMN else column for column in columns)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {reload} ({','.join(columns)}) "
+                           f"SELECT {select_list} FROM {partition} WHERE {self.CLOSED_CONDITION}",
+                           {"table": table, "plain_keys": sorted(self._plain_keys(table))})
+
+    def _count_reload(self, cursor, table: str, reload: str, gemeente: str) -> dict:
+        """Counts the rows of gemeente in reload that are new, changed or unchanged compared to table."""
+        cursor.execute(f"SELECT count(*), "
+                       f"count(*) FILTER (WHERE o.object_id IS NULL), "
+                       f"count(*) FILTER (WHERE o.object_id IS NOT NULL "
+                       f"AND o.{self.HASH_COLUMN} IS DISTINCT FROM n.{self.HASH_COLUMN}) "
+                       f"FROM {reload} n LEFT JOIN {table} o ON o.object_id = n.object_id AND o.gemeente = n.gemeente "
+                       f"WHERE n.gemeente = %s", (gemeente,))
+        return self._count(*cursor.fetchone())
+
+    def _keep_last_update(self, cursor, partition: str, reload: str):
+        """Gives the unchanged rows in reload the last_update of their row in partition, as write_rows leaves the
+        last_update of unchanged rows. The last_update then is the date of the import that last changed a row."""
+        cursor.execute(f"UPDATE {reload} n SET last_update = o.last_update FROM {partition} o "
+                       f"WHERE o.object_id = n.object_id AND o.{self.HASH_COLUMN} = n.{self.HASH_COLUMN} "
+                       f"AND o.last_update <> n.last_update")
+
+    def _reload_projection(self, cursor, table: str, reload: str, gemeente: str):
+        """Replaces the objects of gemeente in the projection table of table, if any, with the objects in reload."""
+        if table in self._projections:
+            cursor.execute(f"DELETE FROM {self.PROJECTION_TABLE.format(table=table)} p USING {table} o "
+                           f"WHERE o.object_id = p.object_id AND o.gemeente = %s", (gemeente,))
+            cursor.execute(self._projection_query(table, reload))
+
+    def _drop_reload_table(self, reload: str):
+        self.connection.rollback()
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {reload}")
+        self.connection.commit()
+
+    @staticmethod
+    def _index_statements(cursor, table: str, reload: str) -> tuple[list[str], list[str]]:
+        """Returns the statements to create the constraints and indexes of table on reload, and the statements to
+        rename them once reload has replaced table. Until then their names get a _reload suffix.
+        """
+        create, rename = [], []
+
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = %s::regclass AND contype IN ('p', 'u')", (table,))
+        constraints = cursor.fetchall()
+        for name, definition in constraints:
+            create.append(f"ALTER TABLE {reload} ADD CONSTRAINT {name}_reload {definition}")
+            rename.append(f"ALTER TABLE {table} RENAME CONSTRAINT {name}_reload TO {name}")
+
+        # Constraints have their own index, which is created with the constraint
+        constraint_names = {name for name, _ in constraints}
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes "
+                       "WHERE schemaname = current_schema() AND tablename = %s", (table,))
+        for name, definition in cursor.fetchall():
+            if name not in constraint_names:
+                create.append(re.sub(rf"INDEX {name} ON (\w+\.)?{table} ", f"INDEX {name}_reload ON {reload} ",
+                                     definition))
+                rename.append(f"ALTER INDEX {name}_reload RENAME TO {name}")
+
+        return create, rename
+
+    def _swap_partition(self, cursor, table: str, gemeente: str, reload: str):
+        """Indexes reload and replaces the partition of gemeente in table with reload. The swap is committed by the
+        caller."""
+        partition = self._partition(table, gemeente)
+        create, rename = self._index_statements(cursor, partition, reload)
+
+        cursor.execute(f"ALTER TABLE {reload} SET LOGGED")
+        # Lets the attach skip checking that all rows of reload belong to the partition
+        cursor.execute(f"ALTER TABLE {reload} ADD CONSTRAINT {reload}_gemeente "
+                       f"CHECK (gemeente IS NOT NULL AND gemeente = %s)", (gemeente,))
+        for statement in create:
+            cursor.execute(statement)
+
+        # The indexes of reload are attached to the indexes of table
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {reload} FOR VALUES IN (%s)", (gemeente,))
+        cursor.execute(f"ALTER TABLE {reload} DROP CONSTRAINT {reload}_gemeente")
+
+        cursor.execute(f"DROP TABLE {partition}")
+        cursor.execute(f"ALTER TABLE {reload} RENAME TO {partition}")
+        for statement in rename:
+            cursor.execute(statement)
@@ -0,0 +1,143 @@
+"""Filters the objects in BAG extracts before they are formatted.
+
+A predicate is given as query to BagExtractDatastore.query, as a dict with one or more of:
+
+    identificatie   a list of identificaties, or a range {"from": ..., "to": ...} (both inclusive and optional)
+    status          a status, or a list of statuses
+    geldig          a date window {"from": ..., "to": ...}, selects the voorkomens that are valid at any time in
+                    the window (from inclusive, to exclusive, both optional)
+    current         true to select only the current voorkomens, see is_current
+
+Only the fields that are needed are read from the element, the cheapest checks go first.
+"""
+import datetime as dt
+from typing import Optional, Union
+from xml.etree import ElementTree
+
+from gobcore.exceptions import GOBException
+
+OBJECTEN = "{www.kadaster.nl/schemas/lvbag/imbag/objecten/v20200601}"
+HISTORIE = "{www.kadaster.nl/schemas/lvbag/imbag/historie/v20200601}"
+
+STATUS = f"{OBJECTEN}status"
+VOORKOMEN = f"{OBJECTEN}voorkomen/{HISTORIE}Voorkomen/{HISTORIE}"
+BEGIN_GELDIGHEID = f"{VOORKOMEN}beginGeldigheid"
+EIND_GELDIGHEID = f"{VOORKOMEN}eindGeldigheid"
+EIND_REGISTRATIE = f"{VOORKOMEN}eindRegistratie"
+
+KEYS = ("identificatie", "status", "geldig", "current")
+
+# The keys of the dates in the stored (flattened) objects, see current_condition
+BEGIN_GELDIGHEID_KEY = "voorkomen/Voorkomen/beginGeldigheid"
+EIND_GELDIGHEID_KEY = "voorkomen/Voorkomen/eindGeldigheid"
+EIND_REGISTRATIE_KEY = "voorkomen/Voorkomen/eindRegistratie"
+
+
+def _text(element: ElementTree.Element, path: str) -> Optional[str]:
+    elm = element.find(path)
+    return None if elm is None or elm.text is None else elm.text.strip()
+
+
+def _range(query: dict, key: str, convert=str) -> tuple[Optional[str], Optional[str]]:
+    """Returns the from and to values of the range in query[key]."""
+    value = query[key]
+    if not isinstance(value, dict) or not value or set(value) - {"from", "to"}:
+        raise GOBException(f"Invalid {key} {value} in query")
+    try:
+        return tuple(None if value.get(name) is None else str(convert(value[name])) for name in ("from", "to"))
+    except ValueError:
+        raise GOBException(f"Invalid {key} {value} in query")
+
+
+def _date(value: str) -> dt.date:
+    return dt.date.fromisoformat(value)
+
+
+def is_current(begin_geldigheid: Optional[str], eind_geldigheid: Optional[str], eind_registratie: Optional[str],
+               today: str) -> bool:
+    """Returns whether a voorkomen is current on today: it has no eindRegistratie, it has begun on or before today
+    and it has no eindGeldigheid or an eindGeldigheid after today.
+
+    Dates are compared as ISO formatted strings, of beginGeldigheid only the date.
+    """
+    return eind_registratie is None \
+        and (begin_geldigheid is None or begin_geldigheid[:10] <= today) \
+        and (eind_geldigheid is None or eind_geldigheid > today)
+
+
+def current_condition(column: str, today: str) -> str:
+    """Returns the SQL condition that selects the current voorkomens (see is_current) of the objects in JSONB
+    column, with today an SQL expression for the ISO formatted date."""
+    begin, eind, eind_registratie = (f"{column}->>'{key}'"
+                                     for key in (BEGIN_GELDIGHEID_KEY, EIND_GELDIGHEID_KEY, EIND_REGISTRATIE_KEY))
+    return f"{eind_registratie} IS NULL " \
+           f"AND ({begin} IS NULL OR left({begin}, 10) <= {today}) " \
+           f"AND ({eind} IS NULL OR {eind} > {today})"
+
+
+def changed_condition(column: str, since: str, today: str) -> str:
+    """Returns the SQL condition that selects the voorkomens of the objects in JSONB column that have begun or ended
+    after since and on or before today, with since and today SQL expressions for ISO formatted dates. Whether a
+    voorkomen is current (see is_current) only differs between these dates for these voorkomens."""
+    begin, eind = (f"{column}->>'{key}'" for key in (BEGIN_GELDIGHEID_KEY, EIND_GELDIGHEID_KEY))
+    return f"(left({begin}, 10) > {since} AND left({begin}, 10) <= {today}) " \
+           f"OR ({eind} > {since} AND {eind} <= {today})"
+
+
+class Predicate:
+    """Selects the objects that match query, see the module docstring for the format of query."""
+
+    def __init__(self, query: dict, today: Optional[dt.date] = None):
+        if not isinstance(query, dict) or set(query) - set(KEYS):
+            raise GOBException(f"Invalid query {query}")
+
+        self.ids = None
+        self.id_range = None
+        if "identificatie" in query:
+            if isinstance(query["identificatie"], list):
+                self.ids = frozenset(query["identificatie"])
+            else:
+                self.id_range = _range(query, "identificatie")
+
+        status = query.get("status")
+        self.statuses = None if status is None else frozenset([status] if isinstance(status, str) else status)
+
+        # Dates are compared as ISO formatted strings, like they are in the extract
+        self.geldig = _range(query, "geldig", _date) if "geldig" in query else None
+        self.today = (today or dt.date.today()).isoformat() if query.get("current") else None
+
+    def __call__(self, element: ElementTree.Element, identificatie: Optional[str]) -> bool:
+        """Returns whether the object in element, with the given identificatie, matches."""
+        if self.ids is not None and identificatie not in self.ids:
+            return False
+        if self.id_range is not None and not self._in_range(identificatie, *self.id_range):
+            return False
+        if self.statuses is not None and _text(element, STATUS) not in self.statuses:
+            return False
+        if self.today is not None and not self._is_current(element):
+            return False
+        if self.geldig is not None and not self._is_geldig(element, *self.geldig):
+            return False
+        return True
+
+    @staticmethod
+    def _in_range(value: Optional[str], from_: Optional[str], to: Optional[str]) -> bool:
+        return value is not None and (from_ is None or value >= from_) and (to is None or value <= to)
+
+    def _is_current(self, element: ElementTree.Element) -> bool:
+        return is_current(_text(element, BEGIN_GELDIGHEID), _text(element, EIND_GELDIGHEID),
+                          _text(element, EIND_REGISTRATIE), self.today)
+
+    @staticmethod
+    def _is_geldig(element: ElementTree.Element, from_: Optional[str], to: Optional[str]) -> bool:
+        """Returns whether the voorkomen in element is valid at some time from from_ until to."""
+        begin = _text(element, BEGIN_GELDIGHEID)
+        if to is not None and (begin is None or begin[:10] >= to):
+            return False
+        eind = _text(element, EIND_GELDIGHEID)
+        return from_ is None or eind is None or eind[:10] > from_
+
+
+def get_predicate(query: Union[dict, str, None]) -> Optional[Predicate]:
+    """Returns the predicate for query, or None to select all objects (for an empty query)."""
+    return Predicate(query) if query else None
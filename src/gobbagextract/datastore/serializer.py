@@ -0,0 +1,19 @@
+"""Serializes the objects that are written to the bag tables to JSON.
+
+orjson writes compact JSON without escaping non-ASCII characters.
+"""
+from typing import Any
+
+import orjson
+
+dumps_bytes = orjson.dumps
+
+
+def dumps(value: Any) -> str:
+    """Returns value serialized to JSON."""
+    return dumps_bytes(value).decode("utf-8")
+
+
+def dumps_sorted_bytes(value: Any) -> bytes:
+    """Returns value serialized to UTF-8 encoded JSON with the keys of objects sorted, for hashing."""
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
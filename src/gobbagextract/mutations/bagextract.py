@@ -1,9 +1,10 @@
 import datetime as dt
-from typing import Tuple
+from typing import Optional, Tuple
 
 from dateutil.relativedelta import relativedelta
 
-from gobbagextract.config import ArtikelNummer
+from gobbagextract.config import ArtikelNummer, BAGEXTRACT_DAILY_IMPORT_COST, BAGEXTRACT_FULL_IMPORT_COST, \
+    BAGEXTRACT_SKIP_AHEAD_MIN_SAVING
 from gobbagextract.database.model import MutationImport
 from gobbagextract.mutations.afgifte import Afgifte
 from gobbagextract.mutations.exception import NothingToDo
@@ -19,6 +20,11 @@ class BagExtractMutationsHandler:
     # Number of periods to lookback for inital import
     INITIAL_IMPORT_RETRY = 5
 
+    # Cost model to decide between replaying the mutation backlog or skipping ahead to the newest full import
+    DAILY_IMPORT_COST = BAGEXTRACT_DAILY_IMPORT_COST
+    FULL_IMPORT_COST = BAGEXTRACT_FULL_IMPORT_COST
+    SKIP_AHEAD_MIN_SAVING = BAGEXTRACT_SKIP_AHEAD_MIN_SAVING
+
     SoapHandler = BagSoapHandler
 
     @staticmethod
@@ -52,12 +58,56 @@ class BagExtractMutationsHandler:
 
         return self.get_daily_mutations(date) + (date,)
 
+    @staticmethod
+    def _next_date(last_import: MutationImport) -> dt.date:
+        return Afgifte(Bestandsnaam=last_import.filename).get_date() + dt.timedelta(days=1)
+
+    def _import_cost(self, start: dt.date, end: dt.date) -> int:
+        """Returns the cost of importing all files from start up to and including end, one by one."""
+        days = (end - start).days + 1
+        fulls = sum(1 for n in range(days) if (start + dt.timedelta(days=n)).day == self.FULL_IMPORT_DAY)
+        return fulls * self.FULL_IMPORT_COST + (days - fulls) * self.DAILY_IMPORT_COST
+
+    def skip_ahead(self, next_date: dt.date, gemeente: str) -> Optional[tuple[ImportMode, Afgifte, dt.date]]:
+        """Returns the newest available full import after next_date when skipping ahead to it is cheaper than
+        replaying the mutation backlog from next_date up to today, or None when the backlog should be replayed.
+
+        Both routes end with today's mutations. Replaying the backlog also passes through every full import on the way.
+        Full imports that are not (yet) available are passed over in favour of the full import of the period before.
+        """
+        today = dt.date.today()
+        replay_cost = self._import_cost(next_date, today)
+        full_date = self._last_full_import_date(today)
+
+        while full_date > next_date:
+            skip_cost = self._import_cost(full_date, today)
+            if replay_cost - skip_cost < self.SKIP_AHEAD_MIN_SAVING:
+                break
+
+            try:
+                result = self.get_full(full_date, gemeente) + (full_date,)
+            except NothingToDo:
+                logger.warning(f"Full import of {full_date} not available to skip ahead to")
+                full_date = self._last_full_import_date(full_date - dt.timedelta(days=1))
+                continue
+
+            logger.info(f"Skip ahead to full import of {full_date} (cost {skip_cost}) "
+                        f"instead of replaying the backlog from {next_date} (cost {replay_cost})")
+            return result
+
+        if next_date < today:
+            logger.info(f"Replay the backlog from {next_date} (cost {replay_cost})")
+        return None
+
     def start_next(self, last_import: MutationImport, gemeente: str) -> tuple[ImportMode, Afgifte, dt.date]:
-        date = Afgifte(Bestandsnaam=last_import.filename).get_date()
-        next_date = date + dt.timedelta(days=1)
+        next_date = self._next_date(last_import)
 
         if next_date.day == self.FULL_IMPORT_DAY:
-            return self.get_full(next_date, gemeente) + (next_date, )
+            try:
+                return self.get_full(next_date, gemeente) + (next_date, )
+            except NothingToDo:
+                # The rollout of a full import can take up to 5 days, the mutations of the day keep the data current
+                logger.warning(f"Full import of {next_date} not available, import the mutations of {next_date}")
 
         return self.get_daily_mutations(next_date) + (next_date, )
 
@@ -75,11 +125,16 @@ class BagExtractMutationsHandler:
             if afgifte.get_gemeente() == gemeente and afgifte.get_date() == date:
                 return ImportMode.FULL, afgifte
 
-        # TODO: This implies when file is not yet availble on the 15th we are failing this workflow!
-        #  Possible solution: Adjust the workflow so it will pick up the last available full import
-        #  and all daily mutations after that. (and thus skip the missing full)
         raise NothingToDo.file_not_available(self._full_filename(date, gemeente))
 
+    def _last_full(self, date: dt.date, gemeente: str) -> Afgifte:
+        """Returns the full import of the period of date, or the one of the period before when it is not available
+        (yet), see start_next."""
+        try:
+            return self.get_full(date, gemeente)[1]
+        except NothingToDo:
+            return self.get_full(self._last_full_import_date(date) - dt.timedelta(days=1), gemeente)[1]
+
     def get_daily_mutations(self, date: dt.date) -> tuple[ImportMode, Afgifte]:
         # search for mutations in a 10 day window (Should be available on `date`)
         kwargs = {
@@ -114,7 +169,8 @@ class BagExtractMutationsHandler:
         elif not last_import.is_ended():
             mode, afgifte, date = self.restart_import(last_import)
         else:
-            mode, afgifte, date = self.start_next(last_import, gemeente)
+            mode, afgifte, date = self.skip_ahead(self._next_date(last_import), gemeente) \
+                or self.start_next(last_import, gemeente)
 
         mutation_import = MutationImport()
         mutation_import.catalogue = dataset["catalogue"]
@@ -127,7 +183,7 @@ class BagExtractMutationsHandler:
 
         if mode == ImportMode.MUTATIONS:
             # The BAGExtract Datastore needs the last full download location as well to determine the ID's to import
-            update_config["last_full_download_location"] = self.get_full(date, gemeente)[1]
+            update_config["last_full_download_location"] = self._last_full(date, gemeente)
 
         # Update read_config for importer
         dataset["source"]["read_config"] |= update_config
@@ -27,5 +27,17 @@ class MutationsHandler:
     def get_next_import(self, last_import: MutationImport) -> Tuple[MutationImport, dict, datetime.date]:
         return self.handler.handle_import(last_import, self.dataset)
 
+    def get_import_after(self, mutation_import: MutationImport, dataset: dict) \
+            -> Tuple[MutationImport, dict, datetime.date]:
+        """Returns the import that follows mutation_import once it has ended. The import is planned on dataset,
+        which should be a copy of self.dataset when mutation_import is still running.
+        """
+        ended_import = MutationImport(
+            filename=mutation_import.filename,
+            mode=mutation_import.mode,
+            ended_at=datetime.datetime.utcnow()
+        )
+        return self.handler.handle_import(ended_import, dataset)
+
     def have_next(self, mutation_import: MutationImport):
         return self.handler.have_next(mutation_import, self.dataset)
@@ -0,0 +1,121 @@
+import copy
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from gobcore.enum import ImportMode
+from gobcore.logging.logger import logger
+
+from gobbagextract.config import BAGEXTRACT_PREFETCH_MAX_SIZE
+from gobbagextract.database.model import MutationImport
+from gobbagextract.datastore.bag_extract import BagExtractDatastore
+from gobbagextract.mutations.exception import NothingToDo
+from gobbagextract.mutations.handler import MutationsHandler
+from gobbagextract.prepare.prepare_client import PrepareClient
+
+
+class Prefetcher:
+    """
+    Prepares the next import in the background while the current import is being processed.
+
+    The import that follows the current import is planned by the MutationsHandler, after which its source datastore
+    downloads and extracts the file (and the last full file for a mutations import) in a separate thread.
+    At most one import is prefetched at a time, and only when its files and their extracted contents are estimated
+    to take at most max_size bytes, see scratch_size. This bounds the extra scratch space that is used.
+    """
+    # The extracted XML files of a zip file are estimated to take at most this many times the size of the zip file
+    EXTRACT_FACTOR = 10
+
+    def __init__(self, mutations_handler: MutationsHandler, max_size: int = BAGEXTRACT_PREFETCH_MAX_SIZE):
+        self.mutations_handler = mutations_handler
+        self.max_size = max_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._future: Optional[Future] = None
+        # Stops the running prefetch between its steps, see BagExtractDatastore.cancelled
+        self._cancelled = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def start(self, mutation_import: MutationImport):
+        """Starts prefetching the import that follows mutation_import."""
+        self.cancel()
+
+        if self.max_size > 0:
+            # The current import may still change the dataset, plan the next import on a copy
+            dataset = copy.deepcopy(self.mutations_handler.dataset)
+            self._cancelled = threading.Event()
+            self._future = self._executor.submit(self._prefetch, mutation_import, dataset, self._cancelled)
+
+    def scratch_size(self, read_config: dict, mode: ImportMode) -> int:
+        """Returns the estimated number of bytes of scratch space that the import of read_config takes: its zip
+        files, and the XML files that are extracted from them. A mutations import extracts the last full file too."""
+        keys = ["download_location"] + (["last_full_download_location"] if mode == ImportMode.MUTATIONS else [])
+        return sum(int(read_config[key].Bestandsgrootte or 0) for key in keys) * (1 + self.EXTRACT_FACTOR)
+
+    def _prefetch(self, mutation_import: MutationImport, dataset: dict,
+                  cancelled: threading.Event) -> Optional[tuple[str, BagExtractDatastore]]:
+        try:
+            next_import, next_dataset, date = self.mutations_handler.get_import_after(mutation_import, dataset)
+        except NothingToDo:
+            return None
+
+        mode = ImportMode(next_import.mode)
+        if cancelled.is_set() or self.scratch_size(next_dataset["source"]["read_config"], mode) > self.max_size:
+            return None
+
+        data_src = PrepareClient.create_data_src(next_dataset, mode, date)
+        data_src.cancelled = cancelled
+        try:
+            data_src.connect()
+        except Exception:
+            data_src.disconnect()
+            raise
+        return next_import.filename, data_src
+
+    def get(self, mutation_import: MutationImport) -> Optional[BagExtractDatastore]:
+        """Returns the connected source datastore for mutation_import when it has been prefetched, otherwise None.
+
+        Waits for a running prefetch to finish. A prefetched import that does not match mutation_import is discarded.
+        """
+        future, self._future = self._future, None
+        if future is None:
+            return None
+
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning(f"Prefetch of the next file failed: {e}")
+            return None
+
+        if result is None:
+            return None
+
+        filename, data_src = result
+        if filename != mutation_import.filename:
+            data_src.disconnect()
+            return None
+
+        logger.info(f"Using prefetched file {filename}")
+        return data_src
+
+    @staticmethod
+    def _discard(future: Future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            future.result()[1].disconnect()
+
+    def cancel(self):
+        """Cancels the current prefetch. When already running, it stops after its current download or extract step
+        and its files are removed as soon as it has finished."""
+        self._cancelled.set()
+        future, self._future = self._future, None
+        if future is not None and not future.cancel():
+            future.add_done_callback(self._discard)
+
+    def shutdown(self):
+        """Cancels the current prefetch and waits for it to stop, so that no files are left behind."""
+        self.cancel()
+        self._executor.shutdown(wait=True)
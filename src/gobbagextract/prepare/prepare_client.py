@@ -1,11 +1,12 @@
 import datetime as dt
-from typing import Any
+from typing import Any, Optional
 
 from gobcore.enum import ImportMode
 from gobcore.logging.logger import logger
 from gobconfig.datastore.config import TYPE_POSTGRES
 
-from gobbagextract.config import DATABASE_CONFIG
+from gobbagextract.config import DATABASE_CONFIG, BAGEXTRACT_FULL_RELOAD, BAGEXTRACT_SKIP_CLOSED, \
+    BAGEXTRACT_CHANGE_LOG_RETENTION_DAYS
 from gobbagextract.datastore.postgres import PostgresDatastoreExt
 from gobbagextract.selector.datastore_to_postgres import DatastoreToPostgresSelector
 from gobbagextract.datastore.bag_extract import BagExtractDatastore
@@ -36,27 +37,45 @@ def connect(func):
 
 
 class PrepareClient:
+    # Full imports reload the destination table instead of updating it
+    FULL_RELOAD = BAGEXTRACT_FULL_RELOAD
+    SKIP_CLOSED = BAGEXTRACT_SKIP_CLOSED
+    CHANGE_LOG_RETENTION_DAYS = BAGEXTRACT_CHANGE_LOG_RETENTION_DAYS
+
     columns_def = [
             {"name": "object_id", "type": "string"},
             {"name": "gemeente", "type": "string"},
             {"name": "last_update", "type": "datetime"},
-            {"name": "object", "type": "JSON"},
+            {"name": "object", "type": "JSONB"},
+            {"name": "hash", "type": "string"},
+            {"name": "bbox", "type": "string"},
+            {"name": "centroid", "type": "string"},
     ]
 
-    def __init__(self, msg: dict, dataset: dict[str, Any], mode: ImportMode, last_date: dt.date):
+    def __init__(self, msg: dict, dataset: dict[str, Any], mode: ImportMode, last_date: dt.date,
+                 data_src: Optional[BagExtractDatastore] = None, mutation_import_id: Optional[int] = None):
         self.header = msg.get("header", {})
         self.dataset = dataset
         self.entity = dataset["entity"]
         self.source_app = self.dataset.get("source", {}).get("application")
         self._last_date = last_date
+        self._mode = mode
+        # The changes of the import are logged under this id, see PostgresDatastoreExt.get_changes
+        self._mutation_import_id = mutation_import_id
+        # The batch sizes of the written rows, see Selector.batch_sizes
+        self._batch_sizes = {}
 
         read_config = dataset.get("source", {}).get("read_config", {})
-        read_config["mode"] = mode
-        self._data_src = BagExtractDatastore(dict(), read_config, last_date)
+
+        # A prefetched source datastore has already been downloaded and extracted
+        self._data_src = data_src or self.create_data_src(dataset, mode, last_date)
 
         data_store_config = DATABASE_CONFIG | {"type": TYPE_POSTGRES}
         data_store_config.pop("drivername")
         self._data_dst = PostgresDatastoreExt(data_store_config)
+        # Keep the table with the current voorkomens in sync
+        self._data_dst.current_tables.add("_".join((dataset["catalogue"], dataset["entity"])))
+        self._data_dst.mutation_import_id = mutation_import_id
 
         self._config = {
             "destination_table": {
@@ -66,17 +85,103 @@ class PrepareClient:
             "ignore_missing": False,
             "catalogue": dataset["catalogue"],
             "entity": dataset["entity"],
-            "gemeente": read_config.get("gemeente"),
+            "gemeente": (read_config.get("gemeentes") or [None])[0],
+            # Only import the objects that match the query, see gobbagextract.datastore.predicate
+            "query": read_config.get("query", ""),
         }
 
+    @staticmethod
+    def create_data_src(dataset: dict[str, Any], mode: ImportMode, last_date: dt.date) -> BagExtractDatastore:
+        """Returns the source datastore to import dataset in the given mode."""
+        read_config = dataset.get("source", {}).get("read_config", {})
+        read_config["mode"] = mode
+        return BagExtractDatastore(dict(), read_config, last_date)
+
     @connect
     def import_dataset(self) -> dict:
         """Returns result message containing total number of imported elements."""
-        selector = DatastoreToPostgresSelector(self._data_src, self._data_dst, self._config)
+        self._recover_prepared()
+        self._ensure_partition()
+        self._ensure_attribute_indexes()
+        self._ensure_projection()
+        self._start_change_log()
+
+        if self._mode == ImportMode.FULL and self.SKIP_CLOSED:
+            self._skip_closed()
+
+        # A reload would remove the objects that do not match the query
+        if self._mode == ImportMode.FULL and self.FULL_RELOAD and not self._config["query"]:
+            nr_rows = self._reload_dataset()
+        else:
+            nr_rows = self._select(self._config)
+            self._refresh_current()
+        return self.get_result_msg(nr_rows, self._data_dst.write_counts, self._batch_sizes)
+
+    def _select(self, config: dict) -> int:
+        """Writes the objects of the source to the destination table in config, returns the number of objects."""
+        selector = DatastoreToPostgresSelector(self._data_src, self._data_dst, config)
         nr_rows = selector.select()
-        return self.get_result_msg(nr_rows)
+        self._batch_sizes = selector.batch_sizes()
+        return nr_rows
+
+    def _recover_prepared(self):
+        """Finishes the batches of an earlier import that have been interrupted while they were committed."""
+        for transaction, outcome in self._data_dst.recover_prepared().items():
+            logger.warning(f"Prepared transaction {transaction} of an interrupted batch has been {outcome}")
+
+    def _ensure_partition(self):
+        """Creates the partition of the gemeente in the destination table when the gemeente is new."""
+        table = self._config["destination_table"]["name"]
+        if self._data_dst.ensure_partition(table, self._config["gemeente"]):
+            logger.info(f"Created partition of {table} for gemeente {self._config['gemeente']}")
+
+    def _refresh_current(self):
+        """Updates the current voorkomens of the gemeente that are not written by the import.
+
+        A voorkomen becomes or stops being current when its beginGeldigheid or eindGeldigheid passes. A reload
+        determines all current voorkomens anew, other imports only the current voorkomens of the written objects.
+        """
+        self._data_dst.refresh_current(self._config["destination_table"]["name"], self._config["gemeente"])
+
+    def _ensure_attribute_indexes(self):
+        """Creates the indexes on the attributes of the objects that are declared in the dataset."""
+        created = self._data_dst.ensure_attribute_indexes(self._config["destination_table"]["name"],
+                                                          self.dataset.get("attribute_indexes", []))
+        if created:
+            logger.info(f"Created indexes {', '.join(created)}")
+
+    def _ensure_projection(self):
+        """Creates the projection table with the typed columns that are declared in the dataset."""
+        table = self._config["destination_table"]["name"]
+        if self._data_dst.ensure_projection(table, self.dataset.get("projection", [])):
+            logger.info(f"Created projection of {table}")
+
+    def _start_change_log(self):
+        """Logs the object_ids that are written by this import."""
+        if self._mutation_import_id is not None:
+            self._data_dst.start_change_log(self._mutation_import_id, self.CHANGE_LOG_RETENTION_DAYS)
+
+    def _skip_closed(self):
+        """Lets the source skip the closed voorkomens that are already stored."""
+        closed_ids = self._data_dst.closed_object_ids(self._config["destination_table"]["name"],
+                                                      self._config["gemeente"])
+        logger.info(f"Skip {len(closed_ids):,} closed voorkomens that are already stored")
+        self._data_src.closed_ids = closed_ids
+
+    def _reload_dataset(self) -> int:
+        """Loads the dataset into a new table, which replaces the destination table when all rows are written.
+
+        Objects of the gemeente that are no longer in the source are removed this way.
+        """
+        destination_table = self._config["destination_table"]
+
+        with self._data_dst.reload_table(destination_table["name"], self._config["gemeente"],
+                                         keep_closed=bool(self._data_src.closed_ids)) as reload_table:
+            config = self._config | {"destination_table": destination_table | {"name": reload_table}}
+            return self._select(config)
 
-    def get_result_msg(self, nr_rows: int) -> dict:
+    def get_result_msg(self, nr_rows: int, write_counts: Optional[dict] = None,
+                       batch_sizes: Optional[dict] = None) -> dict:
         """The result of the bag extract needs to be published.
 
         Publication includes a header, summary and results
@@ -87,14 +192,19 @@ class PrepareClient:
         header = {
             **self.header,
             "version": self.dataset["version"],
+            "mutation_import_id": self._mutation_import_id,
             "timestamp": dt.datetime.utcnow().isoformat()
         }
-        summary = {"num_records": nr_rows}
+        summary = {"num_records": nr_rows} | dict(write_counts or {})
+        if batch_sizes:
+            summary["batch_sizes"] = batch_sizes
 
         # Log end of import process
         logger.info(
             f"Bag extract dataset {self.entity} from {self.source_app} completed. "
-            f"{summary['num_records']:,} records were read from the source.",
+            f"{summary['num_records']:,} records were read from the source. "
+            f"Inserted {summary.get('inserted', 0):,}, updated {summary.get('updated', 0):,}, "
+            f"unchanged {summary.get('unchanged', 0):,}.",
             kwargs={"data": summary}
         )
 
@@ -0,0 +1,58 @@
+import math
+from typing import Any, Iterator
+
+
+def estimate_size(value: Any) -> int:
+    """Returns a cheap estimate of the number of bytes that value takes when written."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return 8
+
+
+class BatchSizer:
+    """Chooses the number of rows of the next write batch.
+
+    A batch ends after size rows or max_bytes estimated bytes, whichever comes first. The byte budget keeps rows
+    with large geometries from filling the memory.
+
+    When adaptive, the size is adjusted after every batch that is written in less than min_time or more than
+    max_time seconds, so that the next batch is expected to take the middle of that band. The size changes at most
+    by a factor 2 per batch, and stays between min_size and max_size.
+    """
+    MAX_FACTOR = 2.0
+
+    def __init__(self, size: int, min_size: int = None, max_size: int = None, max_bytes: int = None,
+                 min_time: float = None, max_time: float = None, adaptive: bool = True):
+        self.adaptive = adaptive
+        self.min_size = min_size or 1
+        self.max_size = max_size or size
+        self.size = min(max(size, self.min_size), self.max_size)
+        self.max_bytes = max_bytes or math.inf
+        self.min_time = min_time or 0.0
+        self.max_time = max_time or math.inf
+
+    def take(self, values: Iterator[list]) -> tuple[list[list], int]:
+        """Returns the next batch from values, and its estimated size in bytes."""
+        batch = []
+        nbytes = 0
+        size, max_bytes = self.size, self.max_bytes
+        for row in values:
+            batch.append(row)
+            nbytes += estimate_size(row)
+            if len(batch) >= size or nbytes >= max_bytes:
+                break
+        return batch, nbytes
+
+    def observe(self, rows: int, write_time: float):
+        """Adjusts the size after rows have been written in write_time seconds."""
+        if not self.adaptive or rows == 0 or self.min_time <= write_time <= self.max_time:
+            return
+
+        target_time = (self.min_time + self.max_time) / 2
+        factor = self.MAX_FACTOR if write_time <= 0 else target_time / write_time
+        factor = min(self.MAX_FACTOR, max(1 / self.MAX_FACTOR, factor))
+        self.size = min(self.max_size, max(self.min_size, int(rows * factor)))
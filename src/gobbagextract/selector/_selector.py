@@ -1,10 +1,33 @@
-import itertools
-from typing import Iterator
+import queue
+import threading
+import time
+from operator import itemgetter
+from typing import Callable, Iterator, NamedTuple
 
 from gobcore.exceptions import GOBException
 from gobcore.logging.logger import logger
 from gobcore.datastore.datastore import Datastore
 
+from gobbagextract.config import BAGEXTRACT_ADAPTIVE_BATCH_SIZE, BAGEXTRACT_WRITE_BATCH_MIN_SIZE, \
+    BAGEXTRACT_WRITE_BATCH_MAX_SIZE, BAGEXTRACT_WRITE_BATCH_MAX_BYTES, BAGEXTRACT_WRITE_BATCH_MIN_TIME, \
+    BAGEXTRACT_WRITE_BATCH_MAX_TIME
+from gobbagextract.selector._batch_sizer import BatchSizer
+
+
+class ChunkStats(NamedTuple):
+    """Statistics of a chunk of rows written to the destination table. Times are in seconds.
+
+    queue_depth is the number of chunks that were still waiting to be written when this chunk was taken from the
+    queue. A queue that is mostly full means that writing is the bottleneck, a mostly empty queue that reading is.
+    bytes is the estimated size of the rows, batch_size the maximum number of rows when the chunk was read.
+    """
+    rows: int
+    read_time: float
+    write_time: float
+    queue_depth: int = 0
+    bytes: int = 0
+    batch_size: int = 0
+
 
 class Selector:
     """
@@ -13,7 +36,17 @@ class Selector:
     Selector handles execution of queries on src_connection. The results of the queries are written to
     dst_database
     """
+    # The number of rows of the first batch, see BatchSizer
     WRITE_BATCH_SIZE = 50_000
+    ADAPTIVE_BATCH_SIZE = BAGEXTRACT_ADAPTIVE_BATCH_SIZE
+    WRITE_BATCH_MIN_SIZE = BAGEXTRACT_WRITE_BATCH_MIN_SIZE
+    WRITE_BATCH_MAX_SIZE = BAGEXTRACT_WRITE_BATCH_MAX_SIZE
+    WRITE_BATCH_MAX_BYTES = BAGEXTRACT_WRITE_BATCH_MAX_BYTES
+    WRITE_BATCH_MIN_TIME = BAGEXTRACT_WRITE_BATCH_MIN_TIME
+    WRITE_BATCH_MAX_TIME = BAGEXTRACT_WRITE_BATCH_MAX_TIME
+
+    # Maximum number of chunks that have been read but not yet written
+    QUEUE_SIZE = 2
 
     def __init__(self, src_datastore: Datastore, dst_datastore: Datastore, config: dict):
         """
@@ -27,37 +60,137 @@ class Selector:
         self.destination_table = config["destination_table"]
         self.ignore_missing = config.get("ignore_missing", False)
         self.query = self._config.get("query", "")
+        self.chunk_stats: list[ChunkStats] = []
+        self.batch_sizer = self._batch_sizer()
 
     def select(self) -> int:
-        """Entry method. Saves result of select query in destination table."""
-        total_cnt = 0
+        """Entry method. Saves result of select query in destination table.
+
+        The result of the query is read once and streamed to the destination table in chunks, of which the size is
+        chosen by a BatchSizer. Reading runs in a separate thread, so that reading the next chunks overlaps with
+        writing the current chunk. At most QUEUE_SIZE chunks are waiting to be written, which bounds memory usage.
+        Statistics for each chunk are kept in chunk_stats.
+        """
         table = self.destination_table["name"]
         columns = self.destination_table["columns"]
+        rows = iter(self._read_rows(self.query))
+        self.chunk_stats = []
+        self.batch_sizer = self._batch_sizer()
+
+        chunks = queue.Queue(maxsize=self.QUEUE_SIZE)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_chunks, args=(rows, columns, chunks, stop), daemon=True)
+
+        start = time.perf_counter()
+        reader.start()
+        try:
+            self._write_chunks(table, columns, chunks)
+        finally:
+            # Stop reading when writing fails, and wait for the reader to finish before the source is disconnected
+            stop.set()
+            reader.join()
+
+        self._log_stats(table, time.perf_counter() - start)
+        return sum(stats.rows for stats in self.chunk_stats)
+
+    def _batch_sizer(self) -> BatchSizer:
+        if not self.ADAPTIVE_BATCH_SIZE:
+            return BatchSizer(self.WRITE_BATCH_SIZE, adaptive=False)
+        return BatchSizer(self.WRITE_BATCH_SIZE, self.WRITE_BATCH_MIN_SIZE, self.WRITE_BATCH_MAX_SIZE,
+                          self.WRITE_BATCH_MAX_BYTES, self.WRITE_BATCH_MIN_TIME, self.WRITE_BATCH_MAX_TIME)
 
-        while True:
-            rows = self._read_rows(self.query)
-            chunk = itertools.islice(rows, self.WRITE_BATCH_SIZE)
-            values = self._process_values(chunk, columns)
+    def _read_chunks(self, rows: Iterator[dict], columns: list, chunks: queue.Queue, stop: threading.Event):
+        """Reads chunks of processed rows into chunks. Ends with None, or with the exception that occurred."""
+        try:
+            values = iter(self._process_values(rows, columns))
+            while not stop.is_set():
+                start = time.perf_counter()
+                batch_size = self.batch_sizer.size
+                chunk, nbytes = self.batch_sizer.take(values)
+                if not chunk:
+                    break
+                self._put(chunks, (chunk, time.perf_counter() - start, nbytes, batch_size), stop)
+            self._put(chunks, None, stop)
+        except Exception as e:
+            self._put(chunks, e, stop)
+
+    @staticmethod
+    def _put(chunks: queue.Queue, item, stop: threading.Event):
+        """Puts item in chunks, waiting for a free slot until stop is set."""
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _write_chunks(self, table: str, columns: list, chunks: queue.Queue):
+        while (item := chunks.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+
+            queue_depth = chunks.qsize()
+            values, read_time, nbytes, batch_size = item
+
+            start = time.perf_counter()
             row_cnt = self._write_rows(table, values, columns)
+            write_time = time.perf_counter() - start
+            self.batch_sizer.observe(row_cnt, write_time)
+            self.chunk_stats.append(ChunkStats(row_cnt, read_time, write_time, queue_depth, nbytes, batch_size))
+
+    def batch_sizes(self) -> dict:
+        """Returns the smallest, largest and last batch size (maximum number of rows) of the written chunks."""
+        sizes = [chunk.batch_size for chunk in self.chunk_stats]
+        return {"min": min(sizes), "max": max(sizes), "last": sizes[-1]} if sizes else {}
+
+    def _log_stats(self, table: str, wall_time: float):
+        stats = self.chunk_stats
+        total_cnt = sum(chunk.rows for chunk in stats)
+        summary = {
+            "rows": total_cnt,
+            "read_time": sum(chunk.read_time for chunk in stats),
+            "write_time": sum(chunk.write_time for chunk in stats),
+            "wall_time": wall_time,
+            "avg_queue_depth": sum(chunk.queue_depth for chunk in stats) / len(stats) if stats else 0,
+            "batch_sizes": self.batch_sizes(),
+        }
+        sizes = summary["batch_sizes"]
+        logger.info(
+            f"Written {total_cnt:,} rows in {len(stats)} chunks to destination table {table}. "
+            f"Read {summary['read_time']:.1f}s, write {summary['write_time']:.1f}s, total {wall_time:.1f}s, "
+            f"average queue depth {summary['avg_queue_depth']:.1f} of {self.QUEUE_SIZE}, "
+            f"batch size {sizes.get('min', 0):,} - {sizes.get('max', 0):,} rows",
+            kwargs={"data": summary | {"chunks": [chunk._asdict() for chunk in stats]}}
+        )
+
+    def _row_getter(self, columns: list) -> Callable[[dict], tuple]:
+        """Returns a function that returns the values of a row (a dictionary of column:value pairs) as a tuple in the
+        order of columns. The column names are resolved once, the values are taken from the row by itemgetter.
+
+        If a column is missing in a row, a GOBException is raised when self.ignore_missing == False. If
+        self.ignore_missing == True, the value for that column is None.
+        """
+        names = [column["name"].lower() for column in columns]
+        # itemgetter returns a single value instead of a tuple for a single name
+        getter = itemgetter(*names) if len(names) > 1 else lambda row_: tuple(row_[name] for name in names)
+
+        def get_missing(row_: dict) -> tuple:
+            if not self.ignore_missing:
+                missing = next(name for name in names if name not in row_)
+                raise GOBException(f"Missing column {missing} in query result")
+            return tuple([row_.get(name) for name in names])
+
+        def get(row_: dict) -> tuple:
+            try:
+                return getter(row_)
+            except KeyError:
+                return get_missing(row_)
 
-            total_cnt += row_cnt
-            if row_cnt < self.WRITE_BATCH_SIZE:
-                logger.info(f"Written {total_cnt:,} rows to destination table {table}")
-                return total_cnt
+        return get
 
-    def _process_values(self, rows: iter, columns: list) -> Iterator[list]:
+    def _process_values(self, rows: iter, columns: list) -> Iterator[tuple]:
         """
-        Transforms the rows (dictionaries of column:value pairs) to lists of values in the order as specified by
-        columns. If a column:value pair is missing for a column present in columns, a GOBException is raised when
-        self.ignore_missing == False. If self.ignore_missing == True, the value for that column will be set to None.
+        Transforms the rows (dictionaries of column:value pairs) to tuples of values in the order as specified by
+        columns, see _row_getter.
         """
-        def process_col(column, row_):
-            if column["name"].lower() in row_:
-                return row_[column["name"].lower()]
-            elif not self.ignore_missing:
-                raise GOBException(f"Missing column {column['name'].lower()} in query result")
-            else:
-                return None
-
-        for row in rows:
-            yield [process_col(col, row) for col in columns]
+        return map(self._row_getter(columns), rows)
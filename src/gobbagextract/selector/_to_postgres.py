@@ -1,27 +1,38 @@
-from typing import Any, Iterator
+from typing import Any, Callable, Iterator, Optional
 
 from psycopg2.extras import Json
 
+from gobbagextract.datastore.serializer import dumps
+
+JSON_TYPES = ("JSON", "JSONB")
+
 
 class ToPostgresSelector:
 
     @staticmethod
-    def _prepare_row(row: list, columns: list[dict[str, str]]) -> list[Any]:
-        """Perform data transformations where necessary.
-        Transforms JSON type values to correct database type
+    def _row_adapter(columns: list[dict[str, str]]) -> Optional[Callable[[tuple], list[Any]]]:
+        """Returns a function that transforms the JSON type values in a row to the correct database type, or None
+        when none of the columns has a JSON type. The JSON columns are resolved once, not for every row.
 
-        :param row: values per row
-        :param columns: dict of name
-        :return: transformed row
+        :param columns: dict of name and type per column
+        :return: function that returns the transformed row
         """
-        for idx, val in enumerate(row):
-            if columns[idx]["type"] in ["JSON", "JSONB"]:
-                row[idx] = Json(val)
-        return row
+        json_idx = [idx for idx, column in enumerate(columns) if column["type"] in JSON_TYPES]
+        if not json_idx:
+            return None
+
+        def adapt(row: tuple) -> list[Any]:
+            row = list(row)
+            for idx in json_idx:
+                row[idx] = Json(row[idx], dumps=dumps)
+            return row
+
+        return adapt
 
-    def _write_rows(self, table: str, values: Iterator[list], columns: list[dict[str, str]]) -> int:
+    def _write_rows(self, table: str, values: Iterator[tuple], columns: list[dict[str, str]]) -> int:
         """Prepares and writes values to a postgresql database and returns number of rows."""
-        values = [self._prepare_row(row, columns) for row in values]
+        adapt = self._row_adapter(columns)
+        values = list(values) if adapt is None else [adapt(row) for row in values]
         column_names = [c["name"] for c in columns]
 
         return self._dst_datastore.write_rows(table, values, columns=column_names)
@@ -43,3 +43,16 @@ class MutationImportRepositoryTest(TestCase):
             call.add(message),
             call.flush(),
         ])
+
+    def test_notify(self):
+        session = MagicMock()
+        repo = MutationImportRepository(session)
+
+        repo.notify("bag_extract", {"id": 42})
+
+        statement, params = session.execute.call_args.args
+        self.assertEqual({"bind_arguments": {"mapper": MutationImport}}, session.execute.call_args.kwargs)
+        self.assertEqual("SELECT pg_notify(:channel, :payload)", str(statement))
+        # The notification is only delivered when it is committed
+        self.assertTrue(statement.get_execution_options()["autocommit"])
+        self.assertEqual({"channel": "bag_extract", "payload": '{"id":42}'}, params)
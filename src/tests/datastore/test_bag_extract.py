@@ -1,12 +1,16 @@
 import datetime
+import hashlib
 import os
 import pprint
+import threading
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import MagicMock, call, patch
+from xml.etree import ElementTree
 
 from gobbagextract.datastore.bag_extract import BagExtractDatastore, GOBException, _extract_nested_zip, ElementFormatter
+from gobbagextract.datastore.bag_extract import ConnectCancelled
 from gobbagextract.mutations.afgifte import Afgifte
 from gobcore.enum import ImportMode
 
@@ -42,21 +46,94 @@ class TestModuleFunctions(TestCase):
 class TestElementFormatter(TestCase):
     """Class is mostly tested with the test_query_full and test_query_mutations methods in the class below."""
 
+    def test_convert_gml(self):
+        gml = '<gml:Polygon xmlns:gml="http://www.opengis.net/gml/3.2" srsDimension="3"><gml:exterior>' \
+              '<gml:LinearRing><gml:posList>0 0 0 4.5 0 0 4.5 3 0 0 3 0 0 0 0</gml:posList></gml:LinearRing>' \
+              '</gml:exterior></gml:Polygon>'
+        elm = ElementTree.fromstring(gml)
+
+        ef = ElementFormatter("")
+        self.assertEqual("POLYGON ((0 0,4.5 0.0,4.5 3.0,0 3,0 0))", ef._convert_gml(elm))
+        self.assertEqual((0, 0, 4.5, 3), ef.bbox)
+        self.assertEqual((2.25, 1.5), ef.centroid)
+
+        ef = ElementFormatter("", geometry_precision=0)
+        self.assertEqual("POLYGON ((0 0,4 0,4 3,0 3,0 0))", ef._convert_gml(elm))
+
+        ef = ElementFormatter("", geometry_encoding="wkb")
+        self.assertTrue(ef._convert_gml(elm).startswith("010300000001000000050000000000"))
+
+        # The extent is taken from the first geometry
+        ef._set_extent((1, 2, 3, 4), (2, 3))
+        self.assertEqual((0, 0, 4.5, 3), ef.bbox)
+
+    @patch("gobbagextract.datastore.bag_extract.ElementFormatter._ogr_geometry")
+    def test_convert_gml_ogr(self, mock_ogr_geometry):
+        ef = ElementFormatter("")
+        ef._convert_ogr_geometry = MagicMock()
+
+        # Not parsed by parse_gml
+        gml = '<gml:LineString xmlns:gml="http://www.opengis.net/gml/3.2" srsDimension="2">' \
+              '<gml:posList>0 0 1 1</gml:posList></gml:LineString>'
+        self.assertEqual(ef._convert_ogr_geometry.return_value, ef._convert_gml(ElementTree.fromstring(gml)))
+        ef._convert_ogr_geometry.assert_called_with(mock_ogr_geometry.return_value)
+
+        # No WKT like OGR
+        gml = '<gml:Point xmlns:gml="http://www.opengis.net/gml/3.2" srsDimension="2">' \
+              '<gml:pos>1 1e20</gml:pos></gml:Point>'
+        self.assertEqual(ef._convert_ogr_geometry.return_value, ef._convert_gml(ElementTree.fromstring(gml)))
+        self.assertEqual(2, ef._convert_ogr_geometry.call_count)
+
+    def test_convert_ogr_geometry(self):
+        geometry = MagicMock()
+        geometry.GetEnvelope.return_value = (1, 3, 2, 4)
+        geometry.Centroid.return_value.GetX.return_value = 2
+        geometry.Centroid.return_value.GetY.return_value = 3
+        geometry.ExportToWkt.return_value = "LINESTRING (1.26 2.0,3 4)"
+        geometry.ExportToWkb.return_value = bytearray(b"\x01\xab")
+
+        ef = ElementFormatter("")
+        self.assertEqual("LINESTRING (1.26 2.0,3 4)", ef._convert_ogr_geometry(geometry))
+        self.assertEqual((1, 2, 3, 4), ef.bbox)
+        self.assertEqual((2, 3), ef.centroid)
+
+        ef.geometry_precision = 1
+        self.assertEqual("LINESTRING (1.3 2,3 4)", ef._convert_ogr_geometry(geometry))
+
+        ef.geometry_encoding = "wkb"
+        self.assertEqual("01AB", ef._convert_ogr_geometry(geometry))
+
+    @patch("gobbagextract.datastore.bag_extract.gml_to_string")
+    def test_keep_gml(self, mock_gml_to_string):
+        gml = '<Objecten:geometrie xmlns:Objecten="www.kadaster.nl/schemas/lvbag/imbag/objecten/v20200601" ' \
+              'xmlns:gml="http://www.opengis.net/gml/3.2"><gml:Point/></Objecten:geometrie>'
+        elm = ElementTree.fromstring(gml)
+
+        self.assertEqual(mock_gml_to_string.return_value, ElementFormatter(elm, keep_gml=True)._element_to_dict(elm))
+        mock_gml_to_string.assert_called_with(elm[0])
+
     @patch("gobbagextract.datastore.bag_extract.ogr.CreateGeometryFromGML")
     @patch("gobbagextract.datastore.bag_extract.ElementTree")
-    def test_gml_to_wkt(self, mock_et, mock_create_geometry):
+    def test_ogr_geometry(self, mock_et, mock_create_geometry):
         ef = ElementFormatter("")
 
-        res = ef._gml_to_wkt("elm")
+        res = ef._ogr_geometry("elm")
 
         mock_create_geometry.assert_called_with(mock_et.tostring().decode())
         mock_create_geometry.return_value.FlattenTo2D.assert_called_once()
-        mock_create_geometry.return_value.ExportToWkt.assert_called_once()
-        self.assertEqual(mock_create_geometry().ExportToWkt(), res)
+        self.assertEqual(mock_create_geometry.return_value, res)
 
 
 class TestBagExtractDatastore(TestCase):
 
+    def test_hash(self):
+        row = {"a": "1", "b": ["2", "3"]}
+        self.assertEqual(32, len(BagExtractDatastore._hash(row)))
+        self.assertEqual(BagExtractDatastore._hash(row), BagExtractDatastore._hash({"b": ["2", "3"], "a": "1"}))
+        self.assertNotEqual(BagExtractDatastore._hash(row), BagExtractDatastore._hash({"a": "1", "b": ["3", "2"]}))
+        # The MD5 of the compact JSON with sorted keys
+        self.assertEqual(hashlib.md5(b'{"a":"1","b":["2","3"]}').hexdigest(), BagExtractDatastore._hash(row))
+
     def get_test_object(self):
         with patch("gobbagextract.datastore.bag_extract.TemporaryDirectory"):
             connection_config = {"connection": "config"}
@@ -103,6 +180,33 @@ class TestBagExtractDatastore(TestCase):
         # Should not fail
         BagExtractDatastore({}, minimal_read_config, None)
 
+    def test_check_geometry_config(self):
+        read_config = {
+            "object_type": "object type",
+            "xml_object": "xml object",
+            "mode": ImportMode.FULL,
+            "gemeentes": ["gemeentes"],
+            "download_location": "location",
+        }
+        ds = BagExtractDatastore({}, read_config | {"geometry_encoding": "wkb"}, None)
+        self.assertEqual({"keep_gml": False, "geometry_encoding": "wkb", "geometry_precision": None, "keys": None},
+                         ds._formatter_config)
+        ds = BagExtractDatastore({}, read_config | {"geometry_precision": 2}, None)
+        self.assertEqual({"keep_gml": False, "geometry_encoding": "wkt", "geometry_precision": 2, "keys": None},
+                         ds._formatter_config)
+
+        with self.assertRaisesRegex(GOBException, "Invalid geometry_encoding geojson in read_config"):
+            BagExtractDatastore({}, read_config | {"geometry_encoding": "geojson"}, None)
+
+        for config in ({"geometry_precision": -1}, {"geometry_precision": "2"},
+                       {"geometry_precision": 2, "geometry_encoding": "wkb"}):
+            with self.assertRaisesRegex(GOBException, "Invalid geometry_precision"):
+                BagExtractDatastore({}, read_config | config, None)
+
+        with patch.object(BagExtractDatastore, "GML_CONVERSION", "postgis"), \
+                self.assertRaisesRegex(GOBException, "require GML conversion in Python"):
+            BagExtractDatastore({}, read_config | {"geometry_encoding": "wkb"}, None)
+
     def test_init(self):
         ds = self.get_test_object()
         self.assertEqual(ImportMode.FULL, ds.mode)
@@ -184,13 +288,44 @@ class TestBagExtractDatastore(TestCase):
         ds._get_mutation_ids.assert_not_called()
         self.assertIsNone(ds.ids)
 
+        # already connected, for example by the prefetcher
+        mock_store.download.reset_mock()
+        ds.connect()
+        mock_store.download.assert_not_called()
+
         # mutations
+        ds.files = None
         ds.mode = ImportMode.MUTATIONS
         ds.connect()
         mock_store.download.assert_called_with(ds.read_config["download_location"], destination=ds.tmp_path)
         ds._get_mutation_ids.assert_called_once()
         ds._extract_mutations_file.assert_called_with(ds.read_config["download_location"])
 
+    @patch("gobbagextract.datastore.bag_extract.ProductStore")
+    def test_connect_cancelled(self, mock_store):
+        ds = self.get_test_object()
+        ds._extract_full_file = MagicMock()
+        ds._extract_mutations_file = MagicMock()
+        ds.cancelled = threading.Event()
+
+        # Cancelled during the download, nothing is extracted
+        mock_store.download.side_effect = lambda *args, **kwargs: ds.cancelled.set()
+        with self.assertRaises(ConnectCancelled):
+            ds.connect()
+        ds._extract_full_file.assert_not_called()
+        self.assertIsNone(ds.files)
+
+        # Cancelled during the extract of the last full file of a mutations import
+        mock_store.download.side_effect = None
+        ds.cancelled.clear()
+        ds.mode = ImportMode.MUTATIONS
+        ds.read_config["last_full_download_location"] = "last/full/download/location"
+        ds._extract_full_file.side_effect = lambda afgifte: ds.cancelled.set() or []
+        with self.assertRaises(ConnectCancelled):
+            ds.connect()
+        ds._extract_mutations_file.assert_not_called()
+        self.assertIsNone(ds.files)
+
     def test_disconnect(self):
         ds = self.get_test_object()
         ds.disconnect()
@@ -236,8 +371,103 @@ class TestBagExtractDatastore(TestCase):
 
         self.assertEqual(len(res), 1)
         self.assertEqual(date_now, res[0]["last_update"])
+        self.assertEqual("(131419.0,482833.0),(131419.0,482833.0)", res[0]["bbox"])
+        self.assertEqual("(131419.0,482833.0)", res[0]["centroid"])
         self.assertEqual(expected, res[0]["object"])
 
+    def test_query_full_keys(self):
+        read_config = {
+            "object_type": "VBO",
+            "xml_object": "Verblijfsobject",
+            "mode": ImportMode.FULL,
+            "gemeentes": ["0457"],
+            "download_location": "the location",
+            "keys": ["identificatie", "status", "maaktDeelUitVan/PandRef", "voorkomen/Voorkomen", "not/there"],
+        }
+        ds = BagExtractDatastore({}, read_config, datetime.date.today())
+        ds.files = [os.path.join(os.path.dirname(__file__), "bag_extract_fixtures", "full.xml")]
+
+        with patch("gobbagextract.datastore.bag_extract.parse_gml") as mock_parse_gml:
+            res = list(ds.query(None))
+        # The geometry is not asked for, and not converted
+        mock_parse_gml.assert_not_called()
+        self.assertIsNone(res[0]["bbox"])
+        self.assertEqual(ds._hash(res[0]["object"]), res[0]["hash"])
+
+        # Everything below voorkomen/Voorkomen is kept
+        self.assertEqual({
+            "identificatie": "votA",
+            "maaktDeelUitVan/PandRef": ["pndA", "pndB"],
+            "status": "Verblijfsobject in gebruik",
+            "voorkomen/Voorkomen/BeschikbaarLV/tijdstipRegistratieLV": "2010-11-15T13:31:10.557",
+            "voorkomen/Voorkomen/beginGeldigheid": "2010-08-31",
+            "voorkomen/Voorkomen/tijdstipRegistratie": "2010-11-15T13:22:03.000",
+            "voorkomen/Voorkomen/voorkomenidentificatie": "1"
+        }, res[0]["object"])
+
+        for keys in ([], "status", [1]):
+            with self.assertRaisesRegex(GOBException, "Invalid keys"):
+                BagExtractDatastore({}, read_config | {"keys": keys}, None)
+
+    def test_query_full_predicate(self):
+        read_config = {
+            "object_type": "VBO",
+            "xml_object": "Verblijfsobject",
+            "mode": ImportMode.FULL,
+            "gemeentes": ["0457"],
+            "download_location": "the location",
+        }
+        ds = BagExtractDatastore({}, read_config, datetime.date.today())
+        ds.files = [os.path.join(os.path.dirname(__file__), "bag_extract_fixtures", "full.xml")]
+
+        self.assertEqual(1, len(list(ds.query({"status": "Verblijfsobject in gebruik", "current": True}))))
+
+        # Objects that do not match are not formatted
+        with patch("gobbagextract.datastore.bag_extract.ElementFormatter") as mock_formatter:
+            self.assertEqual([], list(ds.query({"identificatie": ["votB"]})))
+            self.assertEqual([], list(ds.query({"geldig": {"to": "2010-08-31"}})))
+        mock_formatter.assert_not_called()
+
+        with self.assertRaisesRegex(GOBException, "Invalid query"):
+            list(ds.query({"unknown": 1}))
+
+    def test_key_paths(self):
+        self.assertEqual({"a", "a/b", "d"}, ElementFormatter.key_paths(frozenset({"a/b/c", "d/e", "f"})))
+
+    def test_query_full_keep_gml(self):
+        read_config = {
+            "object_type": "VBO",
+            "xml_object": "Verblijfsobject",
+            "mode": ImportMode.FULL,
+            "gemeentes": ["0457"],
+            "download_location": "the location",
+        }
+        with patch.object(BagExtractDatastore, "GML_CONVERSION", "postgis"):
+            ds = BagExtractDatastore({}, read_config, datetime.date.today())
+        ds.files = [os.path.join(os.path.dirname(__file__), "bag_extract_fixtures", "full.xml")]
+
+        res = list(ds.query(None))
+        self.assertTrue(res[0]["object"]["geometrie/punt"].startswith("<gml:Point "))
+
+    def test_query_full_skip_closed(self):
+        read_config = {
+            "object_type": "VBO",
+            "xml_object": "Verblijfsobject",
+            "mode": ImportMode.FULL,
+            "gemeentes": ["0457"],
+            "download_location": "the location",
+        }
+        ds = BagExtractDatastore({}, read_config, datetime.date.today())
+        ds.files = [os.path.join(os.path.dirname(__file__), "bag_extract_fixtures", "full.xml")]
+        ds.closed_ids = {"votA.1"}
+
+        with patch("gobbagextract.datastore.bag_extract.ElementFormatter") as mock_formatter:
+            self.assertEqual([], list(ds.query(None)))
+        mock_formatter.assert_not_called()
+
+        ds.closed_ids = {"votA.2"}
+        self.assertEqual(["votA.1"], [row["object_id"] for row in ds.query(None)])
+
     def test_query_mutations(self):
         """Tests query, _element_to_dict, _flatten_dict, _flatten_nested_list and _gml_to_wkt
 
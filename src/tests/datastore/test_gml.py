@@ -0,0 +1,105 @@
+import os
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from osgeo import ogr
+
+from gobbagextract.datastore.gml import bbox, centroid, gml_to_string, parse_gml, round_wkt, to_wkb, to_wkt
+
+CORPUS = os.path.join(os.path.dirname(__file__), "gml_fixtures", "corpus.xml")
+
+
+class TestGmlToWkt(TestCase):
+
+    def test_corpus(self):
+        """The corpus holds the WKT and WKB that OGR returns for each GML geometry.
+
+        parse_gml with to_wkt and to_wkb should return exactly the same, or None for the cases that are left to OGR.
+        """
+        cases = ElementTree.parse(CORPUS).getroot()
+        self.assertTrue(len(cases))
+
+        for case in cases:
+            with self.subTest(case.get("description")):
+                geometry = parse_gml(case[0])
+                self.assertEqual(case.get("description").startswith("Fallback"), geometry is None)
+                if geometry is not None:
+                    wkt_fallback = case.get("description").startswith("WKT fallback")
+                    self.assertEqual(None if wkt_fallback else case.get("wkt"), to_wkt(geometry))
+                    self.assertEqual(case.get("wkb"), to_wkb(geometry))
+
+    def test_corpus_ogr(self):
+        """The corpus holds what OGR returns, and to_wkt and to_wkb return the same as OGR itself."""
+        for case in ElementTree.parse(CORPUS).getroot():
+            with self.subTest(case.get("description")):
+                geometry = ogr.CreateGeometryFromGML(gml_to_string(case[0]))
+                geometry.FlattenTo2D()
+                wkt = geometry.ExportToWkt()
+                wkb = bytes(geometry.ExportToWkb(ogr.wkbNDR)).hex().upper()
+                self.assertEqual((case.get("wkt"), case.get("wkb")), (wkt, wkb))
+
+                geometry = parse_gml(case[0])
+                if geometry is not None and not case.get("description").startswith("WKT fallback"):
+                    self.assertEqual(wkt, to_wkt(geometry))
+                if geometry is not None:
+                    self.assertEqual(wkb, to_wkb(geometry))
+
+    def test_corpus_rounded(self):
+        """Rounding the OGR WKT, as is done for the cases that are left to OGR, gives the same as to_wkt."""
+        for case in ElementTree.parse(CORPUS).getroot():
+            if not case.get("description").startswith(("Fallback", "WKT fallback")):
+                with self.subTest(case.get("description")):
+                    self.assertEqual(round_wkt(case.get("wkt"), 1), to_wkt(parse_gml(case[0]), 1))
+
+    def test_rounded(self):
+        gml = '<gml:Polygon xmlns:gml="http://www.opengis.net/gml/3.2" srsDimension="3"><gml:exterior>' \
+              '<gml:LinearRing><gml:posList>0.04 -0.04 0 10.15 0 0 10.0 2.26 0 0.04 -0.04 0</gml:posList>' \
+              '</gml:LinearRing></gml:exterior></gml:Polygon>'
+        geometry = parse_gml(ElementTree.fromstring(gml))
+
+        self.assertEqual("POLYGON ((0.04 -0.04,10.15 0,10 2.26,0.04 -0.04))", to_wkt(geometry, 2))
+        self.assertEqual("POLYGON ((0 0,10.2 0,10 2.3,0 0))", to_wkt(geometry, 1))
+        self.assertEqual("POLYGON ((0 0,10 0,10 2,0 0))", to_wkt(geometry, 0))
+        self.assertEqual("POINT (1.5 -2 300)", round_wkt("POINT (1.46 -2.0 3E+2)", 1))
+
+    def test_invalid(self):
+        gml = '<gml:Point xmlns:gml="http://www.opengis.net/gml/3.2" srsDimension="3">' \
+              '<gml:pos>{}</gml:pos></gml:Point>'
+        for pos in ["", "1 2", "1 2 3 4 5 6", "a b c"]:
+            self.assertIsNone(parse_gml(ElementTree.fromstring(gml.format(pos))))
+
+    def test_gml_to_string(self):
+        gml = '<gml:Point xmlns:gml="http://www.opengis.net/gml/3.2" srsDimension="2">' \
+              '<gml:pos>1 2</gml:pos></gml:Point>'
+        elm = ElementTree.fromstring(f"<geometrie>{gml}\n</geometrie>")[0]
+        self.assertEqual(gml, gml_to_string(elm))
+
+    def assertPointEqual(self, expected, point):
+        self.assertAlmostEqual(expected[0], point[0])
+        self.assertAlmostEqual(expected[1], point[1])
+
+    def test_bbox_centroid(self):
+        self.assertEqual((1, 2, 1, 2), bbox(("POINT", [(1, 2)])))
+        self.assertEqual((1, 2), centroid(("POINT", [(1, 2)])))
+
+        # Square with a hole in the top right quarter
+        polygon = [[(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)], [(2, 2), (2, 4), (4, 4), (4, 2), (2, 2)]]
+        self.assertEqual((0, 0, 4, 4), bbox(("POLYGON", polygon)))
+        self.assertPointEqual((1 + 2 / 3, 1 + 2 / 3), centroid(("POLYGON", polygon)))
+
+        # Clockwise square and the polygon above
+        square = [[(10, 0), (10, 2), (12, 2), (12, 0), (10, 0)]]
+        self.assertEqual((0, 0, 12, 4), bbox(("MULTIPOLYGON", [polygon, square])))
+        self.assertPointEqual((4, 1.5), centroid(("MULTIPOLYGON", [polygon, square])))
+
+        # Degenerate polygon
+        self.assertEqual((1, 0.5), centroid(("POLYGON", [[(0, 0), (2, 1), (2, 1), (0, 0)]])))
+
+    def test_centroid_corpus(self):
+        """The centroid of the BAG polygons in the corpus is within the polygon bbox."""
+        for case in ElementTree.parse(CORPUS).getroot():
+            if case.get("description").startswith("BAG"):
+                geometry = parse_gml(case[0])
+                min_x, min_y, max_x, max_y = bbox(geometry)
+                x, y = centroid(geometry)
+                self.assertTrue(min_x <= x <= max_x and min_y <= y <= max_y)
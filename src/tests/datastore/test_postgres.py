@@ -1,7 +1,16 @@
+import datetime
+from typing import Generator
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import ANY, Mock, MagicMock, patch, call
 
+import pytest
 from psycopg2 import Error
+from psycopg2.extras import Json
+from sqlalchemy.orm import Session
+
+from gobconfig.datastore.config import TYPE_POSTGRES
+from gobcore.exceptions import GOBException
+from gobbagextract.config import DATABASE_CONFIG
 from gobbagextract.datastore.postgres import PostgresDatastoreExt
 
 
@@ -11,6 +20,7 @@ class PotgresTest(TestCase):
     def test_write_rows(self, mock_execute_values):
         config = {}
         ds = PostgresDatastoreExt(config)
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_INSERT
         ds.connection = Mock()
         ds.connection.cursor = Mock()
         cursor = Mock()
@@ -21,10 +31,1068 @@ class PotgresTest(TestCase):
         columns = ["col1", "col2"]
         ds.write_rows(table, rows, columns)
         mock_execute_values.assert_called_once()
-        query = "INSERT INTO my table (col1,col2) VALUES %s ON CONFLICT(col1) DO UPDATE SET col2=EXCLUDED.col2"
+        query = "WITH merged AS (INSERT INTO my table (col1,col2) VALUES %s ON CONFLICT(col1) " \
+                "DO UPDATE SET col2=EXCLUDED.col2 RETURNING xmax = 0 AS inserted) SELECT inserted FROM merged"
         mock_execute_values.assert_called_once()
         self.assertEqual(mock_execute_values.call_args.args[1], query)
         self.assertEqual(mock_execute_values.call_args.args[2], rows)
+        self.assertTrue(mock_execute_values.call_args.kwargs["fetch"])
+        self.assertEqual(2, mock_execute_values.call_args.kwargs["page_size"])
 
         ds.connection.cursor.side_effect = Error("Error")
         self.assertRaises(Exception, ds.write_rows, table, rows, columns)
+
+    @patch("gobbagextract.datastore.postgres.execute_values")
+    def test_write_rows_hash(self, mock_execute_values):
+        ds = PostgresDatastoreExt({})
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_INSERT
+        ds.connection = MagicMock()
+        mock_execute_values.return_value = [(True,), (False,)]
+
+        rows = [("a", "obj", "h1"), ("b", "obj", "h2"), ("c", "obj", "h3")]
+        ds.write_rows("bag_panden", rows, ["object_id", "object", "hash"])
+
+        self.assertEqual(
+            "WITH merged AS (INSERT INTO bag_panden (object_id,object,hash) VALUES %s ON CONFLICT(object_id) "
+            "DO UPDATE SET object=EXCLUDED.object,hash=EXCLUDED.hash "
+            "WHERE bag_panden.hash IS DISTINCT FROM EXCLUDED.hash RETURNING xmax = 0 AS inserted) "
+            "SELECT inserted FROM merged",
+            mock_execute_values.call_args.args[1]
+        )
+        self.assertEqual({"inserted": 1, "updated": 1, "unchanged": 1}, ds.write_counts)
+
+    @patch("gobbagextract.datastore.postgres.execute_values")
+    def test_write_rows_copy(self, mock_execute_values):
+        ds = PostgresDatastoreExt({})
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_COPY
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        copied = []
+        cursor.copy_expert.side_effect = lambda query, data: copied.append(data.read())
+        cursor.fetchone.return_value = (1, 1)
+
+        rows = [
+            ["b", datetime.date(2021, 10, 15), Json({"key": "line\nbreak\ttab \\ backslash"})],
+            ["a", None, Json({"key": "first"})],
+            ["b", datetime.date(2021, 10, 16), Json({"key": "last"})],
+        ]
+        self.assertEqual(3, ds.write_rows("bag_panden", rows, ["object_id", "last_update", "object"]))
+        mock_execute_values.assert_not_called()
+
+        create, merge, notify = [c.args for c in cursor.execute.call_args_list]
+        create, merge = create[0], merge[0]
+        self.assertEqual(
+            "CREATE TEMPORARY TABLE bag_panden_staging ON COMMIT DROP AS "
+            "SELECT object_id,last_update,object FROM bag_panden WITH NO DATA",
+            create
+        )
+        cursor.copy_expert.assert_called_once()
+        self.assertEqual(
+            "COPY bag_panden_staging (object_id,last_update,object) FROM STDIN WITH (ENCODING 'UTF8')",
+            cursor.copy_expert.call_args.args[0]
+        )
+        self.assertEqual(
+            "WITH merged AS (INSERT INTO bag_panden (object_id,last_update,object) "
+            "SELECT object_id,last_update,object FROM bag_panden_staging ORDER BY object_id "
+            "ON CONFLICT(object_id) DO UPDATE SET last_update=EXCLUDED.last_update,object=EXCLUDED.object "
+            "RETURNING xmax = 0 AS inserted) "
+            "SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged",
+            merge
+        )
+        # 2 unique rows, 1 inserted, none updated
+        self.assertEqual({"inserted": 1, "updated": 0, "unchanged": 1}, ds.write_counts)
+        # The counts of the batch are published when it is committed
+        self.assertEqual(("SELECT pg_notify(%s, %s)", ("bag_extract", '{"event":"batch","table":"bag_panden",'
+                          '"mutation_import_id":null,"inserted":1,"updated":0,"unchanged":1}')), notify)
+
+        # Sorted by id, last row for an id wins
+        self.assertEqual([
+            b'a\t\\N\t{"key":"first"}\n'
+            b'b\t2021-10-16\t{"key":"last"}\n'
+        ], copied)
+        ds.connection.commit.assert_called_once()
+
+    def test_copy_value(self):
+        self.assertEqual(rb"\N", PostgresDatastoreExt._copy_value(None))
+        self.assertEqual(b"12", PostgresDatastoreExt._copy_value(12))
+        self.assertEqual(b"a\\tb\\nc\\rd\\\\e", PostgresDatastoreExt._copy_value("a\tb\nc\rd\\e"))
+        self.assertEqual(b'{"a":"b\\\\nc\\\\\\\\d"}', PostgresDatastoreExt._copy_value(Json({"a": "b\nc\\d"})))
+        self.assertEqual("Weesp ë".encode("utf-8"), PostgresDatastoreExt._copy_value("Weesp ë"))
+        self.assertEqual('{"a":"ë"}'.encode("utf-8"), PostgresDatastoreExt._copy_value(Json({"a": "ë"})))
+
+    def test_write_rows_reloading(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        ds._reloading["bag_panden_reload"] = "bag_panden"
+
+        ds.write_rows("bag_panden_reload", [["b", 2], ["a", 1]], ["object_id", "value"])
+
+        # Copied directly into the table, without staging table and merge
+        cursor.execute.assert_not_called()
+        self.assertEqual(
+            "COPY bag_panden_reload (object_id,value) FROM STDIN WITH (ENCODING 'UTF8')",
+            cursor.copy_expert.call_args.args[0]
+        )
+
+    def test_write_rows_reloading_compact(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        ds._reloading["bag_panden_0457_reload"] = "bag_panden"
+        ds._encode_objects = MagicMock(return_value=[["a", 1]])
+        ds._copy_reload = MagicMock()
+
+        ds.write_rows("bag_panden_0457_reload", [["a", {}]], ["object_id", "object"])
+
+        # The objects are encoded with the codes of the table that is reloaded
+        ds._encode_objects.assert_called_with("bag_panden", [["a", {}]], ["object_id", "object"])
+        ds._copy_reload.assert_called_with(ANY, "bag_panden_0457_reload", [["a", 1]], ["object_id", "object"])
+
+    def test_plain_keys(self):
+        ds = PostgresDatastoreExt({})
+        self.assertEqual(set(ds.PLAIN_KEYS), ds._plain_keys("bag_panden"))
+
+        ds._projections["bag_panden"] = [{"name": "bouwjaar", "key": "oorspronkelijkBouwjaar", "type": "integer"}]
+        ds._attribute_keys["bag_panden"] = {"status"}
+        self.assertEqual({*ds.PLAIN_KEYS, "oorspronkelijkBouwjaar", "status"}, ds._plain_keys("bag_panden"))
+
+    def test_key_codes(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+
+        # The codes are read once, new keys are added
+        cursor.fetchall.return_value = [("status", 1), ("geconstateerd", 2)]
+        self.assertEqual({"status": "1", "geconstateerd": "2"}, ds._key_codes("bag_panden", {"status"}))
+        self.assertEqual([
+            call("INSERT INTO bag_object_keys (table_name, key) SELECT %s, unnest(%s::varchar[]) "
+                 "ON CONFLICT DO NOTHING", ("bag_panden", ["status"])),
+            call("SELECT key, code FROM bag_object_keys WHERE table_name = %s", ("bag_panden",)),
+        ], cursor.execute.call_args_list)
+        ds.connection.commit.assert_called_once()
+
+        # Known keys
+        cursor.execute.reset_mock()
+        self.assertEqual({"status": "1", "geconstateerd": "2"}, ds._key_codes("bag_panden", {"geconstateerd"}))
+        cursor.execute.assert_not_called()
+
+        cursor.fetchall.return_value = [("status", 1), ("geconstateerd", 2), ("documentnummer", 5)]
+        self.assertEqual("5", ds._key_codes("bag_panden", {"status", "documentnummer"})["documentnummer"])
+        cursor.execute.assert_any_call(
+            "INSERT INTO bag_object_keys (table_name, key) SELECT %s, unnest(%s::varchar[]) ON CONFLICT DO NOTHING",
+            ("bag_panden", ["documentnummer"]))
+
+    def test_encode_objects(self):
+        ds = PostgresDatastoreExt({})
+        ds._key_codes = MagicMock(return_value={"status": "1", "voorkomen/Voorkomen/eindGeldigheid": "2"})
+        columns = ["object_id", "object", "hash"]
+        obj = {"status": "Pand in gebruik", "voorkomen/Voorkomen/eindGeldigheid": None}
+        rows = [["a", Json(obj), "h"], ["b", None, None]]
+
+        # Not compact
+        self.assertIs(rows, ds._encode_objects("bag_panden", rows, columns))
+        ds._key_codes.assert_not_called()
+
+        ds.COMPACT_OBJECTS = True
+        self.assertIs(rows, ds._encode_objects("bag_panden", rows, ["object_id", "hash"]))
+
+        # Plain keys are not encoded, even when they have a code
+        result = ds._encode_objects("bag_panden", rows, columns)
+        ds._key_codes.assert_called_with("bag_panden", {"status"})
+        self.assertEqual(["a", "h"], [result[0][0], result[0][2]])
+        self.assertEqual({"1": "Pand in gebruik", "voorkomen/Voorkomen/eindGeldigheid": None}, result[0][1].adapted)
+        self.assertIs(rows[1], result[1])
+        # The original rows are not changed
+        self.assertEqual(obj, rows[0][1].adapted)
+
+    def test_select_list(self):
+        ds = PostgresDatastoreExt({})
+        self.assertEqual("object_id,object", ds._select_list(["object_id", "object"]))
+
+        ds.GML_CONVERSION = "postgis"
+        self.assertEqual(
+            "object_id,(SELECT jsonb_object_agg(key, CASE WHEN value::text LIKE '\"<gml:%%' "
+            "THEN to_jsonb(ST_AsText(ST_Force2D(ST_GeomFromGML(value #>> '{}')))) ELSE value END) "
+            "FROM jsonb_each(object::jsonb)) AS object",
+            ds._select_list(["object_id", "object"])
+        )
+        self.assertEqual(
+            "(SELECT ST_GeomFromGML(value #>> '{}')::box FROM jsonb_each(object::jsonb) "
+            "WHERE value::text LIKE '\"<gml:%%' LIMIT 1) AS bbox,"
+            "(SELECT ST_Centroid(ST_GeomFromGML(value #>> '{}'))::point FROM jsonb_each(object::jsonb) "
+            "WHERE value::text LIKE '\"<gml:%%' LIMIT 1) AS centroid",
+            ds._select_list(["bbox", "centroid"])
+        )
+
+    @patch("gobbagextract.datastore.postgres.execute_values")
+    def test_write_rows_postgis(self, mock_execute_values):
+        ds = PostgresDatastoreExt({})
+        ds.GML_CONVERSION = "postgis"
+        ds.NOTIFY_CHANNEL = ""
+        ds._select_list = lambda columns: "converted"
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (1, 1)
+        columns = ["object_id", "object"]
+
+        # GML geometries are converted in the merge from the staging table
+        ds.write_rows("bag_panden", [["a", 1]], columns)
+        self.assertIn("SELECT converted FROM bag_panden_staging ORDER BY object_id", cursor.execute.call_args.args[0])
+
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_INSERT
+        ds.write_rows("bag_panden", [["a", 1]], columns)
+        self.assertTrue(mock_execute_values.call_args.args[1].startswith(
+            "WITH merged AS (INSERT INTO bag_panden (object_id,object) "
+            "SELECT converted FROM (VALUES %s) AS source (object_id,object) "
+        ))
+
+        # A table that is being reloaded gets the rows from a staging table
+        ds._reloading["bag_panden_reload"] = "bag_panden"
+        cursor.reset_mock()
+        ds.write_rows("bag_panden_reload", [["a", 1]], columns)
+        self.assertEqual(
+            "COPY bag_panden_reload_staging (object_id,object) FROM STDIN WITH (ENCODING 'UTF8')",
+            cursor.copy_expert.call_args.args[0]
+        )
+        cursor.execute.assert_called_with("INSERT INTO bag_panden_reload (object_id,object) "
+                                          "SELECT converted FROM bag_panden_reload_staging ORDER BY object_id")
+
+    def test_reload_table(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        ds._swap_partition = MagicMock()
+        ds._count_reload = MagicMock()
+        ds._notify_batch = MagicMock()
+        ds._reload_projection = MagicMock()
+        ds._reload_current = MagicMock()
+        ds._log_reload = MagicMock()
+        ds._keep_last_update = MagicMock()
+
+        # Only the partition of the gemeente is reloaded
+        with ds.reload_table("bag_panden", "0457") as reload_table:
+            self.assertEqual("bag_panden_0457_reload", reload_table)
+            self.assertIn("bag_panden_0457_reload", ds._reloading)
+            self.assertEqual([
+                call("DROP TABLE IF EXISTS bag_panden_0457_reload"),
+                call("CREATE UNLOGGED TABLE bag_panden_0457_reload (LIKE bag_panden INCLUDING DEFAULTS)"),
+            ], cursor.execute.call_args_list)
+            ds._swap_partition.assert_not_called()
+
+        reload = "bag_panden_0457_reload"
+        ds._count_reload.assert_called_with(cursor, "bag_panden", reload, "0457")
+        ds._notify_batch.assert_called_with(cursor, "bag_panden", ds._count_reload.return_value)
+        ds._log_reload.assert_called_with(cursor, "bag_panden", reload, "0457")
+        ds._keep_last_update.assert_called_with(cursor, "bag_panden_0457", reload)
+        ds._reload_projection.assert_called_with(cursor, "bag_panden", reload, "0457")
+        ds._reload_current.assert_called_with(cursor, "bag_panden", reload, "0457")
+        ds._swap_partition.assert_called_with(cursor, "bag_panden", "0457", reload)
+        self.assertEqual({}, ds._reloading)
+        self.assertEqual(2, ds.connection.commit.call_count)
+
+    def test_reload_table_keep_closed(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        ds._swap_partition = MagicMock()
+        ds._count_reload = MagicMock()
+
+        ds._key_codes = MagicMock(return_value={})
+
+        with ds.reload_table("bag_panden", "0457", keep_closed=True):
+            cursor.execute.assert_called_with(
+                "INSERT INTO bag_panden_0457_reload (id,object_id,gemeente,last_update,object,hash,bbox,centroid) "
+                "SELECT id,object_id,gemeente,last_update,object,hash,bbox,centroid FROM bag_panden_0457 "
+                "WHERE object->>'voorkomen/Voorkomen/eindGeldigheid' IS NOT NULL AND hash IS NOT NULL",
+                {"table": "bag_panden", "plain_keys": sorted(ds.PLAIN_KEYS)})
+        ds._key_codes.assert_called_with("bag_panden", set())
+
+        # The objects of table have been stored compact, the kept objects are expanded
+        ds._key_codes.return_value = {"status": "1"}
+        ds._keep_closed("bag_panden", "bag_panden_0457", "bag_panden_0457_reload")
+        self.assertIn(",bag_expand_object(%(table)s, object) AS object,", cursor.execute.call_args.args[0])
+
+        # The kept objects are encoded with the plain keys of now
+        ds.COMPACT_OBJECTS = True
+        ds._attribute_keys["bag_panden"] = {"status"}
+        ds._keep_closed("bag_panden", "bag_panden_0457", "bag_panden_0457_reload")
+        query, params = cursor.execute.call_args.args
+        self.assertIn(",(SELECT jsonb_object_agg(coalesce(k.code::text, o.key), o.value) "
+                      "FROM jsonb_each(bag_expand_object(%(table)s, object)) o "
+                      "LEFT JOIN bag_object_keys k ON k.table_name = %(table)s AND k.key = o.key "
+                      "AND k.key <> ALL(%(plain_keys)s)) AS object,", query)
+        self.assertEqual({"table": "bag_panden", "plain_keys": sorted({*ds.PLAIN_KEYS, "status"})}, params)
+
+        with self.assertRaisesRegex(GOBException, "Invalid gemeente 04;57"):
+            with ds.reload_table("bag_panden", "04;57"):
+                pass
+
+    def test_closed_object_ids(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.__iter__.return_value = iter([("pndA.1",), ("pndB.1",)])
+
+        self.assertEqual({"pndA.1", "pndB.1"}, ds.closed_object_ids("bag_panden", "0457"))
+        cursor.execute.assert_called_with(
+            "SELECT object_id FROM bag_panden "
+            "WHERE gemeente = %s AND object->>'voorkomen/Voorkomen/eindGeldigheid' IS NOT NULL "
+            "AND hash IS NOT NULL", ("0457",))
+        # The read transaction is ended, see _write_prepared
+        ds.connection.commit.assert_called_once()
+
+    def test_ensure_attribute_indexes(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [
+            ("ix_bag_panden_object_id",), ("ix_bag_panden_attr_status",), ("ix_bag_panden_attr_bouwjaar",)
+        ]
+        indexes = [
+            {"name": "status", "key": "status"},
+            {"name": "begin_geldigheid", "key": "voorkomen/Voorkomen/beginGeldigheid"},
+        ]
+
+        # Existing indexes are kept, indexes that are no longer declared are dropped
+        self.assertEqual(["ix_bag_panden_attr_begin_geldigheid"], ds.ensure_attribute_indexes("bag_panden", indexes))
+        cursor.execute.assert_has_calls([
+            call("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                 ("bag_panden",)),
+            call("DROP INDEX ix_bag_panden_attr_bouwjaar"),
+            call("CREATE INDEX ix_bag_panden_attr_begin_geldigheid ON bag_panden ((object->>%s))",
+                 ("voorkomen/Voorkomen/beginGeldigheid",)),
+        ])
+        self.assertEqual(3, cursor.execute.call_count)
+        ds.connection.commit.assert_called_once()
+        self.assertEqual({"status", "voorkomen/Voorkomen/beginGeldigheid"}, ds._attribute_keys["bag_panden"])
+
+        ds.connection.cursor.side_effect = Error("no table")
+        with self.assertRaisesRegex(GOBException, "Error indexing table bag_panden. Error: no table"):
+            ds.ensure_attribute_indexes("bag_panden", indexes)
+
+    @patch("gobbagextract.datastore.postgres.execute_values")
+    def test_write_rows_projection(self, mock_execute_values):
+        ds = PostgresDatastoreExt({})
+        ds._projections["bag_panden"] = [
+            {"name": "status", "key": "status", "type": "string"},
+            {"name": "bouwjaar", "key": "oorspronkelijkBouwjaar", "type": "integer"},
+        ]
+        ds.NOTIFY_CHANNEL = ""
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (1, 1)
+        projection = "projected AS (INSERT INTO bag_panden_projection (object_id,status,bouwjaar) " \
+                     "SELECT object_id,(object->>'status')::varchar,(object->>'oorspronkelijkBouwjaar')::integer " \
+                     "FROM merged ON CONFLICT(object_id) " \
+                     "DO UPDATE SET status=EXCLUDED.status,bouwjaar=EXCLUDED.bouwjaar)"
+
+        # The merged objects are projected in the same statement
+        ds.write_rows("bag_panden", [["a", 1]], ["object_id", "object"])
+        merge = cursor.execute.call_args.args[0]
+        self.assertIn("RETURNING xmax = 0 AS inserted, object_id, object), " + projection, merge)
+        self.assertTrue(merge.endswith("SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged"))
+
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_INSERT
+        ds.write_rows("bag_panden", [["a", 1]], ["object_id", "object"])
+        self.assertIn("), " + projection + " SELECT inserted FROM merged", mock_execute_values.call_args.args[1])
+
+        # Other tables have no projection
+        ds.write_rows("bag_verblijfsobjecten", [["a", 1]], ["object_id", "object"])
+        self.assertNotIn("projected", mock_execute_values.call_args.args[1])
+
+    def test_ensure_projection(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        columns = [{"name": "bouwjaar", "key": "oorspronkelijkBouwjaar", "type": "integer"}]
+        definition = '[{"key": "oorspronkelijkBouwjaar", "name": "bouwjaar", "type": "integer"}]'
+
+        # New projection, created and filled
+        cursor.fetchone.return_value = (None,)
+        self.assertTrue(ds.ensure_projection("bag_panden", columns))
+        cursor.execute.assert_has_calls([
+            call("SELECT obj_description(to_regclass(%s), 'pg_class')", ("bag_panden_projection",)),
+            call("DROP TABLE IF EXISTS bag_panden_projection"),
+            call("CREATE TABLE bag_panden_projection (object_id varchar PRIMARY KEY,bouwjaar integer)"),
+            call("COMMENT ON TABLE bag_panden_projection IS %s", (definition,)),
+            call("INSERT INTO bag_panden_projection (object_id,bouwjaar) "
+                 "SELECT object_id,(object->>'oorspronkelijkBouwjaar')::integer FROM bag_panden "
+                 "ON CONFLICT(object_id) DO UPDATE SET bouwjaar=EXCLUDED.bouwjaar"),
+        ])
+        self.assertEqual({"bag_panden": columns}, ds._projections)
+
+        # Unchanged projection
+        cursor.reset_mock()
+        cursor.fetchone.return_value = (definition,)
+        self.assertFalse(ds.ensure_projection("bag_panden", columns))
+        self.assertEqual(1, cursor.execute.call_count)
+        self.assertEqual({"bag_panden": columns}, ds._projections)
+
+        # No columns, the projection table is dropped
+        cursor.reset_mock()
+        self.assertFalse(ds.ensure_projection("bag_panden", []))
+        cursor.execute.assert_called_with("DROP TABLE IF EXISTS bag_panden_projection")
+        self.assertEqual({}, ds._projections)
+
+        with self.assertRaisesRegex(GOBException, "Invalid type float for projection column bouwjaar"):
+            ds.ensure_projection("bag_panden", [columns[0] | {"type": "float"}])
+        with self.assertRaisesRegex(GOBException, "Invalid key o'key for projection column bouwjaar"):
+            ds.ensure_projection("bag_panden", [columns[0] | {"key": "o'key"}])
+
+        ds.connection.cursor.side_effect = Error("no table")
+        with self.assertRaisesRegex(GOBException, "Error creating projection of table bag_panden. Error: no table"):
+            ds.ensure_projection("bag_panden", columns)
+
+    def test_reload_projection(self):
+        ds = PostgresDatastoreExt({})
+        cursor = Mock()
+        ds._reload_projection(cursor, "bag_panden", "bag_panden_reload", "0457")
+        cursor.execute.assert_not_called()
+
+        ds._projections["bag_panden"] = [{"name": "status", "key": "status", "type": "string"}]
+        ds._reload_projection(cursor, "bag_panden", "bag_panden_reload", "0457")
+        cursor.execute.assert_has_calls([
+            call("DELETE FROM bag_panden_projection p USING bag_panden o "
+                 "WHERE o.object_id = p.object_id AND o.gemeente = %s", ("0457",)),
+            call("INSERT INTO bag_panden_projection (object_id,status) "
+                 "SELECT object_id,(object->>'status')::varchar FROM bag_panden_reload "
+                 "ON CONFLICT(object_id) DO UPDATE SET status=EXCLUDED.status"),
+        ])
+
+    def test_write_rows_current(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (1, 1)
+        ds._update_current = MagicMock()
+
+        ds.write_rows("bag_panden", [["pndA.1", 1], ["pndA.2", 2]], ["object_id", "object"])
+        ds._update_current.assert_not_called()
+
+        ds.current_tables.add("bag_panden")
+        ds.write_rows("bag_panden", [["pndA.1", 1], ["pndA.2", 2]], ["object_id", "object"])
+        ds._update_current.assert_called_with(cursor, "bag_panden", ["pndA.1", "pndA.2"])
+
+        # Reloads fill the current table at the end
+        ds._update_current.reset_mock()
+        ds._reloading["bag_panden_reload"] = "bag_panden"
+        ds.write_rows("bag_panden_reload", [["pndA.1", 1]], ["object_id", "object"])
+        ds._update_current.assert_not_called()
+
+    def test_update_current(self):
+        ds = PostgresDatastoreExt({})
+        cursor = Mock()
+
+        ds._update_current(cursor, "bag_panden", ["pndB.1", "pndA.1", "pndA.2", "pndC"])
+
+        columns = "object_id,gemeente,last_update,object,hash,bbox,centroid"
+        cursor.execute.assert_called_with(
+            "WITH selected AS (SELECT DISTINCT ON (split_part(object_id, '.', 1)) "
+            f"split_part(object_id, '.', 1) AS identificatie,{columns} FROM bag_panden "
+            f"WHERE (split_part(object_id, '.', 1) = ANY(%(identificaties)s)) AND {ds.CURRENT_CONDITION} "
+            "ORDER BY split_part(object_id, '.', 1),NULLIF(split_part(object_id, '.', 2), '')::integer "
+            "DESC NULLS LAST), "
+            "deleted AS (DELETE FROM bag_panden_current WHERE identificatie = ANY(%(identificaties)s) "
+            "AND NOT EXISTS (SELECT FROM selected WHERE selected.identificatie = bag_panden_current.identificatie)) "
+            f"INSERT INTO bag_panden_current (identificatie,{columns}) SELECT identificatie,{columns} FROM selected "
+            "ON CONFLICT(identificatie) DO UPDATE SET object_id=EXCLUDED.object_id,gemeente=EXCLUDED.gemeente,"
+            "last_update=EXCLUDED.last_update,object=EXCLUDED.object,hash=EXCLUDED.hash,bbox=EXCLUDED.bbox,"
+            "centroid=EXCLUDED.centroid "
+            "WHERE bag_panden_current.object_id <> EXCLUDED.object_id "
+            "OR bag_panden_current.hash IS DISTINCT FROM EXCLUDED.hash",
+            {"identificaties": ["pndA", "pndB", "pndC"]}
+        )
+
+    def test_current_condition(self):
+        # A voorkomen that ends in the future is current, one that begins in the future is not yet current
+        self.assertEqual(
+            "object->>'voorkomen/Voorkomen/eindRegistratie' IS NULL "
+            "AND (object->>'voorkomen/Voorkomen/beginGeldigheid' IS NULL "
+            "OR left(object->>'voorkomen/Voorkomen/beginGeldigheid', 10) <= to_char(CURRENT_DATE, 'YYYY-MM-DD')) "
+            "AND (object->>'voorkomen/Voorkomen/eindGeldigheid' IS NULL "
+            "OR object->>'voorkomen/Voorkomen/eindGeldigheid' > to_char(CURRENT_DATE, 'YYYY-MM-DD'))",
+            PostgresDatastoreExt.CURRENT_CONDITION
+        )
+
+    def test_refresh_current(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+
+        ds.refresh_current("bag_panden", "0457")
+        cursor.execute.assert_not_called()
+
+        # The first refresh of the gemeente updates all its objects
+        ds.current_tables.add("bag_panden")
+        cursor.fetchone.return_value = None
+        ds.refresh_current("bag_panden", "0457")
+        select, merge, refreshed = cursor.execute.call_args_list
+        self.assertEqual(call("SELECT to_char(refreshed, 'YYYY-MM-DD') FROM bag_current_refreshes "
+                              "WHERE table_name = %s AND gemeente = %s", ("bag_panden", "0457")), select)
+        query, params = merge.args
+        self.assertIn(f"FROM bag_panden WHERE (gemeente = %(gemeente)s) AND {ds.CURRENT_CONDITION} ", query)
+        self.assertIn("DELETE FROM bag_panden_current WHERE gemeente = %(gemeente)s AND NOT EXISTS ", query)
+        self.assertEqual({"gemeente": "0457"}, params)
+        self.assertEqual(call("INSERT INTO bag_current_refreshes (table_name, gemeente, refreshed) "
+                              "VALUES (%s, %s, CURRENT_DATE) "
+                              "ON CONFLICT (table_name, gemeente) DO UPDATE SET refreshed = EXCLUDED.refreshed",
+                              ("bag_panden", "0457")), refreshed)
+        ds.connection.commit.assert_called_once()
+
+        # Later refreshes only update the objects with a voorkomen that has begun or ended since
+        cursor.reset_mock()
+        cursor.fetchone.return_value = ("2021-10-14",)
+        cursor.fetchall.return_value = [("pndA.1",), ("pndB.2",)]
+        ds._update_current = Mock()
+        ds.refresh_current("bag_panden", "0457")
+        self.assertEqual(call(f"SELECT object_id FROM bag_panden WHERE gemeente = %(gemeente)s "
+                              f"AND ({ds.CHANGED_CONDITION})", {"gemeente": "0457", "since": "2021-10-14"}),
+                         cursor.execute.call_args_list[1])
+        ds._update_current.assert_called_once_with(cursor, "bag_panden", ["pndA.1", "pndB.2"])
+        self.assertEqual(3, cursor.execute.call_count)
+
+        ds.connection.cursor.side_effect = Error("no table")
+        with self.assertRaisesRegex(GOBException,
+                                    "Error refreshing current table of table bag_panden. Error: no table"):
+            ds.refresh_current("bag_panden", "0457")
+
+    def test_reload_current(self):
+        ds = PostgresDatastoreExt({})
+        cursor = Mock()
+        ds._reload_current(cursor, "bag_panden", "bag_panden_reload", "0457")
+        cursor.execute.assert_not_called()
+
+        ds.current_tables.add("bag_panden")
+        ds._reload_current(cursor, "bag_panden", "bag_panden_reload", "0457")
+        delete, insert, refreshed = cursor.execute.call_args_list
+        self.assertEqual(call("DELETE FROM bag_panden_current WHERE gemeente = %s", ("0457",)), delete)
+        self.assertEqual(("bag_panden", "0457"), refreshed.args[1])
+        insert = insert.args[0]
+        self.assertTrue(insert.startswith(
+            "INSERT INTO bag_panden_current (identificatie,object_id,gemeente,last_update,object,hash,bbox,centroid) "
+            "SELECT DISTINCT ON (split_part(object_id, '.', 1))"
+        ))
+        self.assertIn("FROM bag_panden_reload WHERE (TRUE) AND ", insert)
+
+    def test_reload_table_error(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        ds._swap_partition = MagicMock()
+        ds._count_reload = MagicMock()
+
+        # Error while writing rows
+        with self.assertRaises(ValueError):
+            with ds.reload_table("bag_panden", "0457"):
+                raise ValueError
+
+        ds._swap_partition.assert_not_called()
+        ds.connection.rollback.assert_called_once()
+        cursor.execute.assert_called_with("DROP TABLE IF EXISTS bag_panden_0457_reload")
+        self.assertEqual({}, ds._reloading)
+
+        # Database error while swapping
+        ds._swap_partition.side_effect = Error("swap failed")
+        with self.assertRaisesRegex(GOBException, "Error reloading table bag_panden. Error: swap failed"):
+            with ds.reload_table("bag_panden", "0457"):
+                pass
+        cursor.execute.assert_called_with("DROP TABLE IF EXISTS bag_panden_0457_reload")
+
+    def test_index_statements(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [("bag_panden_pkey", "PRIMARY KEY (id)")],
+            [
+                ("bag_panden_pkey", "CREATE UNIQUE INDEX bag_panden_pkey ON public.bag_panden USING btree (id)"),
+                ("ix_bag_panden_object_id",
+                 "CREATE UNIQUE INDEX ix_bag_panden_object_id ON public.bag_panden USING btree (object_id)"),
+            ]
+        ]
+        create, rename = PostgresDatastoreExt._index_statements(cursor, "bag_panden", "bag_panden_reload")
+
+        self.assertEqual([
+            "ALTER TABLE bag_panden_reload ADD CONSTRAINT bag_panden_pkey_reload PRIMARY KEY (id)",
+            "CREATE UNIQUE INDEX ix_bag_panden_object_id_reload ON bag_panden_reload USING btree (object_id)",
+        ], create)
+        self.assertEqual([
+            "ALTER TABLE bag_panden RENAME CONSTRAINT bag_panden_pkey_reload TO bag_panden_pkey",
+            "ALTER INDEX ix_bag_panden_object_id_reload RENAME TO ix_bag_panden_object_id",
+        ], rename)
+
+    def test_swap_partition(self):
+        ds = PostgresDatastoreExt({})
+        ds._index_statements = MagicMock(return_value=(["CREATE INDEX"], ["RENAME INDEX"]))
+        cursor = MagicMock()
+
+        ds._swap_partition(cursor, "bag_panden", "0457", "bag_panden_0457_reload")
+        ds._index_statements.assert_called_with(cursor, "bag_panden_0457", "bag_panden_0457_reload")
+        self.assertEqual([
+            call("ALTER TABLE bag_panden_0457_reload SET LOGGED"),
+            call("ALTER TABLE bag_panden_0457_reload ADD CONSTRAINT bag_panden_0457_reload_gemeente "
+                 "CHECK (gemeente IS NOT NULL AND gemeente = %s)", ("0457",)),
+            call("CREATE INDEX"),
+            call("ALTER TABLE bag_panden DETACH PARTITION bag_panden_0457"),
+            call("ALTER TABLE bag_panden ATTACH PARTITION bag_panden_0457_reload FOR VALUES IN (%s)", ("0457",)),
+            call("ALTER TABLE bag_panden_0457_reload DROP CONSTRAINT bag_panden_0457_reload_gemeente"),
+            call("DROP TABLE bag_panden_0457"),
+            call("ALTER TABLE bag_panden_0457_reload RENAME TO bag_panden_0457"),
+            call("RENAME INDEX"),
+        ], cursor.execute.call_args_list)
+
+    def test_ensure_partition(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+
+        cursor.fetchone.return_value = (None,)
+        self.assertTrue(ds.ensure_partition("bag_panden", "0457"))
+        cursor.execute.assert_has_calls([
+            call("SELECT to_regclass(%s)", ("bag_panden_0457",)),
+            call("CREATE TABLE bag_panden_0457 PARTITION OF bag_panden FOR VALUES IN (%s)", ("0457",)),
+        ])
+        ds.connection.commit.assert_called_once()
+
+        cursor.reset_mock()
+        cursor.fetchone.return_value = ("bag_panden_0457",)
+        self.assertFalse(ds.ensure_partition("bag_panden", "0457"))
+        self.assertEqual(1, cursor.execute.call_count)
+
+        with self.assertRaisesRegex(GOBException, "Invalid gemeente None"):
+            ds.ensure_partition("bag_panden", None)
+
+        ds.connection.cursor.side_effect = Error("no table")
+        with self.assertRaisesRegex(GOBException, "Error creating partition of table bag_panden. Error: no table"):
+            ds.ensure_partition("bag_panden", "0457")
+
+    def test_upsert_query_partitioned(self):
+        ds = PostgresDatastoreExt({})
+        self.assertEqual(
+            "INSERT INTO bag_panden (object_id,gemeente,hash) VALUES %s ON CONFLICT(object_id,gemeente) "
+            "DO UPDATE SET gemeente=EXCLUDED.gemeente,hash=EXCLUDED.hash "
+            "WHERE bag_panden.hash IS DISTINCT FROM EXCLUDED.hash",
+            ds._upsert_query("bag_panden", ["object_id", "gemeente", "hash"], "VALUES %s")
+        )
+
+    def test_returning_partitioned(self):
+        ds = PostgresDatastoreExt({})
+        self.assertEqual("RETURNING xmax = 0 AS inserted", ds._returning("bag_panden", ["object_id", "hash"]))
+
+        # A partitioned table cannot return xmax
+        self.assertEqual(
+            "RETURNING NOT EXISTS (SELECT FROM bag_panden o WHERE o.object_id = bag_panden.object_id "
+            "AND o.gemeente = bag_panden.gemeente) AS inserted",
+            ds._returning("bag_panden", ["object_id", "gemeente", "hash"])
+        )
+
+    def test_count_reload(self):
+        ds = PostgresDatastoreExt({})
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (10, 2, 3)
+
+        ds._count_reload(cursor, "bag_panden", "bag_panden_reload", "0457")
+        self.assertEqual(
+            "SELECT count(*), count(*) FILTER (WHERE o.object_id IS NULL), "
+            "count(*) FILTER (WHERE o.object_id IS NOT NULL AND o.hash IS DISTINCT FROM n.hash) "
+            "FROM bag_panden_reload n LEFT JOIN bag_panden o ON o.object_id = n.object_id AND o.gemeente = n.gemeente "
+            "WHERE n.gemeente = %s",
+            cursor.execute.call_args.args[0]
+        )
+        self.assertEqual({"inserted": 2, "updated": 3, "unchanged": 5}, ds.write_counts)
+
+    def test_keep_last_update(self):
+        ds = PostgresDatastoreExt({})
+        cursor = MagicMock()
+
+        ds._keep_last_update(cursor, "bag_panden_0457", "bag_panden_0457_reload")
+        cursor.execute.assert_called_with(
+            "UPDATE bag_panden_0457_reload n SET last_update = o.last_update FROM bag_panden_0457 o "
+            "WHERE o.object_id = n.object_id AND o.hash = n.hash AND o.last_update <> n.last_update")
+
+    @patch("gobbagextract.datastore.postgres.execute_values")
+    def test_write_rows_change_log(self, mock_execute_values):
+        ds = PostgresDatastoreExt({})
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_INSERT
+        ds.NOTIFY_CHANNEL = ""
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        ds.change_log_id = 42
+        mock_execute_values.return_value = [(True, "c"), (False, "a")]
+
+        rows = [("a", "h1"), ("b", "h2"), ("c", "h3")]
+        ds.write_rows("bag_panden", rows, ["object_id", "hash"])
+
+        self.assertIn("RETURNING xmax = 0 AS inserted, object_id) SELECT inserted, object_id FROM merged",
+                      mock_execute_values.call_args.args[1])
+        query = "INSERT INTO bag_change_log (mutation_import_id,table_name,change,object_ids) VALUES (%s,%s,%s,%s)"
+        self.assertEqual([
+            call(query, (42, "bag_panden", "inserted", ["c"])),
+            call(query, (42, "bag_panden", "updated", ["a"])),
+            call(query, (42, "bag_panden", "unchanged", ["b"])),
+        ], cursor.execute.call_args_list)
+        self.assertEqual({"inserted": 1, "updated": 1, "unchanged": 1}, ds.write_counts)
+
+        # Copy mode, nothing changed
+        ds.WRITE_MODE = PostgresDatastoreExt.WRITE_MODE_COPY
+        cursor.reset_mock()
+        cursor.fetchall.return_value = []
+        ds.write_rows("bag_panden", rows, ["object_id", "hash"])
+
+        merge, log = [c.args for c in cursor.execute.call_args_list[1:]]
+        self.assertTrue(merge[0].endswith("RETURNING xmax = 0 AS inserted, object_id) "
+                                          "SELECT inserted, object_id FROM merged"))
+        self.assertEqual((query, (42, "bag_panden", "unchanged", ["a", "b", "c"])), log)
+        self.assertEqual({"inserted": 1, "updated": 1, "unchanged": 4}, ds.write_counts)
+
+    def test_start_change_log(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+
+        ds.start_change_log(42, 30)
+        self.assertEqual(42, ds.change_log_id)
+        cursor.execute.assert_called_with(
+            "DELETE FROM bag_change_log WHERE logged_at < now() - %s * interval '1 day'", (30,))
+        ds.connection.commit.assert_called_once()
+
+    def test_log_reload(self):
+        ds = PostgresDatastoreExt({})
+        cursor = MagicMock()
+
+        ds._log_reload(cursor, "bag_panden", "bag_panden_reload", "0457")
+        cursor.execute.assert_not_called()
+
+        ds.change_log_id = 42
+        ds._log_reload(cursor, "bag_panden", "bag_panden_reload", "0457")
+        self.assertEqual(
+            "INSERT INTO bag_change_log (mutation_import_id,table_name,change,object_ids) "
+            "SELECT %s, %s, change, array_agg(object_id ORDER BY object_id) FROM ("
+            "SELECT n.object_id, CASE WHEN o.object_id IS NULL THEN 'inserted' "
+            "WHEN o.hash IS DISTINCT FROM n.hash THEN 'updated' ELSE 'unchanged' END AS change "
+            "FROM bag_panden_reload n LEFT JOIN bag_panden o ON o.object_id = n.object_id AND o.gemeente = n.gemeente "
+            "WHERE n.gemeente = %s "
+            "UNION ALL "
+            "SELECT o.object_id, 'deleted' FROM bag_panden o WHERE o.gemeente = %s "
+            "AND NOT EXISTS (SELECT FROM bag_panden_reload n "
+            "WHERE n.object_id = o.object_id AND n.gemeente = o.gemeente)"
+            ") changes GROUP BY change",
+            cursor.execute.call_args.args[0]
+        )
+        self.assertEqual((42, "bag_panden", "0457", "0457"), cursor.execute.call_args.args[1])
+
+    def test_get_changes(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.__iter__.return_value = iter([("updated", "pndA.1"), ("inserted", "pndB.1"), ("updated", "pndC.2")])
+
+        self.assertEqual({"updated": ["pndA.1", "pndC.2"], "inserted": ["pndB.1"]},
+                         ds.get_changes(42, "bag_panden"))
+        cursor.execute.assert_called_with(
+            "SELECT change, object_id FROM bag_changes(%s, %s) ORDER BY object_id", (42, "bag_panden"))
+
+    def test_notify_batch(self):
+        ds = PostgresDatastoreExt({})
+        ds.mutation_import_id = 42
+        cursor = MagicMock()
+
+        ds._notify_batch(cursor, "bag_panden", {"inserted": 1, "updated": 2, "unchanged": 3})
+        cursor.execute.assert_called_with("SELECT pg_notify(%s, %s)", (
+            "bag_extract",
+            '{"event":"batch","table":"bag_panden","mutation_import_id":42,"inserted":1,"updated":2,"unchanged":3}'
+        ))
+
+        cursor.reset_mock()
+        ds.NOTIFY_CHANNEL = ""
+        ds._notify_batch(cursor, "bag_panden", {"inserted": 1, "updated": 2, "unchanged": 3})
+        cursor.execute.assert_not_called()
+
+    def test_shard_rows(self):
+        rows = [[f"{i:016}.{v}"] for i in range(100) for v in (1, 2)]
+
+        shards = PostgresDatastoreExt._shard_rows(rows, 4)
+        self.assertEqual(4, len(shards))
+        self.assertEqual(sorted(rows), sorted(row for shard in shards for row in shard))
+        self.assertTrue(all(shard for shard in shards))
+
+        # All voorkomens of an object are in the same shard, in the original order
+        for shard in shards:
+            ids = [row[0] for row in shard]
+            self.assertEqual(ids, sorted(ids))
+            for object_id in ids:
+                identificatie = object_id.split(".")[0]
+                self.assertIn(f"{identificatie}.1", ids)
+                self.assertIn(f"{identificatie}.2", ids)
+
+    @staticmethod
+    def _sharded_datastore() -> tuple[PostgresDatastoreExt, list, list]:
+        """Returns a datastore that writes in 3 shards, its connections and the list of statements and commits."""
+        ds = PostgresDatastoreExt({})
+        ds.WRITE_CONNECTIONS = 3
+        ds.WRITE_MODE = ds.WRITE_MODE_COPY
+        ds.NOTIFY_CHANNEL = "bag_extract"
+        ds.connection = MagicMock()
+        connections = [ds.connection, MagicMock(), MagicMock()]
+        ds._write_connections = Mock(return_value=connections)
+        ds._copy_rows = Mock(side_effect=lambda cursor, table, rows, columns, prepared=False:
+                             (len(rows), len(rows), 0))
+        ds._insert_rows = Mock(side_effect=lambda cursor, table, rows, columns: (len(rows), len(rows), 0))
+
+        events = []
+        ds.connection.commit.side_effect = lambda: events.append("commit 0")
+        for i, connection in enumerate(connections[1:], 1):
+            connection.tpc_commit.side_effect = lambda i=i: events.append(f"tpc_commit {i}")
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = lambda query, params=None: events.append(query)
+        cursor.fetchone.return_value = (1234,)
+        return ds, connections, events
+
+    def test_write_rows_shards(self):
+        ds, connections, events = self._sharded_datastore()
+
+        rows = [[f"{i:016}.1", "obj"] for i in range(30)]
+        ds.write_rows("bag_panden", rows, ["object_id", "object"])
+
+        # Every connection copies its own shard, the shards after the first one in a prepared transaction
+        self.assertEqual(3, ds._copy_rows.call_count)
+        written = [call.args[2] for call in ds._copy_rows.call_args_list]
+        self.assertEqual(sorted(rows), sorted(row for shard in written for row in shard))
+        prepared = {call.args[0]: call.kwargs.get("prepared", False) for call in ds._copy_rows.call_args_list}
+        self.assertEqual([False, True, True], [prepared[connection.cursor.return_value.__enter__.return_value]
+                                               for connection in connections])
+        self.assertEqual({"inserted": 30, "updated": 0, "unchanged": 0}, ds.write_counts)
+
+        # The prepared transactions are named after the transaction of the first connection, which coordinates
+        ds.connection.tpc_begin.assert_not_called()
+        for i, connection in enumerate(connections[1:], 1):
+            connection.tpc_begin.assert_called_once_with(f"bagextract_1234_{i}")
+            connection.tpc_prepare.assert_called_once()
+            connection.tpc_commit.assert_called_once_with()
+            connection.tpc_rollback.assert_not_called()
+
+        # The commit of the first connection decides, the batch is published when all shards have been committed
+        self.assertEqual(["SELECT txid_current()", "commit 0", "tpc_commit 1", "tpc_commit 2",
+                          "SELECT pg_notify(%s, %s)", "commit 0"], events)
+
+        # Insert mode, and an empty batch
+        ds, connections, events = self._sharded_datastore()
+        ds.WRITE_MODE = ds.WRITE_MODE_INSERT
+        ds.write_rows("bag_panden", rows, ["object_id", "object"])
+        ds._copy_rows.assert_not_called()
+        self.assertEqual(3, ds._insert_rows.call_count)
+
+        events.clear()
+        ds.write_rows("bag_panden", [], ["object_id", "object"])
+        self.assertEqual(1, connections[1].tpc_begin.call_count)
+        self.assertEqual(["SELECT txid_current()", "commit 0", "SELECT pg_notify(%s, %s)", "commit 0"], events)
+
+    def test_write_rows_shards_rollback(self):
+        ds, connections, events = self._sharded_datastore()
+
+        # All shards are rolled back when one of them fails, nothing is committed nor published
+        connections[2].cursor.side_effect = Error("deadlock")
+        with self.assertRaisesRegex(GOBException, "Error writing rows to table bag_panden. Error: deadlock"):
+            ds.write_rows("bag_panden", [[f"{i:016}.1", "obj"] for i in range(30)], ["object_id", "object"])
+        ds.connection.rollback.assert_called_once()
+        for connection in connections[1:]:
+            connection.tpc_prepare.assert_not_called()
+            connection.tpc_rollback.assert_called_once()
+        self.assertEqual(["SELECT txid_current()"], events)
+
+        # When the server does not allow prepared transactions only the begun transactions are rolled back
+        ds, connections, events = self._sharded_datastore()
+        connections[1].tpc_begin.side_effect = Error("prepared transactions are disabled")
+        with self.assertRaisesRegex(GOBException, "prepared transactions are disabled"):
+            ds.write_rows("bag_panden", [[f"{i:016}.1", "obj"] for i in range(30)], ["object_id", "object"])
+        ds.connection.rollback.assert_called_once()
+        self.assertEqual([0, 0], [connection.tpc_rollback.call_count for connection in connections[1:]])
+        connections[2].tpc_begin.assert_not_called()
+
+    def test_recover_prepared(self):
+        ds = PostgresDatastoreExt({})
+        ds.connection = MagicMock()
+        ds.connection.info.dbname = "gob_bagextract"
+        cursor = ds.connection.cursor.return_value.__enter__.return_value
+
+        def xid(gtrid: str, database: str = "gob_bagextract"):
+            return Mock(gtrid=gtrid, database=database)
+
+        ds.connection.tpc_recover.return_value = [xid("other"), xid("bagextract_12_1", "other_database")]
+        self.assertEqual({}, ds.recover_prepared())
+        cursor.execute.assert_not_called()
+
+        committed, aborted, running = xid("bagextract_12_1"), xid("bagextract_13_2"), xid("bagextract_14_1")
+        ds.connection.tpc_recover.return_value = [committed, xid(None), aborted, running]
+        cursor.fetchall.return_value = [("committed",), ("aborted",), ("in progress",)]
+        self.assertEqual({"bagextract_12_1": "committed", "bagextract_13_2": "rolled back"}, ds.recover_prepared())
+        cursor.execute.assert_called_with(
+            "SELECT txid_status(txid) FROM unnest(%s::bigint[]) WITH ORDINALITY AS t(txid, n) ORDER BY n",
+            ([12, 13, 14],))
+        ds.connection.tpc_commit.assert_called_once_with(committed)
+        ds.connection.tpc_rollback.assert_called_once_with(aborted)
+
+        ds.connection.tpc_recover.side_effect = Error("no connection")
+        with self.assertRaisesRegex(GOBException, "Error recovering prepared transactions. Error: no connection"):
+            ds.recover_prepared()
+
+    def test_copy_rows_prepared(self):
+        ds = PostgresDatastoreExt({})
+        cursor = MagicMock()
+        cursor.connection.get_backend_pid.return_value = 4321
+        cursor.fetchone.return_value = (1, 1)
+
+        self.assertEqual((1, 1, 0), ds._copy_rows(cursor, "bag_panden", [["a", "b"]], ["object_id", "hash"],
+                                                  prepared=True))
+        # A prepared transaction cannot use a temporary table
+        self.assertEqual(call("CREATE UNLOGGED TABLE bag_panden_staging_4321 AS SELECT object_id,hash "
+                              "FROM bag_panden WITH NO DATA"), cursor.execute.call_args_list[0])
+        cursor.execute.assert_called_with("DROP TABLE bag_panden_staging_4321")
+
+    @patch("gobcore.datastore.postgres.PostgresDatastore.connect")
+    def test_write_connections(self, mock_connect):
+        ds = PostgresDatastoreExt({})
+        ds.connection = connection = Mock()
+        shard_connections = [Mock(), Mock()]
+
+        def connect():
+            ds.connection = shard_connections[mock_connect.call_count - 1]
+        mock_connect.side_effect = connect
+
+        self.assertEqual([connection], ds._write_connections())
+        mock_connect.assert_not_called()
+
+        ds.WRITE_CONNECTIONS = 3
+        self.assertEqual([connection, *shard_connections], ds._write_connections())
+        self.assertEqual([connection, *shard_connections], ds._write_connections())
+        self.assertEqual(2, mock_connect.call_count)
+
+        with patch("gobcore.datastore.postgres.PostgresDatastore.disconnect") as mock_disconnect:
+            ds.disconnect()
+        for shard_connection in shard_connections:
+            shard_connection.close.assert_called_once()
+        self.assertEqual([], ds._shard_connections)
+        mock_disconnect.assert_called_once()
+
+
+class TestPostgresDatabase:
+    """Runs the queries of the datastore on the test database."""
+
+    COLUMNS = ["object_id", "gemeente", "last_update", "object", "hash"]
+
+    @pytest.fixture
+    def datastore(self, database: Session) -> Generator[PostgresDatastoreExt, None, None]:
+        config = DATABASE_CONFIG | {"type": TYPE_POSTGRES}
+        config.pop("drivername")
+        ds = PostgresDatastoreExt(config)
+        ds.NOTIFY_CHANNEL = ""
+        ds.connect()
+        ds.ensure_partition("bag_panden", "0457")
+        try:
+            yield ds
+        finally:
+            ds.disconnect()
+
+    @staticmethod
+    def _select(ds: PostgresDatastoreExt, query: str) -> list:
+        with ds.connection.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
+
+    def test_reload_table_keep_closed_compact(self, datastore: PostgresDatastoreExt):
+        ds = datastore
+        ds.COMPACT_OBJECTS = True
+        closed = {"oorspronkelijkBouwjaar": "1990", "voorkomen/Voorkomen/eindGeldigheid": "2020-01-01"}
+        ds.write_rows("bag_panden", [["pndA.1", "0457", datetime.date(2021, 1, 1), Json(closed), "h1"]], self.COLUMNS)
+        assert [(None,)] == self._select(ds, "SELECT object->>'oorspronkelijkBouwjaar' FROM bag_panden")
+
+        # The key is indexed and projected from now on, the closed voorkomen is kept by the reload
+        ds.ensure_attribute_indexes("bag_panden", [{"name": "bouwjaar", "key": "oorspronkelijkBouwjaar"}])
+        ds.ensure_projection("bag_panden", [{"name": "bouwjaar", "key": "oorspronkelijkBouwjaar", "type": "integer"}])
+        with ds.reload_table("bag_panden", "0457", keep_closed=True) as reload:
+            current = {"oorspronkelijkBouwjaar": "1991"}
+            ds.write_rows(reload, [["pndA.2", "0457", datetime.date(2021, 1, 1), Json(current), "h2"]], self.COLUMNS)
+
+        assert [("pndA.1", "h1"), ("pndA.2", "h2")] == self._select(
+            ds, "SELECT object_id, hash FROM bag_panden WHERE object->>'oorspronkelijkBouwjaar' IN ('1990', '1991') "
+                "ORDER BY object_id")
+        assert [("pndA.1", 1990), ("pndA.2", 1991)] == self._select(
+            ds, "SELECT object_id, bouwjaar FROM bag_panden_projection ORDER BY object_id")
+        assert [(closed,)] == self._select(ds, "SELECT object FROM bag_panden_expanded WHERE object_id = 'pndA.1'")
+
+    @staticmethod
+    def _prepared_transactions(ds: PostgresDatastoreExt):
+        if TestPostgresDatabase._select(ds, "SHOW max_prepared_transactions") == [("0",)]:
+            pytest.skip("The test database does not allow prepared transactions")
+
+    def test_write_rows_shards_after_closed_object_ids(self, datastore: PostgresDatastoreExt):
+        ds = datastore
+        self._prepared_transactions(ds)
+        ds.WRITE_CONNECTIONS = 3
+        closed = {"voorkomen/Voorkomen/eindGeldigheid": "2020-01-01"}
+        ds.write_rows("bag_panden", [["pndA.1", "0457", datetime.date(2021, 1, 1), Json(closed), "h1"]], self.COLUMNS)
+
+        # The closed voorkomens are read first, the sharded write starts its prepared transactions afterwards
+        assert {"pndA.1"} == ds.closed_object_ids("bag_panden", "0457")
+        rows = [[f"pnd{i}.1", "0457", datetime.date(2021, 1, 1), Json({}), f"h{i}"] for i in range(30)]
+        ds.write_rows("bag_panden", rows, self.COLUMNS)
+
+        assert {"inserted": 31, "updated": 0, "unchanged": 0} == ds.write_counts
+        assert [(31,)] == self._select(ds, "SELECT count(*) FROM bag_panden")
+        assert [] == self._select(ds, "SELECT gid FROM pg_prepared_xacts")
+        assert [] == self._select(ds, "SELECT tablename FROM pg_tables WHERE tablename LIKE 'bag_panden_staging%'")
+
+    def test_recover_prepared(self, datastore: PostgresDatastoreExt):
+        ds = datastore
+        self._prepared_transactions(ds)
+        ds.WRITE_CONNECTIONS = 2
+        shard = ds._write_connections()[1]
+
+        # An interrupted batch of which the coordinator has committed, and one of which it has not
+        for object_id, decide in [("pndA.1", ds.connection.commit), ("pndB.1", ds.connection.rollback)]:
+            txid = self._select(ds, "SELECT txid_current()")[0][0]
+            shard.tpc_begin(f"{ds.PREPARED_PREFIX}{txid}_1")
+            with shard.cursor() as cursor:
+                cursor.execute("INSERT INTO bag_panden (object_id, gemeente, last_update, object, hash) "
+                               "VALUES (%s, '0457', '2021-01-01', '{}', 'h')", (object_id,))
+            shard.tpc_prepare()
+            shard.reset()
+            decide()
+
+        outcomes = ds.recover_prepared()
+        assert ["committed", "rolled back"] == [outcome for _, outcome in sorted(outcomes.items())]
+        assert [("pndA.1",)] == self._select(ds, "SELECT object_id FROM bag_panden")
+        assert [] == self._select(ds, "SELECT gid FROM pg_prepared_xacts")
+
+    def test_refresh_current_since(self, datastore: PostgresDatastoreExt):
+        ds = datastore
+        eind = "voorkomen/Voorkomen/eindGeldigheid"
+        yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+        rows = [["pndA.1", "0457", datetime.date(2021, 1, 1), Json({eind: yesterday}), "h1"],
+                ["pndB.1", "0457", datetime.date(2021, 1, 1), Json({eind: "2000-01-01"}), "h2"]]
+        ds.write_rows("bag_panden", rows, self.COLUMNS)
+
+        # Both were current at the refresh of two days ago, pndA has ended since
+        with ds.connection.cursor() as cursor:
+            cursor.execute("INSERT INTO bag_panden_current SELECT split_part(object_id, '.', 1), object_id, gemeente, "
+                           "last_update, object, hash, bbox, centroid FROM bag_panden")
+            cursor.execute("INSERT INTO bag_current_refreshes VALUES ('bag_panden', '0457', CURRENT_DATE - 2)")
+        ds.connection.commit()
+
+        ds.current_tables.add("bag_panden")
+        ds.refresh_current("bag_panden", "0457")
+        assert [("pndB",)] == self._select(ds, "SELECT identificatie FROM bag_panden_current")
+        assert [(datetime.date.today(),)] == self._select(ds, "SELECT refreshed FROM bag_current_refreshes")
+
+    def test_reload_table_keep_last_update(self, datastore: PostgresDatastoreExt):
+        ds = datastore
+        rows = [["pndA.1", "0457", datetime.date(2021, 1, 1), Json({"a": 1}), "h1"],
+                ["pndB.1", "0457", datetime.date(2021, 1, 1), Json({"b": 1}), "h2"]]
+        ds.write_rows("bag_panden", rows, self.COLUMNS)
+
+        # The last_update is the date of the import that has last changed the object
+        with ds.reload_table("bag_panden", "0457") as reload:
+            rows = [["pndA.1", "0457", datetime.date(2022, 1, 1), Json({"a": 1}), "h1"],
+                    ["pndB.1", "0457", datetime.date(2022, 1, 1), Json({"b": 2}), "h3"]]
+            ds.write_rows(reload, rows, self.COLUMNS)
+
+        assert [("pndA.1", datetime.date(2021, 1, 1)), ("pndB.1", datetime.date(2022, 1, 1))] == self._select(
+            ds, "SELECT object_id, last_update FROM bag_panden ORDER BY object_id")
@@ -0,0 +1,109 @@
+import datetime
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from gobcore.exceptions import GOBException
+
+from gobbagextract.datastore.predicate import Predicate, changed_condition, get_predicate, is_current
+
+OBJECT = """
+<Objecten:Pand xmlns:Objecten="www.kadaster.nl/schemas/lvbag/imbag/objecten/v20200601"
+               xmlns:Historie="www.kadaster.nl/schemas/lvbag/imbag/historie/v20200601">
+  <Objecten:identificatie>0457100000000002</Objecten:identificatie>
+  <Objecten:status>Pand in gebruik</Objecten:status>
+  <Objecten:voorkomen>
+    <Historie:Voorkomen>
+      <Historie:voorkomenidentificatie>2</Historie:voorkomenidentificatie>
+      <Historie:beginGeldigheid>2015-01-01</Historie:beginGeldigheid>
+      {eind}
+    </Historie:Voorkomen>
+  </Objecten:voorkomen>
+</Objecten:Pand>
+"""
+
+EIND_GELDIGHEID = "<Historie:eindGeldigheid>2020-01-01</Historie:eindGeldigheid>"
+EIND_REGISTRATIE = "<Historie:eindRegistratie>2016-01-01T10:00:00.000</Historie:eindRegistratie>"
+TODAY = datetime.date(2021, 10, 15)
+
+
+def element(eind: str = "") -> ElementTree.Element:
+    return ElementTree.fromstring(OBJECT.format(eind=eind))
+
+
+def matches(query: dict, elm: ElementTree.Element, identificatie: str = "0457100000000002") -> bool:
+    return Predicate(query, TODAY)(elm, identificatie)
+
+
+class TestPredicate(TestCase):
+
+    def test_get_predicate(self):
+        self.assertIsNone(get_predicate(""))
+        self.assertIsNone(get_predicate(None))
+        self.assertIsInstance(get_predicate({"current": True}), Predicate)
+
+    def test_identificatie(self):
+        elm = element()
+        self.assertTrue(matches({"identificatie": ["0457100000000001", "0457100000000002"]}, elm))
+        self.assertFalse(matches({"identificatie": ["0457100000000001"]}, elm))
+
+        self.assertTrue(matches({"identificatie": {"from": "0457100000000002", "to": "0457100000000003"}}, elm))
+        self.assertTrue(matches({"identificatie": {"to": "0457100000000002"}}, elm))
+        self.assertFalse(matches({"identificatie": {"from": "0457100000000003"}}, elm))
+        self.assertFalse(matches({"identificatie": {"from": "0457100000000001"}}, elm, identificatie=None))
+
+    def test_status(self):
+        elm = element()
+        self.assertTrue(matches({"status": "Pand in gebruik"}, elm))
+        self.assertTrue(matches({"status": ["Pand gesloopt", "Pand in gebruik"]}, elm))
+        self.assertFalse(matches({"status": "Pand gesloopt"}, elm))
+
+    def test_current(self):
+        self.assertTrue(matches({"current": True}, element()))
+        self.assertFalse(matches({"current": True}, element(EIND_GELDIGHEID)))
+        self.assertFalse(matches({"current": True}, element(EIND_REGISTRATIE)))
+        # Ends after today
+        self.assertTrue(Predicate({"current": True}, datetime.date(2019, 12, 31))(element(EIND_GELDIGHEID), None))
+        # Begins after today
+        self.assertFalse(Predicate({"current": True}, datetime.date(2014, 12, 31))(element(), None))
+        # current false does not filter
+        self.assertTrue(matches({"current": False}, element(EIND_GELDIGHEID)))
+
+    def test_is_current(self):
+        self.assertTrue(is_current("2015-01-01", None, None, "2021-10-15"))
+        self.assertTrue(is_current(None, None, None, "2021-10-15"))
+        self.assertTrue(is_current("2021-10-15T10:00:00", "2021-10-16", None, "2021-10-15"))
+        self.assertFalse(is_current("2021-10-16", None, None, "2021-10-15"))
+        self.assertFalse(is_current("2015-01-01", "2021-10-15", None, "2021-10-15"))
+        self.assertFalse(is_current("2015-01-01", None, "2016-01-01T10:00:00.000", "2021-10-15"))
+
+    def test_changed_condition(self):
+        self.assertEqual(
+            "(left(o->>'voorkomen/Voorkomen/beginGeldigheid', 10) > %(since)s "
+            "AND left(o->>'voorkomen/Voorkomen/beginGeldigheid', 10) <= CURRENT_DATE) "
+            "OR (o->>'voorkomen/Voorkomen/eindGeldigheid' > %(since)s "
+            "AND o->>'voorkomen/Voorkomen/eindGeldigheid' <= CURRENT_DATE)",
+            changed_condition("o", "%(since)s", "CURRENT_DATE"))
+
+    def test_geldig(self):
+        # Valid from 2015-01-01 until 2020-01-01
+        elm = element(EIND_GELDIGHEID)
+        self.assertTrue(matches({"geldig": {"from": "2019-01-01", "to": "2021-01-01"}}, elm))
+        self.assertTrue(matches({"geldig": {"from": "2014-01-01", "to": "2015-01-02"}}, elm))
+        self.assertFalse(matches({"geldig": {"from": "2014-01-01", "to": "2015-01-01"}}, elm))
+        self.assertFalse(matches({"geldig": {"from": "2020-01-01"}}, elm))
+        self.assertTrue(matches({"geldig": {"from": "2019-12-31"}}, elm))
+
+        # Still valid
+        self.assertTrue(matches({"geldig": {"from": "2030-01-01"}}, element()))
+        self.assertFalse(matches({"geldig": {"to": "2010-01-01"}}, element()))
+
+    def test_combined(self):
+        elm = element(EIND_GELDIGHEID)
+        self.assertTrue(matches({"status": "Pand in gebruik", "geldig": {"from": "2016-01-01"}}, elm))
+        self.assertFalse(matches({"status": "Pand in gebruik", "current": True}, elm))
+
+    def test_invalid(self):
+        for query in ("status", {"name": "x"}, {"geldig": "2020-01-01"}, {"geldig": {}},
+                      {"geldig": {"from": "01-01-2020"}}, {"identificatie": {"start": "1"}}):
+            with self.subTest(query), self.assertRaises(GOBException):
+                Predicate(query)
@@ -0,0 +1,18 @@
+from unittest import TestCase
+
+from gobbagextract.datastore.serializer import dumps, dumps_bytes, dumps_sorted_bytes
+
+
+class TestSerializer(TestCase):
+
+    def test_dumps_bytes(self):
+        value = {"naam": "Weesp ë", "nummer": 1, "lijst": [None, True]}
+        expected = '{"naam":"Weesp ë","nummer":1,"lijst":[null,true]}'.encode("utf-8")
+        self.assertEqual(expected, dumps_bytes(value))
+
+    def test_dumps(self):
+        self.assertEqual('{"a":"b\\nc ë"}', dumps({"a": "b\nc ë"}))
+
+    def test_dumps_sorted_bytes(self):
+        value = {"b": {"d": 1, "c": 2}, "a": ["y", "x"]}
+        self.assertEqual(b'{"a":["y","x"],"b":{"c":2,"d":1}}', dumps_sorted_bytes(value))
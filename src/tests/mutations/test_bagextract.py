@@ -139,6 +139,7 @@ class TestBagExtractSoapInterface:
         assert mut_import.filename == dataset["source"]["read_config"]["download_location"].Bestandsnaam
         handler.get_full.assert_called_with(datetime.date(2021, 11, 14), "0457")
 
+    @freeze_time(datetime.date(2021, 11, 14))
     def test_handle_import_next_mutation(self, mock_response_mutaties, mock_config):
         handler = BagExtractMutationsHandler()
         handler.get_full = MagicMock()
@@ -154,6 +155,7 @@ class TestBagExtractSoapInterface:
         assert mut_import.mode == ImportMode.MUTATIONS.value
         assert date == datetime.date(2021, 11, 14)
 
+    @freeze_time(datetime.date(2021, 10, 15))
     def test_handle_import_next_full(self, mock_response_full, mock_config):
         handler = BagExtractMutationsHandler()
         last_import = MutationImport(
@@ -167,6 +169,96 @@ class TestBagExtractSoapInterface:
         assert mut_import.mode == ImportMode.FULL.value
         assert date == datetime.date(2021, 10, 15)
 
+    @patch("gobbagextract.mutations.bagextract.logger")
+    def test_start_next_full_not_available(self, mock_logger):
+        handler = BagExtractMutationsHandler()
+        handler.get_full = MagicMock(side_effect=NothingToDo)
+        mutations = Afgifte(Bestandsnaam="BAGNLDM-14102021-15102021.zip")
+        handler.get_daily_mutations = MagicMock(return_value=(ImportMode.MUTATIONS, mutations))
+        last_import = MutationImport(mode=ImportMode.MUTATIONS.value, filename="BAGNLDM-13102021-14102021.zip")
+
+        # The mutations of the 15th are imported instead
+        result = handler.start_next(last_import, "0457")
+
+        assert result == (ImportMode.MUTATIONS, mutations, datetime.date(2021, 10, 15))
+        handler.get_full.assert_called_with(datetime.date(2021, 10, 15), "0457")
+        handler.get_daily_mutations.assert_called_with(datetime.date(2021, 10, 15))
+        mock_logger.warning.assert_called_once()
+
+    def test_last_full(self):
+        handler = BagExtractMutationsHandler()
+        full = Afgifte(Bestandsnaam="BAGGEM0457L-15092021.zip")
+        handler.get_full = MagicMock(side_effect=[NothingToDo, (ImportMode.FULL, full)])
+
+        # The mutations are applied to the previous full import until the full import of the period is available
+        assert handler._last_full(datetime.date(2021, 10, 16), "0457") == full
+        handler.get_full.assert_has_calls([call(datetime.date(2021, 10, 16), "0457"),
+                                           call(datetime.date(2021, 10, 14), "0457")])
+
+    def test_import_cost(self):
+        handler = BagExtractMutationsHandler()
+        handler.DAILY_IMPORT_COST = 1
+        handler.FULL_IMPORT_COST = 10
+
+        assert handler._import_cost(datetime.date(2021, 10, 16), datetime.date(2021, 10, 16)) == 1
+        assert handler._import_cost(datetime.date(2021, 10, 14), datetime.date(2021, 10, 16)) == 12
+        assert handler._import_cost(datetime.date(2021, 10, 14), datetime.date(2021, 11, 16)) == 52
+
+    @freeze_time(datetime.date(2021, 11, 20))
+    @patch("gobbagextract.mutations.bagextract.logger")
+    def test_skip_ahead(self, mock_logger):
+        handler = BagExtractMutationsHandler()
+        handler.DAILY_IMPORT_COST = 1
+        handler.FULL_IMPORT_COST = 10
+        handler.SKIP_AHEAD_MIN_SAVING = 7
+        full_afgifte = Afgifte(Bestandsnaam="BAGGEM0457L-15112021.zip")
+        handler.get_full = MagicMock(return_value=(ImportMode.FULL, full_afgifte))
+
+        # No newer full import than the next date
+        assert handler.skip_ahead(datetime.date(2021, 11, 15), "0457") is None
+        handler.get_full.assert_not_called()
+
+        # Saving too small
+        assert handler.skip_ahead(datetime.date(2021, 11, 10), "0457") is None
+        handler.get_full.assert_not_called()
+        mock_logger.info.assert_called_with("Replay the backlog from 2021-11-10 (cost 20)")
+
+        # Skip ahead to the full import of the 15th
+        result = handler.skip_ahead(datetime.date(2021, 11, 8), "0457")
+        assert result == (ImportMode.FULL, full_afgifte, datetime.date(2021, 11, 15))
+        handler.get_full.assert_called_with(datetime.date(2021, 11, 15), "0457")
+        mock_logger.info.assert_called_with(
+            "Skip ahead to full import of 2021-11-15 (cost 15) "
+            "instead of replaying the backlog from 2021-11-08 (cost 22)"
+        )
+
+        # Newest full not available, fall back on the one before
+        handler.get_full.side_effect = [NothingToDo("not available"), (ImportMode.FULL, full_afgifte)]
+        result = handler.skip_ahead(datetime.date(2021, 9, 20), "0457")
+        assert result == (ImportMode.FULL, full_afgifte, datetime.date(2021, 10, 15))
+
+        # No full available at all, replay the backlog
+        handler.get_full.side_effect = NothingToDo("not available")
+        assert handler.skip_ahead(datetime.date(2021, 10, 20), "0457") is None
+
+    @freeze_time(datetime.date(2021, 11, 20))
+    @patch("gobbagextract.mutations.bagextract.logger", MagicMock())
+    def test_handle_import_skip_ahead(self, mock_response_full, mock_config):
+        handler = BagExtractMutationsHandler()
+        handler.get_daily_mutations = MagicMock()
+
+        last_import = MutationImport(
+            mode=ImportMode.MUTATIONS.value,
+            filename="BAGNLDM-30092021-01102021.zip",
+            ended_at=datetime.datetime(2021, 10, 1, 12, 00)
+        )
+        mut_import, dataset, date = handler.handle_import(last_import, mock_config)
+
+        assert mut_import.filename == "BAGGEM0457L-15102021.zip"
+        assert mut_import.mode == ImportMode.FULL.value
+        assert date == datetime.date(2021, 10, 15)
+        handler.get_daily_mutations.assert_not_called()
+
     def test_have_next(self, mock_config):
         handler = BagExtractMutationsHandler()
 
@@ -49,3 +49,25 @@ class TestMutationsHandler(TestCase):
         last_import = MutationImport()
         self.assertEqual(handler.handler.have_next.return_value, handler.have_next(last_import))
         handler.handler.have_next.assert_called_with(last_import, handler.dataset)
+
+    def test_get_import_after(self):
+        dataset = {
+            "source": {
+                "application": "BAGExtract",
+            }
+        }
+        handler = MutationsHandler(dataset)
+        handler.handler = MagicMock()
+
+        mutation_import = MutationImport(filename="BAGNLDM-13112021-14112021.zip", mode="mutations")
+        other_dataset = {"source": {}}
+        self.assertEqual(
+            handler.handler.handle_import.return_value, handler.get_import_after(mutation_import, other_dataset)
+        )
+
+        ended_import, used_dataset = handler.handler.handle_import.call_args.args
+        self.assertEqual(other_dataset, used_dataset)
+        self.assertEqual("BAGNLDM-13112021-14112021.zip", ended_import.filename)
+        self.assertEqual("mutations", ended_import.mode)
+        self.assertTrue(ended_import.is_ended())
+        self.assertFalse(mutation_import.is_ended())
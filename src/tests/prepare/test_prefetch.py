@@ -0,0 +1,192 @@
+import threading
+from concurrent.futures import Future
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from gobcore.enum import ImportMode
+
+from gobbagextract.database.model import MutationImport
+from gobbagextract.datastore.bag_extract import ConnectCancelled
+from gobbagextract.mutations.afgifte import Afgifte
+from gobbagextract.mutations.exception import NothingToDo
+from gobbagextract.prepare.prefetch import Prefetcher
+
+
+def _done_future(result=None, exception=None) -> Future:
+    future = Future()
+    if exception:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+class TestPrefetcher(TestCase):
+
+    def setUp(self) -> None:
+        self.mutations_handler = MagicMock()
+        self.mutations_handler.dataset = {"source": {"read_config": {}}}
+        self.prefetcher = Prefetcher(self.mutations_handler, max_size=100)
+
+        self.next_import = MutationImport(mode=ImportMode.MUTATIONS.value, filename="BAGNLDM-13112021-14112021.zip")
+        self.next_dataset = {
+            "source": {
+                "read_config": {
+                    "download_location": Afgifte(Bestandsnaam=self.next_import.filename),
+                    "last_full_download_location": Afgifte(Bestandsnaam="BAGGEM0457L-15102021.zip"),
+                }
+            }
+        }
+        self.mutations_handler.get_import_after.return_value = (self.next_import, self.next_dataset, "date")
+
+    def tearDown(self) -> None:
+        self.prefetcher.shutdown()
+
+    @patch("gobbagextract.prepare.prefetch.PrepareClient")
+    def test_prefetch(self, mock_client):
+        mutation_import = MutationImport(filename="BAGNLDM-12112021-13112021.zip")
+        data_src = mock_client.create_data_src.return_value
+        cancelled = threading.Event()
+
+        self.assertEqual((self.next_import.filename, data_src),
+                         self.prefetcher._prefetch(mutation_import, {}, cancelled))
+        self.mutations_handler.get_import_after.assert_called_with(mutation_import, {})
+        mock_client.create_data_src.assert_called_with(self.next_dataset, ImportMode.MUTATIONS, "date")
+        data_src.connect.assert_called_once()
+        self.assertIs(cancelled, data_src.cancelled)
+
+        # Failing or cancelled connect cleans up
+        data_src.connect.side_effect = ConnectCancelled
+        with self.assertRaises(ConnectCancelled):
+            self.prefetcher._prefetch(mutation_import, {}, cancelled)
+        data_src.disconnect.assert_called_once()
+
+    @patch("gobbagextract.prepare.prefetch.PrepareClient")
+    def test_prefetch_skipped(self, mock_client):
+        cancelled = threading.Event()
+
+        # Files too large, the last full file of a mutations import is extracted as well
+        self.next_dataset["source"]["read_config"]["last_full_download_location"] = \
+            Afgifte(Bestandsnaam="BAGGEM0457L-15102021.zip", Bestandsgrootte="10")
+        self.assertIsNone(self.prefetcher._prefetch(MutationImport(), {}, cancelled))
+
+        # Cancelled before the download
+        self.next_dataset["source"]["read_config"]["last_full_download_location"] = \
+            Afgifte(Bestandsnaam="BAGGEM0457L-15102021.zip", Bestandsgrootte="9")
+        cancelled.set()
+        self.assertIsNone(self.prefetcher._prefetch(MutationImport(), {}, cancelled))
+
+        # No next import
+        self.mutations_handler.get_import_after.side_effect = NothingToDo
+        self.assertIsNone(self.prefetcher._prefetch(MutationImport(), {}, threading.Event()))
+
+        mock_client.create_data_src.assert_not_called()
+
+    def test_scratch_size(self):
+        read_config = {
+            "download_location": Afgifte(Bestandsgrootte="3"),
+            "last_full_download_location": Afgifte(Bestandsgrootte="5"),
+        }
+        self.assertEqual(33, self.prefetcher.scratch_size(read_config, ImportMode.FULL))
+        self.assertEqual(88, self.prefetcher.scratch_size(read_config, ImportMode.MUTATIONS))
+
+        read_config["download_location"] = Afgifte()
+        self.assertEqual(55, self.prefetcher.scratch_size(read_config, ImportMode.MUTATIONS))
+
+    def test_start(self):
+        self.prefetcher._prefetch = MagicMock()
+        mutation_import = MutationImport()
+
+        self.prefetcher.start(mutation_import)
+        self.prefetcher._future.result()
+
+        dataset, cancelled = self.prefetcher._prefetch.call_args.args[1:]
+        self.assertIs(self.prefetcher._cancelled, cancelled)
+        self.assertFalse(cancelled.is_set())
+        self.assertEqual(self.mutations_handler.dataset, dataset)
+        self.assertIsNot(self.mutations_handler.dataset, dataset)
+
+        # Disabled
+        self.prefetcher._prefetch.reset_mock()
+        self.prefetcher.max_size = 0
+        self.prefetcher.start(mutation_import)
+        self.assertIsNone(self.prefetcher._future)
+        self.prefetcher._prefetch.assert_not_called()
+
+    @patch("gobbagextract.prepare.prefetch.logger")
+    def test_get(self, mock_logger):
+        mutation_import = MutationImport(filename="BAGNLDM-13112021-14112021.zip")
+        data_src = MagicMock()
+
+        # Nothing prefetched
+        self.assertIsNone(self.prefetcher.get(mutation_import))
+
+        self.prefetcher._future = _done_future(None)
+        self.assertIsNone(self.prefetcher.get(mutation_import))
+
+        # Prefetch failed
+        self.prefetcher._future = _done_future(exception=IOError("no connection"))
+        self.assertIsNone(self.prefetcher.get(mutation_import))
+        mock_logger.warning.assert_called_with("Prefetch of the next file failed: no connection")
+
+        # Other file prefetched
+        self.prefetcher._future = _done_future(("BAGGEM0457L-15112021.zip", data_src))
+        self.assertIsNone(self.prefetcher.get(mutation_import))
+        data_src.disconnect.assert_called_once()
+
+        # Matching file prefetched
+        data_src.reset_mock()
+        self.prefetcher._future = _done_future((mutation_import.filename, data_src))
+        self.assertEqual(data_src, self.prefetcher.get(mutation_import))
+        data_src.disconnect.assert_not_called()
+        self.assertIsNone(self.prefetcher._future)
+
+    def test_cancel(self):
+        # Pending prefetch is cancelled
+        future = Future()
+        self.prefetcher._future = future
+        cancelled = self.prefetcher._cancelled
+        self.prefetcher.cancel()
+        self.assertTrue(future.cancelled())
+        self.assertTrue(cancelled.is_set())
+        self.assertIsNone(self.prefetcher._future)
+
+        # Running prefetch is cleaned up when done
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.prefetcher._future = future
+        self.prefetcher.cancel()
+
+        data_src = MagicMock()
+        future.set_result(("filename", data_src))
+        data_src.disconnect.assert_called_once()
+
+        # Failed or empty prefetch needs no cleanup
+        Prefetcher._discard(_done_future(None))
+        Prefetcher._discard(_done_future(exception=IOError()))
+
+    @patch("gobbagextract.prepare.prefetch.PrepareClient")
+    def test_shutdown(self, mock_client):
+        # A running prefetch stops after its current step, and has removed its files when shutdown returns
+        downloading, stopped = threading.Event(), threading.Event()
+        data_src = mock_client.create_data_src.return_value
+
+        def connect():
+            downloading.set()
+            stopped.wait(1)
+            if data_src.cancelled.is_set():
+                raise ConnectCancelled
+
+        data_src.connect.side_effect = connect
+        self.prefetcher.start(MutationImport())
+        downloading.wait(1)
+
+        threading.Timer(0.05, stopped.set).start()
+        self.prefetcher.shutdown()
+        data_src.disconnect.assert_called_once()
+
+    def test_context_manager(self):
+        self.prefetcher.cancel = MagicMock()
+        with self.prefetcher as prefetcher:
+            self.assertEqual(self.prefetcher, prefetcher)
+        self.prefetcher.cancel.assert_called_once()
@@ -37,14 +37,36 @@ class TestPrepareClient(TestCase):
         ds_config = DATABASE_CONFIG | {"type": TYPE_POSTGRES}
         ds_config.pop("drivername")
         mock_postgres_ds.assert_called_with(ds_config)
+        mock_postgres_ds.return_value.current_tables.add.assert_called_with("bag_ENT")
 
-    @patch("gobbagextract.prepare.prepare_client.DatastoreToPostgresSelector")
-    def test_import_data(self, mock_ds_to_postgres_selector):
+    @patch("gobbagextract.prepare.prepare_client.PostgresDatastoreExt")
+    @patch("gobbagextract.prepare.prepare_client.BagExtractDatastore")
+    def test_init_data_src(self, mock_bagextractdatastore, mock_postgres_ds):
+        dataset = {
+            "catalogue": "bag",
+            "entity": "ENT",
+            "source": {"read_config": {}}
+        }
+        data_src = Mock()
+        client = PrepareClient({}, dataset, ImportMode.FULL, datetime.date.today(), data_src=data_src)
+        self.assertEqual(data_src, client._data_src)
+        mock_bagextractdatastore.assert_not_called()
+
+    @patch("gobbagextract.prepare.prepare_client.BagExtractDatastore")
+    def test_create_data_src(self, mock_bagextractdatastore):
+        dataset = {"source": {"read_config": {"xml_object": "Pand"}}}
+        last_date = datetime.date.today()
+
+        result = PrepareClient.create_data_src(dataset, ImportMode.MUTATIONS, last_date)
+        self.assertEqual(mock_bagextractdatastore.return_value, result)
+        read_config = {"xml_object": "Pand", "mode": ImportMode.MUTATIONS}
+        mock_bagextractdatastore.assert_called_with({}, read_config, last_date)
+
+    def test_import_data(self):
         client = Mock()
         nr_rows = 10
-        selector = Mock()
-        selector.select = Mock(return_value=nr_rows)
-        mock_ds_to_postgres_selector.return_value = selector
+        client._select.return_value = nr_rows
+        data_dst = client._data_dst
 
         PrepareClient.import_dataset(client)
 
@@ -52,12 +74,179 @@ class TestPrepareClient(TestCase):
             [
                 call._data_src.connect(),
                 call._data_dst.connect(),
-                call.get_result_msg(nr_rows),
+                call._recover_prepared(),
+                call._ensure_partition(),
+                call._ensure_attribute_indexes(),
+                call._ensure_projection(),
+                call._start_change_log(),
+                call._select(client._config),
+                call._refresh_current(),
+                call.get_result_msg(nr_rows, data_dst.write_counts, client._batch_sizes),
                 call._data_src.disconnect(),
                 call._data_dst.disconnect()
             ]
         )
-        selector.select.assert_called_once()
+        client._select.assert_called_once_with(client._config)
+
+    @patch("gobbagextract.prepare.prepare_client.DatastoreToPostgresSelector")
+    def test_select(self, mock_ds_to_postgres_selector):
+        client = Mock()
+        selector = mock_ds_to_postgres_selector.return_value
+        selector.select.return_value = 10
+        selector.batch_sizes.return_value = {"min": 50_000, "max": 100_000, "last": 100_000}
+
+        self.assertEqual(10, PrepareClient._select(client, {"config": "any"}))
+        mock_ds_to_postgres_selector.assert_called_with(client._data_src, client._data_dst, {"config": "any"})
+        self.assertEqual({"min": 50_000, "max": 100_000, "last": 100_000}, client._batch_sizes)
+
+    def test_import_data_full_reload(self):
+        client = Mock()
+        client._mode = ImportMode.FULL
+        client.FULL_RELOAD = True
+        client._config = {"query": ""}
+        data_dst = client._data_dst
+
+        PrepareClient.import_dataset(client)
+
+        client._reload_dataset.assert_called_once()
+        client.get_result_msg.assert_called_with(client._reload_dataset.return_value, data_dst.write_counts,
+                                                 client._batch_sizes)
+        client._select.assert_not_called()
+        client._refresh_current.assert_not_called()
+        client._skip_closed.assert_called_once()
+
+        client = Mock()
+        client._mode = ImportMode.FULL
+        client.SKIP_CLOSED = False
+        client._config = {"query": ""}
+        PrepareClient.import_dataset(client)
+        client._skip_closed.assert_not_called()
+
+        # Objects that do not match the query are not imported, and must not be removed by a reload
+        client = Mock()
+        client._mode = ImportMode.FULL
+        client.FULL_RELOAD = True
+        client._config = {"query": {"status": "Pand in gebruik"}}
+        PrepareClient.import_dataset(client)
+        client._reload_dataset.assert_not_called()
+        client._select.assert_called_with(client._config)
+
+    def test_refresh_current(self):
+        client = Mock()
+        client._config = {"destination_table": {"name": "bag_panden"}, "gemeente": "0457"}
+
+        PrepareClient._refresh_current(client)
+
+        client._data_dst.refresh_current.assert_called_with("bag_panden", "0457")
+
+    @patch("gobbagextract.prepare.prepare_client.logger", Mock())
+    def test_skip_closed(self):
+        client = Mock()
+        client._config = {"destination_table": {"name": "bag_panden"}, "gemeente": "0457"}
+        client._data_dst.closed_object_ids.return_value = {"pndA.1", "pndA.2"}
+
+        PrepareClient._skip_closed(client)
+
+        client._data_dst.closed_object_ids.assert_called_with("bag_panden", "0457")
+        self.assertEqual({"pndA.1", "pndA.2"}, client._data_src.closed_ids)
+
+    @patch("gobbagextract.prepare.prepare_client.logger")
+    def test_recover_prepared(self, mock_logger):
+        client = Mock()
+        client._data_dst.recover_prepared.return_value = {"bagextract_12_1": "committed"}
+
+        PrepareClient._recover_prepared(client)
+
+        mock_logger.warning.assert_called_once_with(
+            "Prepared transaction bagextract_12_1 of an interrupted batch has been committed")
+
+    @patch("gobbagextract.prepare.prepare_client.logger")
+    def test_ensure_attribute_indexes(self, mock_logger):
+        client = Mock()
+        client._config = {"destination_table": {"name": "bag_panden"}}
+        client.dataset = {"attribute_indexes": [{"name": "status", "key": "status"}]}
+        client._data_dst.ensure_attribute_indexes.return_value = ["ix_bag_panden_attr_status"]
+
+        PrepareClient._ensure_attribute_indexes(client)
+
+        client._data_dst.ensure_attribute_indexes.assert_called_with(
+            "bag_panden", [{"name": "status", "key": "status"}])
+        mock_logger.info.assert_called_with("Created indexes ix_bag_panden_attr_status")
+
+        # Without declared indexes, existing attribute indexes are dropped
+        mock_logger.reset_mock()
+        client.dataset = {}
+        client._data_dst.ensure_attribute_indexes.return_value = []
+        PrepareClient._ensure_attribute_indexes(client)
+        client._data_dst.ensure_attribute_indexes.assert_called_with("bag_panden", [])
+        mock_logger.info.assert_not_called()
+
+    @patch("gobbagextract.prepare.prepare_client.logger")
+    def test_ensure_partition(self, mock_logger):
+        client = Mock()
+        client._config = {"destination_table": {"name": "bag_panden"}, "gemeente": "0457"}
+        client._data_dst.ensure_partition.return_value = True
+
+        PrepareClient._ensure_partition(client)
+        client._data_dst.ensure_partition.assert_called_with("bag_panden", "0457")
+        mock_logger.info.assert_called_with("Created partition of bag_panden for gemeente 0457")
+
+        mock_logger.reset_mock()
+        client._data_dst.ensure_partition.return_value = False
+        PrepareClient._ensure_partition(client)
+        mock_logger.info.assert_not_called()
+
+    @patch("gobbagextract.prepare.prepare_client.logger")
+    def test_ensure_projection(self, mock_logger):
+        client = Mock()
+        client._config = {"destination_table": {"name": "bag_panden"}}
+        client.dataset = {"projection": [{"name": "status", "key": "status", "type": "string"}]}
+        client._data_dst.ensure_projection.return_value = True
+
+        PrepareClient._ensure_projection(client)
+
+        client._data_dst.ensure_projection.assert_called_with(
+            "bag_panden", [{"name": "status", "key": "status", "type": "string"}])
+        mock_logger.info.assert_called_with("Created projection of bag_panden")
+
+        mock_logger.reset_mock()
+        client.dataset = {}
+        client._data_dst.ensure_projection.return_value = False
+        PrepareClient._ensure_projection(client)
+        client._data_dst.ensure_projection.assert_called_with("bag_panden", [])
+        mock_logger.info.assert_not_called()
+
+    def test_start_change_log(self):
+        client = Mock()
+        client._mutation_import_id = 42
+        client.CHANGE_LOG_RETENTION_DAYS = 30
+
+        PrepareClient._start_change_log(client)
+        client._data_dst.start_change_log.assert_called_with(42, 30)
+
+        client = Mock()
+        client._mutation_import_id = None
+        PrepareClient._start_change_log(client)
+        client._data_dst.start_change_log.assert_not_called()
+
+    def test_reload_dataset(self):
+        client = Mock()
+        client._config = {
+            "destination_table": {"name": "bag_panden", "columns": []},
+            "gemeente": "0457",
+        }
+        client._data_dst.reload_table.return_value.__enter__ = Mock(return_value="bag_panden_reload")
+        client._data_dst.reload_table.return_value.__exit__ = Mock(return_value=None)
+
+        result = PrepareClient._reload_dataset(client)
+
+        client._data_dst.reload_table.assert_called_with("bag_panden", "0457", keep_closed=True)
+        client._select.assert_called_with({
+            "destination_table": {"name": "bag_panden_reload", "columns": []},
+            "gemeente": "0457",
+        })
+        self.assertEqual(client._select.return_value, result)
+        client._data_dst.reload_table.return_value.__exit__.assert_called_once()
 
     @patch("gobbagextract.prepare.prepare_client.logger")
     def test_get_result_message(self, mock_logger):
@@ -70,3 +259,11 @@ class TestPrepareClient(TestCase):
         mock_logger.info.assert_called_once()
         mock_logger.get_summary.assert_called_once()
         self.assertEqual(set(ret.keys()), {"header", "summary"})
+
+        counts = {"inserted": 5, "updated": 10, "unchanged": 5}
+        ret = PrepareClient.get_result_msg(client, nr_rows, counts)
+        self.assertEqual({"num_records": 20, **counts, "summary": "a summary"}, ret["summary"])
+
+        batch_sizes = {"min": 50_000, "max": 100_000, "last": 100_000}
+        ret = PrepareClient.get_result_msg(client, nr_rows, counts, batch_sizes)
+        self.assertEqual(batch_sizes, ret["summary"]["batch_sizes"])
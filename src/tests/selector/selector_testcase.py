@@ -15,7 +15,7 @@ class SelectorTestCase(TestCase):
         # Assert have "ToSelector" (methods needed by Selector)
         self.assertHasMethod(selector, "_write_rows")
         self.assertHasMethod(selector, "_create_destination_table")
-        self.assertHasMethod(selector, "_prepare_row")
+        self.assertHasMethod(selector, "_row_adapter")
 
         # Assert have "FromSelector" (methods needed by Selector)
         self.assertHasMethod(selector, "_read_rows")
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from gobbagextract.selector._batch_sizer import BatchSizer, estimate_size
+
+
+class TestBatchSizer(TestCase):
+
+    def test_batch_sizer(self):
+        sizer = BatchSizer(100, 10, 1000, 50, 1.0, 3.0)
+
+        # Ends at the byte budget
+        chunk, nbytes = sizer.take(iter([["abcdefghij"]] * 10))
+        self.assertEqual(5, len(chunk))
+        self.assertEqual(50, nbytes)
+
+        # Within the band, unchanged
+        sizer.observe(100, 2.5)
+        self.assertEqual(100, sizer.size)
+
+        # Slower, shrinks towards 2s per batch
+        sizer.observe(100, 2 * 3.2)
+        self.assertEqual(50, sizer.size)
+        sizer.observe(50, 2.5 * 1.1)
+        self.assertEqual(50, sizer.size)
+        sizer.observe(50, 100)
+        self.assertEqual(25, sizer.size)
+
+        # Faster, grows at most by a factor 2
+        sizer.observe(25, 0.5)
+        self.assertEqual(50, sizer.size)
+        sizer.observe(50, 0)
+        self.assertEqual(100, sizer.size)
+
+        # Between the bounds
+        sizer.observe(1000, 0.1)
+        self.assertEqual(1000, sizer.size)
+        sizer.observe(10, 100)
+        self.assertEqual(10, sizer.size)
+
+        # Fixed size, no byte budget
+        sizer = BatchSizer(3, adaptive=False)
+        self.assertEqual(3, len(sizer.take(iter([["abcdefghij"]] * 10))[0]))
+        sizer.observe(3, 100)
+        self.assertEqual(3, sizer.size)
+
+    def test_estimate_size(self):
+        self.assertEqual(3 + 8 + 6 + 8, estimate_size(["abc", 12, {"key": "ab", "k": None}]))
@@ -1,8 +1,10 @@
+import queue
+import threading
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from gobcore.exceptions import GOBException
-from gobbagextract.selector._selector import Selector
+from gobbagextract.selector._selector import Selector, ChunkStats
 
 
 class TestSelector(TestCase):
@@ -26,6 +28,8 @@ class TestSelector(TestCase):
             },
         }
         self.selector = Selector("src_store", "dst_store", self.config)
+        # Fixed batch sizes, see test_select_adaptive
+        self.selector.ADAPTIVE_BATCH_SIZE = False
 
     def test_init(self):
         self.assertEqual("src_store", self.selector._src_datastore)
@@ -54,7 +58,9 @@ class TestSelector(TestCase):
 
         self.assertEqual(result_cnt, result)
         self.assertEqual(5, self.selector._write_rows.call_count)
+        self.selector._read_rows.assert_called_once()
         mock_logger.info.assert_called_once()
+        self.assertEqual([24, 24, 24, 24, 1], [stats.rows for stats in self.selector.chunk_stats])
 
     @patch("gobbagextract.selector._selector.logger")
     def test_select_match_batch_size(self, mock_logger):
@@ -62,7 +68,7 @@ class TestSelector(TestCase):
         self.selector.WRITE_BATCH_SIZE = result_cnt
         self.selector._create_destination_table = MagicMock()
         self.selector._read_rows = MagicMock()
-        self.selector._write_rows = MagicMock(side_effect=[2, 0])
+        self.selector._write_rows = MagicMock(side_effect=[2])
 
         # Mock values list. Important that returned length is the same as length of input generator x.
         self.selector._values_list = lambda x, y: [[] for _ in x]
@@ -75,11 +81,129 @@ class TestSelector(TestCase):
         result = self.selector.select()
 
         self.assertEqual(result_cnt, result)
-        self.assertEqual(2, self.selector._write_rows.call_count)
+        # No empty chunk is written
+        self.assertEqual(1, self.selector._write_rows.call_count)
         mock_logger.info.assert_called_once()
 
+    @patch("gobbagextract.selector._selector.logger")
+    def test_select_streams_source_once(self, mock_logger):
+        result_cnt = 10
+        self.selector.WRITE_BATCH_SIZE = 3
+        written = []
+        self.selector._write_rows = lambda table, values, columns: written.append(values) or len(values)
+
+        def read_rows(query):
+            # Fresh generator on every call, as the datastore query does
+            return ({"col_a": str(i), "col_b": i} for i in range(result_cnt))
+
+        self.selector._read_rows = MagicMock(side_effect=read_rows)
+
+        self.assertEqual(result_cnt, self.selector.select())
+        self.selector._read_rows.assert_called_once_with(self.selector.query)
+        self.assertEqual([(str(i), i) for i in range(result_cnt)], [row for chunk in written for row in chunk])
+        self.assertEqual([3, 3, 3, 1], [len(chunk) for chunk in written])
+        self.assertEqual(4, len(self.selector.chunk_stats))
+
+    @patch("gobbagextract.selector._selector.logger")
+    def test_select_read_error(self, mock_logger):
+        self.selector._read_rows = MagicMock(return_value=iter([{"col_a": "a"}]))
+        self.selector._write_rows = MagicMock()
+
+        with self.assertRaisesRegex(GOBException, "Missing column col_b"):
+            self.selector.select()
+        self.selector._write_rows.assert_not_called()
+
+    @patch("gobbagextract.selector._selector.logger")
+    def test_select_write_error(self, mock_logger):
+        self.selector.WRITE_BATCH_SIZE = 1
+        self.selector.QUEUE_SIZE = 1
+        read = []
+
+        def read_rows(query):
+            for i in range(100):
+                read.append(i)
+                yield {"col_a": str(i), "col_b": i}
+
+        self.selector._read_rows = read_rows
+        self.selector._write_rows = MagicMock(side_effect=GOBException("write failed"))
+
+        with self.assertRaisesRegex(GOBException, "write failed"):
+            self.selector.select()
+
+        # Reading stopped shortly after the write failed
+        self.assertLess(len(read), 10)
+        mock_logger.info.assert_not_called()
+
+    @patch("gobbagextract.selector._selector.logger")
+    def test_select_adaptive(self, mock_logger):
+        self.selector.ADAPTIVE_BATCH_SIZE = True
+        self.selector.WRITE_BATCH_SIZE = 4
+        self.selector.WRITE_BATCH_MIN_SIZE = 2
+        self.selector.WRITE_BATCH_MAX_SIZE = 10
+        self.selector.WRITE_BATCH_MAX_BYTES = 1000
+        self.selector.WRITE_BATCH_MIN_TIME = 1.0
+        self.selector.WRITE_BATCH_MAX_TIME = 2.0
+        self.selector.QUEUE_SIZE = 1
+        written = []
+        self.selector._write_rows = lambda table, values, columns: written.append(values) or len(values)
+        self.selector._read_rows = lambda query: ({"col_a": str(i), "col_b": i} for i in range(30))
+
+        # Fast writes, the batch size grows up to the maximum. How far the reader reads ahead depends on timing
+        self.assertEqual(30, self.selector.select())
+        sizes = [stats.batch_size for stats in self.selector.chunk_stats]
+        self.assertEqual(4, sizes[0])
+        self.assertEqual(sorted(sizes), sizes)
+        self.assertGreater(sizes[-1], 4)
+        self.assertLessEqual(sizes[-1], 10)
+        self.assertTrue(all(len(chunk) <= size for chunk, size in zip(written, sizes)))
+        self.assertEqual({"min": 4, "max": sizes[-1], "last": sizes[-1]}, self.selector.batch_sizes())
+        self.assertEqual([sum(len(row[0]) + 8 for row in chunk) for chunk in written],
+                         [stats.bytes for stats in self.selector.chunk_stats])
+
+    def test_put(self):
+        chunks = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        Selector._put(chunks, "a", stop)
+        self.assertEqual("a", chunks.get_nowait())
+
+        # Full queue, gives up when stopped
+        chunks.put("b")
+        threading.Timer(0.2, stop.set).start()
+        Selector._put(chunks, "c", stop)
+        self.assertEqual("b", chunks.get_nowait())
+        self.assertTrue(chunks.empty())
+
+    @patch("gobbagextract.selector._selector.logger")
+    def test_log_stats(self, mock_logger):
+        self.selector.chunk_stats = [ChunkStats(10, 2.0, 1.0, 0, 1000, 10), ChunkStats(5, 1.0, 0.5, 2, 500, 20)]
+        self.selector._log_stats("table", 3.5)
+
+        mock_logger.info.assert_called_with(
+            "Written 15 rows in 2 chunks to destination table table. "
+            "Read 3.0s, write 1.5s, total 3.5s, average queue depth 1.0 of 2, batch size 10 - 20 rows",
+            kwargs={"data": {
+                "rows": 15,
+                "read_time": 3.0,
+                "write_time": 1.5,
+                "wall_time": 3.5,
+                "avg_queue_depth": 1.0,
+                "batch_sizes": {"min": 10, "max": 20, "last": 20},
+                "chunks": [
+                    {"rows": 10, "read_time": 2.0, "write_time": 1.0, "queue_depth": 0, "bytes": 1000,
+                     "batch_size": 10},
+                    {"rows": 5, "read_time": 1.0, "write_time": 0.5, "queue_depth": 2, "bytes": 500,
+                     "batch_size": 20},
+                ],
+            }}
+        )
+
+        # No chunks
+        self.selector.chunk_stats = []
+        self.selector._log_stats("table", 0.1)
+        self.assertEqual(0, mock_logger.info.call_args.kwargs["kwargs"]["data"]["avg_queue_depth"])
+
     def test_values_list(self):
-        self.selector._prepare_row = lambda x, y: x  # return rowvals as is
         rows = [
             {"col_a": 8, "col_b": 2, "col_c": 7},
             {"col_b": 2, "col_c": 5, "col_a": 0},
@@ -94,15 +218,14 @@ class TestSelector(TestCase):
 
         # Expect values of "rows" in the order of "cols"
         expected_result = [
-            [8, 2, 7],
-            [0, 2, 5],
-            [6, 4, 2],
-            [4, 2, 8]
+            (8, 2, 7),
+            (0, 2, 5),
+            (6, 4, 2),
+            (4, 2, 8)
         ]
         self.assertEqual(expected_result, list(self.selector._process_values(rows, cols)))
 
     def test_values_list_missing_column_exception(self):
-        self.selector._prepare_row = lambda x, y: x  # return rowvals as is
         rows = [
             {"col_a": 8, "col_b": 2, "col_c": 7},
             {"col_b": 2, "col_c": 5, "col_a": 0},
@@ -115,7 +238,7 @@ class TestSelector(TestCase):
             {"name": "col_c"}
         ]
 
-        with self.assertRaisesRegex(GOBException, "Missing column"):
+        with self.assertRaisesRegex(GOBException, "Missing column col_a in query result"):
             list(self.selector._process_values(rows, cols))
 
     def test_values_list_missing_column_allowed(self):
@@ -135,9 +258,19 @@ class TestSelector(TestCase):
 
         # Expect values of "rows" in the order of "cols" with missing values set to None
         expected_result = [
-            [8, 2, 7],
-            [0, 2, 5],
-            [None, 4, 2],
-            [4, 2, None]
+            (8, 2, 7),
+            (0, 2, 5),
+            (None, 4, 2),
+            (4, 2, None)
         ]
         self.assertEqual(expected_result, list(self.selector._process_values(rows, cols)))
+
+    def test_values_list_single_column(self):
+        rows = [{"col_a": 8, "col_b": 2}, {"col_b": 2}]
+        cols = [{"name": "COL_A"}]
+
+        with self.assertRaisesRegex(GOBException, "Missing column col_a in query result"):
+            list(self.selector._process_values(rows, cols))
+
+        self.selector.ignore_missing = True
+        self.assertEqual([(8,), (None,)], list(self.selector._process_values(rows, cols)))
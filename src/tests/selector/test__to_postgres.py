@@ -1,6 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
+from gobbagextract.datastore.serializer import dumps
 from gobbagextract.selector._to_postgres import ToPostgresSelector
 
 
@@ -33,14 +34,8 @@ class TestToPostgresSelector(TestCase):
         self.selector._dst_datastore = MagicMock()
 
     @patch("gobbagextract.selector._to_postgres.Json")
-    def test_prepare_row(self, mock_json):
-        row = [
-            {"key": "value"},
-            {"key": "value"},
-            {"key": "value"},
-            {"key": "value"},
-            {"key": "value"},
-        ]
+    def test_row_adapter(self, mock_json):
+        row = tuple({"key": "value"} for _ in range(5))
         columns = [
             {"type": "SOME_INNOCENT_TYPE"},
             {"type": "JSONB"},
@@ -49,18 +44,32 @@ class TestToPostgresSelector(TestCase):
             {"type": "JSON"},
         ]
 
-        result = self.selector._prepare_row(row, columns)
+        result = self.selector._row_adapter(columns)(row)
         # Rows 1 and 4 should be replaced with return value
-        row[1] = row[4] = mock_json.return_value
-        self.assertEqual(row, result)
+        expected = list(row)
+        expected[1] = expected[4] = mock_json.return_value
+        self.assertEqual(expected, result)
+        mock_json.assert_called_with({"key": "value"}, dumps=dumps)
+
+        # No JSON columns
+        self.assertIsNone(self.selector._row_adapter([{"type": "SOME_INNOCENT_TYPE"}]))
 
     def test_write_rows(self):
         table = "some_table"
-        values = [[2, 4, 5], [2, 2, 0], [4, 4, 3]]
+        values = iter([(2, 4, 5), (2, 2, 0), (4, 4, 3)])
         columns = [
             {"type": "typ1", "name": "naam1"},
             {"type": "typ2", "name": "naam2"},
             {"type": "typ3", "name": "naam3"}
         ]
         self.selector._write_rows(table, values, columns)
-        self.selector._dst_datastore.write_rows.assert_called_with(table, values, columns=["naam1", "naam2", "naam3"])
+        self.selector._dst_datastore.write_rows.assert_called_with(
+            table, [(2, 4, 5), (2, 2, 0), (4, 4, 3)], columns=["naam1", "naam2", "naam3"])
+
+    @patch("gobbagextract.selector._to_postgres.Json")
+    def test_write_rows_json(self, mock_json):
+        values = [("id", {"key": "value"})]
+        columns = [{"type": "VARCHAR", "name": "object_id"}, {"type": "JSONB", "name": "object"}]
+        self.selector._write_rows("some_table", values, columns)
+        self.selector._dst_datastore.write_rows.assert_called_with(
+            "some_table", [["id", mock_json.return_value]], columns=["object_id", "object"])
@@ -24,8 +24,10 @@ class TestHandleBagExtract:
         with (
             mock.patch("gobbagextract.__main__.logger") as p,
             mock.patch("gobbagextract.selector._selector.logger"),
-            mock.patch("gobbagextract.prepare.prepare_client.logger")
+            mock.patch("gobbagextract.prepare.prepare_client.logger") as prepare_logger
         ):
+            # The summary is published with the import, see _notify_import
+            prepare_logger.get_summary.return_value = {}
             yield p
 
     @pytest.fixture
@@ -7,7 +7,7 @@ from freezegun import freeze_time
 
 from gobbagextract.__main__ import \
     SERVICEDEFINITION, handle_bag_extract_message, NothingToDo, _handle_mutation_import, \
-    _log_no_more_left, _validate_message
+    _log_no_more_left, _validate_message, _notify_import
 from gobbagextract.config import BAGEXTRACT_NOT_AVAIL_DAYS_ERROR, BAGEXTRACT_NOT_AVAIL_DAYS_WARNING
 from gobbagextract.database.model import MutationImport
 from gobcore.enum import ImportMode
@@ -113,7 +113,34 @@ class TestMain(TestCase):
         mock_repo.return_value.get_last.assert_called_with("CAT", "ENT", "APP NAME")
         mock_repo.return_value.save.assert_called_with(mocked_next_import)
 
-        mock_client.assert_called_with(self.mock_msg, updated_dataset, ImportMode.MUTATIONS, date)
+        mock_client.assert_called_with(self.mock_msg, updated_dataset, ImportMode.MUTATIONS, date, data_src=None,
+                                       mutation_import_id=42)
+        mock_repo.return_value.notify.assert_called_once()
+
+    @patch("gobbagextract.__main__.PrepareClient")
+    @patch("gobbagextract.__main__.DatabaseSession")
+    @patch("gobbagextract.__main__.MutationImportRepository")
+    @patch("gobbagextract.__main__.logger")
+    def test_handle_import_msg_mutations_prefetch(self, mock_logger, mock_repo, mock_session, mock_client):
+        dataset = {
+            "catalogue": "CAT",
+            "entity": "ENT",
+            "source": {"application": "APP NAME"},
+        }
+        mock_mutations_handler = Mock()
+        mocked_next_import = MutationImport(mode=ImportMode.FULL.value)
+        date = datetime.now().date()
+        mock_mutations_handler.get_next_import.return_value = (mocked_next_import, dataset, date)
+        prefetcher = Mock()
+
+        _handle_mutation_import(self.mock_msg, dataset, mock_mutations_handler, prefetcher)
+
+        prefetcher.get.assert_called_with(mocked_next_import)
+        prefetcher.start.assert_called_with(mocked_next_import)
+        mock_client.assert_called_with(
+            self.mock_msg, dataset, ImportMode.FULL, date, data_src=prefetcher.get.return_value,
+            mutation_import_id=None
+        )
 
     @patch("gobbagextract.__main__.DatabaseSession")
     @patch("gobbagextract.__main__.MutationImportRepository")
@@ -161,3 +188,27 @@ class TestMain(TestCase):
         _log_no_more_left(last_import)
         mock_logger.warning.assert_called_once()
         mock_logger.error.assert_not_called()
+
+    def test_notify_import(self):
+        repo = Mock()
+        mutation_import = MutationImport(id=42, catalogue="bag", collection="panden", filename="BAGGEM0457L.zip",
+                                         mode=ImportMode.MUTATIONS.value)
+        summary = {"num_records": 10, "inserted": 2, "updated": 3, "unchanged": 5, "warnings": []}
+
+        _notify_import(repo, mutation_import, summary)
+        repo.notify.assert_called_with("bag_extract", {
+            "event": "import",
+            "table": "bag_panden",
+            "mutation_import_id": 42,
+            "filename": "BAGGEM0457L.zip",
+            "mode": ImportMode.MUTATIONS.value,
+            "num_records": 10,
+            "inserted": 2,
+            "updated": 3,
+            "unchanged": 5,
+        })
+
+        repo.reset_mock()
+        with patch("gobbagextract.__main__.BAGEXTRACT_NOTIFY_CHANNEL", ""):
+            _notify_import(repo, mutation_import, summary)
+        repo.notify.assert_not_called()
@@ -0,0 +1,73 @@
+"""Compares storing the bag objects as JSON and as JSONB with an expression index.
+
+Copies the objects of a bag table into a temporary JSON table and a temporary JSONB table, and reports the time to
+load each table and to query them on an attribute of the object.
+
+Usage: python utils/benchmark_jsonb.py [table] [key]
+e.g.: python utils/benchmark_jsonb.py bag_verblijfsobjecten status
+"""
+import io
+import sys
+import time
+
+import psycopg2
+
+from gobbagextract.config import DATABASE_CONFIG
+
+REPEAT = 20
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def load(cursor, table: str, data: bytes):
+    cursor.copy_expert(f"COPY {table} (object) FROM STDIN", io.BytesIO(data))
+
+
+def query(cursor, table: str, key: str, value: str) -> int:
+    for _ in range(REPEAT):
+        cursor.execute(f"SELECT count(*) FROM {table} WHERE object->>%s = %s", (key, value))
+    return cursor.fetchone()[0]
+
+
+def main(source: str = "bag_verblijfsobjecten", key: str = "status"):
+    connection = psycopg2.connect(
+        user=DATABASE_CONFIG["username"],
+        password=DATABASE_CONFIG["password"],
+        host=DATABASE_CONFIG["host"],
+        port=DATABASE_CONFIG["port"],
+        dbname=DATABASE_CONFIG["database"],
+    )
+
+    with connection.cursor() as cursor:
+        data = io.BytesIO()
+        cursor.copy_expert(f"COPY (SELECT object::text FROM {source}) TO STDOUT", data)
+        data = data.getvalue()
+
+        # The least common value, as a selective filter
+        cursor.execute(f"SELECT object->>%s, count(*) FROM {source} GROUP BY 1 ORDER BY 2 LIMIT 1", (key,))
+        value, _ = cursor.fetchone()
+
+        for type_ in ("json", "jsonb"):
+            table = f"benchmark_{type_}"
+            cursor.execute(f"CREATE TEMPORARY TABLE {table} (object {type_})")
+
+            load_time, _ = timed(load, cursor, table, data)
+            index_time = 0.0
+            if type_ == "jsonb":
+                index_time, _ = timed(cursor.execute, f"CREATE INDEX ON {table} ((object->>'{key}'))")
+            cursor.execute(f"ANALYZE {table}")
+
+            query_time, count = timed(query, cursor, table, key, value)
+            print(f"{type_:5}: load {load_time:.3f}s, index {index_time:.3f}s, "
+                  f"query {query_time / REPEAT * 1000:.2f}ms ({count:,} rows with {key} = {value!r})")
+
+    connection.rollback()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,46 @@
+"""Prints the notifications that are published while importing BAG extracts.
+
+Committed batches and finished imports are published with NOTIFY on BAGEXTRACT_NOTIFY_CHANNEL, this script listens
+on that channel and prints the JSON payloads. Stop with Ctrl-C.
+
+Usage: python utils/listen_notify.py
+"""
+import select
+
+import psycopg2
+
+from gobbagextract.config import DATABASE_CONFIG, BAGEXTRACT_NOTIFY_CHANNEL
+
+TIMEOUT = 60
+
+
+def main():
+    connection = psycopg2.connect(
+        user=DATABASE_CONFIG["username"],
+        password=DATABASE_CONFIG["password"],
+        host=DATABASE_CONFIG["host"],
+        port=DATABASE_CONFIG["port"],
+        dbname=DATABASE_CONFIG["database"],
+    )
+    connection.autocommit = True
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {BAGEXTRACT_NOTIFY_CHANNEL}")
+    print(f"Listening on {BAGEXTRACT_NOTIFY_CHANNEL}")
+
+    try:
+        while True:
+            if select.select([connection], [], [], TIMEOUT) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                print(notify.payload)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()